@@ -0,0 +1,326 @@
+from datetime import date
+import heapq
+import json
+
+from flask import Blueprint, Response, jsonify, request, send_file, stream_with_context, url_for
+from sqlalchemy import select, union_all
+from models import Categoria, Funcionario, Movimentacao, MovimentacaoArquivada, Produto, RecursoIndisponivel, db_leitura
+from paginacao import Ordenacao, chave_intercalacao, clausulas_ordem, paginar
+from fechamentos import estoque_em
+from arquivamento import alcanca_arquivo, consulta_arquivada, no_arquivo, so_no_arquivo
+from tarefas import ErroTarefa, TERMINADAS, arquivo_pronto, cancelar, enviar, listar as consultar_tarefas, obter
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+LIMITE_PADRAO = 50
+LIMITE_MAXIMO = 500
+LOTE_STREAMING = 1000
+LIMITE_BUSCA = 20
+
+
+class ErroConsulta(ValueError):
+    pass
+
+
+def _data(nome):
+    valor = request.args.get(nome)
+    try:
+        return date.fromisoformat(valor) if valor else None
+    except ValueError:
+        raise ErroConsulta(f"Parâmetro '{nome}' deve estar no formato AAAA-MM-DD.")
+
+
+def _inteiro(nome):
+    valor = request.args.get(nome)
+    try:
+        return int(valor) if valor else None
+    except ValueError:
+        raise ErroConsulta(f"Parâmetro '{nome}' deve ser inteiro.")
+
+
+def _prefixo(coluna, valor):
+    # Intervalo [valor, valor + U+FFFF) aproveita o índice da coluna, ao contrário de LIKE
+    return (coluna >= valor) & (coluna < valor + '\uffff')
+
+
+def _filtros_funcionarios():
+    filtros = []
+    if request.args.get('nome'):
+        filtros.append(_prefixo(Funcionario.nome_funcionario, request.args['nome']))
+    if request.args.get('email'):
+        filtros.append(Funcionario.email == request.args['email'])
+    if request.args.get('cpf'):
+        filtros.append(Funcionario.cpf == request.args['cpf'])
+    return filtros
+
+
+def _filtros_produtos():
+    filtros = []
+    if request.args.get('nome'):
+        filtros.append(_prefixo(Produto.nome_produto, request.args['nome']))
+    id_categoria = _inteiro('id_categoria')
+    if id_categoria is not None:
+        filtros.append(Produto.id_categoria == id_categoria)
+    return filtros
+
+
+def _filtros_categorias():
+    if request.args.get('nome'):
+        return [_prefixo(Categoria.nome_categoria, request.args['nome'])]
+    return []
+
+
+def _filtros_movimentacoes(m=Movimentacao):
+    filtros = []
+    for nome, coluna in [('id_produto', m.id_produto), ('id_funcionario', m.id_funcionario)]:
+        valor = _inteiro(nome)
+        if valor is not None:
+            filtros.append(coluna == valor)
+    if request.args.get('status'):
+        filtros.append(m.status == request.args['status'])
+    de, ate = _data('de'), _data('ate')
+    if de:
+        filtros.append(m.data_da_movimentacao >= de)
+    if ate:
+        filtros.append(m.data_da_movimentacao <= ate)
+    return filtros
+
+
+# recurso: (modelo, método de serialização, filtros, ordens aceitas)
+RECURSOS = {
+    'funcionarios': (Funcionario, 'serialize_funcionario', _filtros_funcionarios, {
+        'id': Ordenacao(None, Funcionario.id_funcionario, False),
+        'nome': Ordenacao(Funcionario.nome_funcionario, Funcionario.id_funcionario, False),
+    }),
+    'produtos': (Produto, 'serialize_produto', _filtros_produtos, {
+        'id': Ordenacao(None, Produto.id_produto, False),
+        'nome': Ordenacao(Produto.nome_produto, Produto.id_produto, False),
+    }),
+    'categorias': (Categoria, 'serialize_categoria', _filtros_categorias, {
+        'id': Ordenacao(None, Categoria.id_categoria, False),
+        'nome': Ordenacao(Categoria.nome_categoria, Categoria.id_categoria, False),
+    }),
+    'movimentacoes': (Movimentacao, 'serialize_movimentacao', _filtros_movimentacoes, {
+        'id': Ordenacao(None, Movimentacao.id_movimentacao, False),
+        'data': Ordenacao(Movimentacao.data_da_movimentacao, Movimentacao.id_movimentacao, False),
+        'valor': Ordenacao(Movimentacao.valor_movimentacao, Movimentacao.id_movimentacao, False),
+    }),
+}
+
+
+def _complemento(recurso, ordenacao):
+    # Movimentações com ?de= antes do corte (ou sem ?de=) juntam as arquivadas
+    if recurso != 'movimentacoes' or not alcanca_arquivo(_data('de')):
+        return None
+    stmt = select(MovimentacaoArquivada).where(*_filtros_movimentacoes(MovimentacaoArquivada), so_no_arquivo())
+    return consulta_arquivada(stmt), no_arquivo(ordenacao)
+
+
+def _ordenacao(ordens):
+    # ?ordem=nome ou ?ordem=-nome (decrescente)
+    ordem = request.args.get('ordem', 'id')
+    descendente = ordem.startswith('-')
+    ordenacao = ordens.get(ordem.lstrip('-'))
+    if ordenacao is None:
+        raise ErroConsulta(f"Ordem inválida. Use uma de: {', '.join(ordens)} (prefixo '-' para decrescente).")
+    return ordenacao._replace(descendente=descendente)
+
+
+def _serializador(metodo):
+    campos = [campo for campo in request.args.get('campos', '').split(',') if campo]
+
+    def serializar(objeto):
+        dados = getattr(objeto, metodo)()
+        return {campo: dados[campo] for campo in campos if campo in dados} if campos else dados
+    return serializar
+
+
+def _quer_ndjson():
+    return request.args.get('formato') == 'ndjson' or request.accept_mimetypes.best == 'application/x-ndjson'
+
+
+def _streaming(stmt, serializar, ordenacao, complemento=None):
+    # yield_per busca e serializa em lotes: memória constante mesmo no dump completo
+    def ler(stmt, ordenacao):
+        return db_leitura.execute(stmt.order_by(*clausulas_ordem(ordenacao, ordenacao.descendente))
+                                  .execution_options(yield_per=LOTE_STREAMING)).scalars()
+
+    def gerar():
+        objetos = ler(stmt, ordenacao)
+        if complemento is not None:
+            # As duas fontes já vêm ordenadas: intercala sem juntar tudo na memória
+            chave = (ordenacao.chave if ordenacao.chave is not None else ordenacao.id_coluna).key
+            id_coluna = ordenacao.id_coluna.key
+            objetos = heapq.merge(objetos, ler(*complemento), reverse=ordenacao.descendente,
+                                  key=lambda objeto: chave_intercalacao(getattr(objeto, chave),
+                                                                         getattr(objeto, id_coluna)))
+        for objeto in objetos:
+            yield json.dumps(serializar(objeto), ensure_ascii=False) + '\n'
+    return Response(stream_with_context(gerar()), mimetype='application/x-ndjson')
+
+
+@api.errorhandler(ErroConsulta)
+def erro_consulta(erro):
+    return jsonify({'erro': str(erro)}), 400
+
+
+@api.errorhandler(RecursoIndisponivel)
+def recurso_indisponivel(erro):
+    return jsonify({'erro': str(erro)}), 503
+
+
+@api.route('/<recurso>', methods=['GET'])
+def listar(recurso):
+    if recurso not in RECURSOS:
+        return jsonify({'erro': f"Recurso '{recurso}' não existe."}), 404
+    modelo, metodo, filtros, ordens = RECURSOS[recurso]
+    ordenacao = _ordenacao(ordens)
+    stmt = select(modelo).where(*filtros())
+    complemento = _complemento(recurso, ordenacao)
+    serializar = _serializador(metodo)
+
+    if _quer_ndjson():
+        return _streaming(stmt, serializar, ordenacao, complemento)
+
+    limite = max(1, min(_inteiro('limite') or LIMITE_PADRAO, LIMITE_MAXIMO))
+    pagina = paginar(db_leitura, stmt, ordenacao, limite,
+                     apos=request.args.get('apos'),
+                     antes=request.args.get('antes'),
+                     complemento=complemento)
+    return jsonify({
+        'dados': [serializar(objeto) for objeto in pagina.itens],
+        'proximo': pagina.proximo,
+        'anterior': pagina.anterior,
+    })
+
+
+@api.route('/<recurso>/<int:id_objeto>', methods=['GET'])
+def detalhar(recurso, id_objeto):
+    if recurso not in RECURSOS:
+        return jsonify({'erro': f"Recurso '{recurso}' não existe."}), 404
+    modelo, metodo, _, _ = RECURSOS[recurso]
+    objeto = db_leitura.get(modelo, id_objeto)
+    if objeto is None and recurso == 'movimentacoes' and alcanca_arquivo():
+        objeto = db_leitura.get(MovimentacaoArquivada, id_objeto, execution_options={'arquivo': True})
+    if objeto is None:
+        return jsonify({'erro': 'Registro não encontrado.'}), 404
+    return jsonify(_serializador(metodo)(objeto))
+
+
+def _busca_prefixo(colunas, coluna, id_coluna, termo, limite):
+    # O índice é sensível a maiúsculas: busca o termo como digitado e capitalizado. Um SELECT por
+    # variante num UNION ALL ordenado: o SQLite intercala as duas faixas lidas em ordem pelo índice
+    # e para no limite (um OR das faixas ordenaria todas as ocorrências numa B-tree temporária).
+    variantes = sorted({termo, termo[:1].upper() + termo[1:]})
+    consultas = [select(*colunas).where(_prefixo(coluna, variante)) for variante in variantes]
+    consulta = union_all(*consultas) if len(consultas) > 1 else consultas[0]
+    return consulta.order_by(consulta.selected_columns[coluna.key],
+                             consulta.selected_columns[id_coluna.key]).limit(limite)
+
+
+@api.route('/busca/funcionarios', methods=['GET'])
+def buscar_funcionarios():
+    termo = request.args.get('q', '').strip()
+    if not termo:
+        return jsonify([])
+    limite = max(1, min(_inteiro('limite') or LIMITE_BUSCA, LIMITE_BUSCA))
+    linhas = db_leitura.execute(_busca_prefixo(
+        [Funcionario.id_funcionario, Funcionario.nome_funcionario, Funcionario.sobrenome],
+        Funcionario.nome_funcionario, Funcionario.id_funcionario, termo, limite)).all()
+    return jsonify([{'id': id_funcionario, 'label': f'{nome} {sobrenome} (#{id_funcionario})'}
+                    for id_funcionario, nome, sobrenome in linhas])
+
+
+@api.route('/busca/produtos', methods=['GET'])
+def buscar_produtos():
+    termo = request.args.get('q', '').strip()
+    if not termo:
+        return jsonify([])
+    limite = max(1, min(_inteiro('limite') or LIMITE_BUSCA, LIMITE_BUSCA))
+    linhas = db_leitura.execute(_busca_prefixo(
+        [Produto.id_produto, Produto.nome_produto, Produto.qtd],
+        Produto.nome_produto, Produto.id_produto, termo, limite)).all()
+    return jsonify([{'id': id_produto, 'label': f'{nome} (#{id_produto})', 'qtd': qtd}
+                    for id_produto, nome, qtd in linhas])
+
+
+@api.route('/estoque', methods=['GET'])
+def estoque_na_data():
+    # ?data=AAAA-MM-DD (padrão: hoje), pelo fechamento mensal mais próximo e as movimentações seguintes
+    data = _data('data') or date.today()
+    id_produto = _inteiro('id_produto')
+    stmt = select(Produto)
+    if id_produto is not None:
+        stmt = stmt.where(Produto.id_produto == id_produto)
+    limite = max(1, min(_inteiro('limite') or LIMITE_PADRAO, LIMITE_MAXIMO))
+    pagina = paginar(db_leitura, stmt, Ordenacao(None, Produto.id_produto, False), limite,
+                     apos=request.args.get('apos'),
+                     antes=request.args.get('antes'))
+    quantidades = estoque_em(data, [produto.id_produto for produto in pagina.itens])
+    return jsonify({
+        'data': data.isoformat(),
+        'dados': [{'id_produto': produto.id_produto, 'nome_produto': produto.nome_produto,
+                   'quantidade': quantidades.get(produto.id_produto, 0)} for produto in pagina.itens],
+        'proximo': pagina.proximo,
+        'anterior': pagina.anterior,
+    })
+
+
+@api.errorhandler(ErroTarefa)
+def erro_tarefa(erro):
+    return jsonify({'erro': str(erro)}), 400
+
+
+def _tarefa_json(tarefa, status=200):
+    resposta = jsonify(tarefa.serialize_tarefa())
+    resposta.status_code = status
+    resposta.headers['Location'] = url_for('api.detalhar_tarefa', id_tarefa=tarefa.id_tarefa)
+    return resposta
+
+
+@api.route('/tarefas', methods=['POST'])
+def enviar_tarefa():
+    # {"tipo": "exportacao", "parametros": {...}}: responde 202 com o id, sem esperar a execução
+    corpo = request.get_json(silent=True) or {}
+    parametros = corpo.get('parametros') or {}
+    if not isinstance(parametros, dict):
+        raise ErroTarefa("'parametros' deve ser um objeto.")
+    id_tarefa = enviar(corpo.get('tipo'), parametros)
+    return _tarefa_json(obter(id_tarefa), 202)
+
+
+@api.route('/tarefas', methods=['GET'])
+def listar_tarefas():
+    limite = max(1, min(_inteiro('limite') or LIMITE_PADRAO, LIMITE_MAXIMO))
+    return jsonify({'dados': [tarefa.serialize_tarefa() for tarefa in
+                              consultar_tarefas(limite, request.args.get('estado'), request.args.get('tipo'))]})
+
+
+@api.route('/tarefas/<int:id_tarefa>', methods=['GET'])
+def detalhar_tarefa(id_tarefa):
+    tarefa = obter(id_tarefa)
+    if tarefa is None:
+        return jsonify({'erro': 'Tarefa não encontrada.'}), 404
+    return _tarefa_json(tarefa)
+
+
+@api.route('/tarefas/<int:id_tarefa>', methods=['DELETE'])
+def cancelar_tarefa(id_tarefa):
+    # 202: pedido aceito, a tarefa termina como cancelada; 409: já terminou ou é uma manutenção
+    # em andamento, que não pode ser interrompida
+    if obter(id_tarefa) is None:
+        return jsonify({'erro': 'Tarefa não encontrada.'}), 404
+    cancelada = cancelar(id_tarefa)
+    return _tarefa_json(obter(id_tarefa), 202 if cancelada else 409)
+
+
+@api.route('/tarefas/<int:id_tarefa>/arquivo', methods=['GET'])
+def arquivo_tarefa(id_tarefa):
+    tarefa = obter(id_tarefa)
+    if tarefa is None:
+        return jsonify({'erro': 'Tarefa não encontrada.'}), 404
+    caminho = arquivo_pronto(tarefa)
+    if caminho is None:
+        motivo = 'ainda não terminou' if tarefa.estado not in TERMINADAS else 'não tem arquivo disponível'
+        return jsonify({'erro': f'A tarefa {motivo}.', 'estado': tarefa.estado}), 409
+    return send_file(caminho, as_attachment=True, download_name=tarefa.nome_download)
@@ -1,134 +1,278 @@
-from flask import Flask, render_template, redirect, url_for, request, flash, send_file
-from models import Funcionario, Movimentacao, Produto, Categoria, db_session
-from datetime import datetime
+from flask import Flask, render_template, redirect, url_for, request, flash, send_file, session, make_response, jsonify, \
+    Response
+from markupsafe import Markup, escape
+from werkzeug.http import is_resource_modified
+from models import Funcionario, Movimentacao, Produto, Categoria, db_leitura, db_session, engine, engine_leitura, \
+    MovimentacaoArquivada, RecursoIndisponivel, exigir_sqlite, init_db, remover_sessoes, unidade_de_trabalho
+from datetime import date, datetime, timezone
+from functools import lru_cache
 from sqlalchemy import select, func, extract
+from sqlalchemy.orm import contains_eager, joinedload
+import importlib.metadata
+import importlib.util
+import json
 import locale
 import os
-import plotly.express as px
-import plotly.io as pio
-import pandas as pd
-import io
-import base64
 from utils import produtos_por_mes_ano
-
-app = Flask(__name__)
-app.secret_key = os.urandom(24)
-# Configurar idioma para português
-# app.config['BABEL_DEFAULT_LOCALE'] = 'pt'
-locale.setlocale(locale.LC_TIME, 'pt_BR.UTF-8')  # Configura o idioma para português
-
-
-@app.route('/')
+from paginacao import Ordenacao, paginar
+from estoque import registrar_movimentacao
+from fechamentos import estoque_em
+from arquivamento import alcanca_arquivo, consulta_arquivada, no_arquivo, so_no_arquivo
+from importacao import importar_movimentacoes
+from api import api
+from busca import CONSULTAS, buscar
+from exportacao import consulta_exportacao, gerar_csv
+from tarefas import ErroTarefa, MANUTENCOES, TERMINADAS, arquivo_pronto, cancelar, cancelavel, enviar, listar as listar_tarefas, \
+    obter as obter_tarefa
+from contadores import contar
+from cache import CacheVersionado, estatisticas as estatisticas_cache
+from versoes import assinatura, versao
+from metricas import consultas_lentas, exportar as exportar_metricas, instrumentar, restrita
+from respostas import UM_ANO, instalar as instalar_respostas, pagina_condicional
+
+# Rotas registradas por @rota e instaladas em cada aplicação criada por criar_app()
+ROTAS = []
+
+
+def rota(regra, **opcoes):
+    def registrar(funcao):
+        ROTAS.append((regra, funcao, opcoes))
+        return funcao
+    return registrar
+
+
+def criar_app(configuracao=None):
+    app = Flask(__name__)
+    app.secret_key = os.urandom(24)
+    app.config.update(configuracao or {})
+    # Configurar idioma para português
+    # app.config['BABEL_DEFAULT_LOCALE'] = 'pt'
+    try:
+        locale.setlocale(locale.LC_TIME, 'pt_BR.UTF-8')  # Configura o idioma para português
+    except locale.Error:
+        pass  # Locale não instalado: mantém o padrão do sistema
+    # Cria as tabelas auxiliares (contadores) que ainda não existirem no banco
+    init_db()
+    # Fecha as sessões ao fim de cada requisição, com ou sem erro
+    app.teardown_appcontext(remover_sessoes)
+    app.register_blueprint(api)
+    app.register_error_handler(RecursoIndisponivel, recurso_indisponivel)
+    # Mesmo nome de endpoint que o @app.route daria: os url_for dos templates não mudam
+    for regra, funcao, opcoes in ROTAS:
+        app.add_url_rule(regra, view_func=funcao, **opcoes)
+    # Latência por rota, contagem/tempo de SQL e log de consultas lentas, expostos em /metrics
+    instrumentar(app, {'escrita': engine, 'leitura': engine_leitura})
+    # Compressão, URLs dos estáticos com hash do conteúdo e cache immutable
+    instalar_respostas(app)
+    return app
+
+
+def recurso_indisponivel(erro):
+    # Banco servidor: o que depende de gatilhos, FTS5 ou ATTACH do SQLite responde 503
+    return make_response(str(erro), 503)
+
+
+@rota('/')
 def home():
     return dashboard()
 
 
-@app.route('/dashboard', methods=['GET'])
-def dashboard():
-    produtos_por_pagina = 15
-    pagina_atual = int(request.args.get('pagina', 1))
-    offset = (pagina_atual - 1) * produtos_por_pagina
+# Cada bloco do dashboard é um fragmento HTML guardado sob a versão das tabelas de que depende
+cache_dashboard = CacheVersionado('dashboard')
+
 
-    # Obter total de produtos
-    total_produtos = db_session.query(func.sum(Produto.qtd)).scalar()
+def fragmento_metricas():
+    return render_template('fragmentos/dashboard_metricas.html',
+                           total_produtos=contar('estoque_total'),
+                           total_funcionarios=contar('funcionarios'))
 
-    # Obter total de funcionários
-    total_funcionarios = db_session.query(Funcionario).count()
 
+def fragmento_recentes():
     # Obter movimentações recentes
-    movimentacoes_recentes = (select(Movimentacao, Funcionario, Produto)
-                              .join(Funcionario, Funcionario.id_funcionario == Movimentacao.id_funcionario)
-                              .join(Produto, Produto.id_produto == Movimentacao.id_produto)
+    movimentacoes_recentes = (select(Movimentacao)
+                              .options(joinedload(Movimentacao.funcionario, innerjoin=True),
+                                       joinedload(Movimentacao.Produto, innerjoin=True))
                               .order_by(Movimentacao.data_da_movimentacao.desc())
                               .limit(5))
-    movimentacoes_recentes = db_session.execute(movimentacoes_recentes).fetchall()
+    movimentacoes_recentes = db_leitura.execute(movimentacoes_recentes).scalars().all()
 
     # Formatar datas no formato extenso
     movimentacoes_formatadas = []
-    for movimentacao, funcionario, produto in movimentacoes_recentes:
+    for movimentacao in movimentacoes_recentes:
         movimentacao.data_extenso = movimentacao.data_da_movimentacao.strftime('%d de %B de %Y')
-        movimentacoes_formatadas.append((movimentacao, funcionario, produto))
+        movimentacoes_formatadas.append(movimentacao)
+    return render_template('fragmentos/dashboard_recentes.html', movimentacoes_recentes=movimentacoes_formatadas)
 
+
+def fragmento_grafico():
     # Gráfico de produtos por mês/ano
-    produtos_por_mes = produtos_por_mes_ano()  # Presumindo que essa função já existe
-    meses, totais = zip(*[(resultado.mes_ano, resultado.total_produtos) for resultado in produtos_por_mes])
+    produtos_por_mes = produtos_por_mes_ano()
+    meses, totais = zip(*[(resultado.mes_ano, resultado.total_produtos) for resultado in produtos_por_mes]) \
+        if produtos_por_mes else ((), ())
+    return render_template('fragmentos/dashboard_grafico.html', meses=meses, totais=totais)
 
-    return render_template('dashboard.html',
-                           total_produtos=total_produtos,
-                           total_funcionarios=total_funcionarios,
-                           movimentacoes_recentes=movimentacoes_formatadas,
-                           meses=meses,
-                           totais=totais)
 
+# fragmento: (função que gera, tabelas de que depende)
+FRAGMENTOS_DASHBOARD = {
+    'metricas': (fragmento_metricas, ['produtos', 'funcionarios']),
+    'recentes': (fragmento_recentes, ['movimentacoes', 'funcionarios', 'produtos']),
+    'grafico': (fragmento_grafico, ['movimentacoes']),
+}
 
-@app.route('/produto/grafico', methods=['GET', 'POST'])
-def produto_grafico():
-    resultados = produtos_por_mes_ano()
-    meses, totais = zip(*[(resultado.mes_ano, resultado.total_produtos) for resultado in resultados])
 
-    # Verifica se um tipo de gráfico foi selecionado
+@rota('/dashboard', methods=['GET'])
+@pagina_condicional('produtos', 'funcionarios', 'movimentacoes')
+def dashboard():
+    # Com tudo em cache a página sai só com a leitura das versões dos dados
+    fragmentos = {}
+    for nome, (gerar, tabelas) in FRAGMENTOS_DASHBOARD.items():
+        try:
+            html, _ = cache_dashboard.obter(nome, assinatura(*tabelas), gerar)
+        except RecursoIndisponivel as erro:
+            html = f"<p>{escape(erro)}</p>"
+        fragmentos[nome] = Markup(html)
+    return render_template('dashboard.html', **fragmentos)
+
+
+TIPOS_GRAFICO = ['bar', 'line', 'pie', 'scatter', 'area']
+cache_grafico = CacheVersionado('grafico_produtos')
+
+
+@lru_cache(maxsize=1)
+def bundle_plotly():
+    # (versão, caminho) do plotly.min.js que acompanha o pacote plotly, sem importá-lo
+    especificacao = importlib.util.find_spec('plotly')
+    if especificacao is None:
+        return None
+    caminho = os.path.join(os.path.dirname(especificacao.origin), 'package_data', 'plotly.min.js')
+    return (importlib.metadata.version('plotly'), caminho) if os.path.exists(caminho) else None
+
+
+@rota('/vendor/plotly-<versao>.min.js', methods=['GET'])
+def plotly_js(versao):
+    # A URL muda com a versão do pacote: o navegador guarda o arquivo por um ano sem revalidar
+    bundle = bundle_plotly()
+    if bundle is None or bundle[0] != versao:
+        return make_response('', 404)
+    resposta = send_file(bundle[1], mimetype='text/javascript', max_age=UM_ANO, conditional=True)
+    resposta.cache_control.public = True
+    resposta.cache_control.immutable = True
+    return resposta
+
+
+def dados_grafico():
+    resultados = produtos_por_mes_ano()
+    return json.dumps({'meses': [resultado.mes_ano for resultado in resultados],
+                       'totais': [resultado.total_produtos for resultado in resultados]},
+                      ensure_ascii=False, separators=(',', ':'))
+
+
+@rota('/produto/grafico/dados', methods=['GET'])
+def produto_grafico_dados():
+    # A série só muda quando entra uma nova movimentação
+    exigir_sqlite('O gráfico de movimentações')
+    numero, alterado_em = versao('movimentacoes')
+    etag = str(numero)
+    ultima_modificacao = datetime.fromtimestamp(int(alterado_em), timezone.utc)
+    if not is_resource_modified(request.environ, etag=etag, last_modified=ultima_modificacao):
+        resposta = make_response('', 304)
+    else:
+        corpo, acerto = cache_grafico.obter('dados', numero, dados_grafico)
+        resposta = Response(corpo, mimetype='application/json')
+        resposta.headers['X-Cache'] = 'HIT' if acerto else 'MISS'
+
+    resposta.set_etag(etag)
+    resposta.last_modified = ultima_modificacao
+    resposta.cache_control.no_cache = True
+    return resposta
+
+
+@rota('/produto/grafico', methods=['GET', 'POST'])
+@pagina_condicional()
+def produto_grafico():
+    # A página só traz o seletor; o navegador busca a série em /produto/grafico/dados
+    # e redesenha ao trocar o tipo, sem voltar ao servidor
     tipo_grafico = request.args.get('tipo_grafico', 'bar')  # 'bar' é o padrão
+    if tipo_grafico not in TIPOS_GRAFICO:
+        tipo_grafico = 'bar'
+    bundle = bundle_plotly()
+    return render_template('grafico_produtos.html', tipo_grafico=tipo_grafico,
+                           plotly_js=url_for('plotly_js', versao=bundle[0]) if bundle else None)
+
+
+@rota('/busca', methods=['GET'])
+@pagina_condicional('produtos', 'funcionarios', 'categorias')
+def busca():
+    termo = request.args.get('q', '').strip()
+    tipo = request.args.get('tipo', 'produtos')
+    if tipo not in CONSULTAS:
+        tipo = 'produtos'
+    pagina_atual = max(1, request.args.get('pagina', 1, type=int))
+    resultados, tem_mais = buscar(tipo, termo, pagina_atual)
+    return render_template('busca.html',
+                           termo=termo,
+                           tipo=tipo,
+                           resultados=resultados,
+                           pagina_atual=pagina_atual,
+                           tem_mais=tem_mais)
+
+
+@rota('/cache/estatisticas', methods=['GET'])
+@restrita
+def cache_estatisticas():
+    return jsonify(estatisticas_cache())
+
+
+@rota('/metrics', methods=['GET'])
+@restrita
+def metrics():
+    return Response(exportar_metricas(), mimetype='text/plain; version=0.0.4')
+
+
+@rota('/metrics/lentas', methods=['GET'])
+@restrita
+def metrics_lentas():
+    return jsonify(consultas_lentas())
+
 
-    # Defina tamanhos maiores para os gráficos
-    largura = 1400  # Define a largura desejada
-    altura = 700  # Define a altura desejada
-
-    # Gerar o gráfico com base no tipo selecionado
-    if tipo_grafico == 'line':
-        fig = px.line(x=meses, y=totais, labels={'x': 'Mês/Ano', 'y': 'Total de Produtos'},
-                      title="Produtos por Mês/Ano", width=largura, height=altura)
-    elif tipo_grafico == 'pie':
-        fig = px.pie(names=meses, values=totais, title="Distribuição de Produtos por Mês/Ano",
-                     width=largura, height=altura)
-    elif tipo_grafico == 'scatter':
-        fig = px.scatter(x=meses, y=totais, labels={'x': 'Mês/Ano', 'y': 'Total de Produtos'},
-                         title="Dispersão de Produtos por Mês/Ano", width=largura, height=altura)
-    elif tipo_grafico == 'area':
-        fig = px.area(x=meses, y=totais, labels={'x': 'Mês/Ano', 'y': 'Total de Produtos'},
-                      title="Área de Produtos por Mês/Ano", width=largura, height=altura)
-    else:  # padrão para gráfico de barras
-        fig = px.bar(x=meses, y=totais, labels={'x': 'Mês/Ano', 'y': 'Total de Produtos'},
-                     title="Produtos por Mês/Ano", width=largura, height=altura)
-
-    graph_json = pio.to_html(fig, full_html=False)
-    return render_template('grafico_produtos.html', plot_html=graph_json)
-
-
-@app.route('/funcionario', methods=['GET'])
+ORDENS_FUNCIONARIO = {
+    'nome_asc': Ordenacao(Funcionario.nome_funcionario, Funcionario.id_funcionario, False),
+    'nome_desc': Ordenacao(Funcionario.nome_funcionario, Funcionario.id_funcionario, True),
+    'id_funcionario_asc': Ordenacao(None, Funcionario.id_funcionario, False),
+    'id_funcionario_desc': Ordenacao(None, Funcionario.id_funcionario, True),
+}
+
+
+# Itens por página de cada lista
+POR_PAGINA = {'funcionario': 15, 'produto': 10, 'movimentacao': 10, 'categoria': 5, 'estoque': 20}
+
+
+@rota('/funcionario', methods=['GET'])
+@pagina_condicional('funcionarios')
 def funcionario():
-    por_pagina = 15
-    pagina_atual = int(request.args.get('pagina', 1))
+    por_pagina = POR_PAGINA['funcionario']
+    pagina_atual = request.args.get('pagina', 1, type=int)
     ordem = request.args.get('ordem', 'id_funcionario_desc')
 
-    # Calcular o offset
-    offset = (pagina_atual - 1) * por_pagina
-
     # Determinar a ordem
-    if ordem == 'nome_asc':
-        order_by = Funcionario.nome_funcionario.asc()
-    elif ordem == 'nome_desc':
-        order_by = Funcionario.nome_funcionario.desc()
-    elif ordem == 'id_funcionario_asc':
-        order_by = Funcionario.id_funcionario.asc()
-    else:  # padrão
-        order_by = Funcionario.id_funcionario.desc()
-
-    # Selecionar os produtos com limite e offset
-    lista = (select(Funcionario).offset(offset).limit(por_pagina).order_by(order_by))
-    lista = db_session.execute(lista).scalars().all()
-
-    total_veterinarios = db_session.query(Funcionario).count()
-    total_paginas = (total_veterinarios + por_pagina - 1) // por_pagina
+    ordenacao = ORDENS_FUNCIONARIO.get(ordem, ORDENS_FUNCIONARIO['id_funcionario_desc'])
+
+    # Selecionar os funcionários pela página ou pelo cursor
+    pagina = paginar(db_leitura, select(Funcionario), ordenacao, por_pagina,
+                     pagina=pagina_atual,
+                     apos=request.args.get('apos'),
+                     antes=request.args.get('antes'))
 
     return render_template('funcionario.html',
-                           cavalo=lista,
-                           pagina_atual=pagina_atual,
-                           total_paginas=total_paginas,
+                           cavalo=pagina.itens,
+                           total_registros=contar('funcionarios'),
+                           proximo=pagina.proximo,
+                           anterior=pagina.anterior,
                            ordem=ordem
                            )
 
 
-@app.route('/novo_funcionario', methods=["POST", "GET"])
+@rota('/novo_funcionario', methods=["POST", "GET"])
 def novo_funcionario():
     if request.method == "POST":
         # Captura os valores dos campos do formulário
@@ -178,9 +322,11 @@ def novo_funcionario():
     return render_template('novo_funcionario.html')
 
 
-@app.route('/editar_funcionario/<int:id_funcionario>', methods=["GET", "POST"])
+@rota('/editar_funcionario/<int:id_funcionario>', methods=["GET", "POST"])
 def editar_funcionario(id_funcionario):
-    funcionario = db_session.query(Funcionario).filter(Funcionario.id_funcionario == id_funcionario).first()
+    # Só o POST grava; o GET usa a sessão de leitura
+    sessao = db_session if request.method == "POST" else db_leitura
+    funcionario = sessao.query(Funcionario).filter(Funcionario.id_funcionario == id_funcionario).first()
     if not funcionario:
         flash("Funcionário não encontrado.", "error")
         return redirect(url_for('funcionario'))
@@ -215,13 +361,13 @@ def editar_funcionario(id_funcionario):
         else:
             try:
                 # Atualiza os dados do funcionário
-                funcionario.nome_funcionario = nome_funcionario
-                funcionario.sobrenome = sobrenome
-                funcionario.email = email
-                funcionario.cpf = cpf
-                funcionario.telefone = telefone
+                with unidade_de_trabalho():
+                    funcionario.nome_funcionario = nome_funcionario
+                    funcionario.sobrenome = sobrenome
+                    funcionario.email = email
+                    funcionario.cpf = cpf
+                    funcionario.telefone = telefone
 
-                db_session.commit()
                 flash("Funcionário atualizado com sucesso!", "success")
                 return redirect(url_for('funcionario'))
             except ValueError:
@@ -230,43 +376,71 @@ def editar_funcionario(id_funcionario):
     return render_template('editar_funcionario.html', funcionario=funcionario)
 
 
-@app.route('/produto', methods=['GET'])
+ORDENS_PRODUTO = {
+    'nome_asc': Ordenacao(Produto.nome_produto, Produto.id_produto, False),
+    'nome_desc': Ordenacao(Produto.nome_produto, Produto.id_produto, True),
+    'id_produto_asc': Ordenacao(None, Produto.id_produto, False),
+    'id_produto_desc': Ordenacao(None, Produto.id_produto, True),
+}
+
+
+@rota('/produto', methods=['GET'])
+@pagina_condicional('produtos', 'categorias')
 def produto():
-    por_pagina = 10
-    pagina_atual = int(request.args.get('pagina', 1))
+    por_pagina = POR_PAGINA['produto']
+    pagina_atual = request.args.get('pagina', 1, type=int)
     ordem = request.args.get('ordem', 'id_produto_desc')
-    offset = (pagina_atual - 1) * por_pagina
 
     # Determinar a ordem
-    if ordem == 'nome_asc':
-        order_by = Produto.nome_produto.asc()
-    elif ordem == 'nome_desc':
-        order_by = Produto.nome_produto.desc()
-    elif ordem == 'id_produto_asc':
-        order_by = Produto.id_produto.asc()
-    else:  # padrão
-        order_by = Produto.id_produto.desc()
-
-    # Selecionar os produtos com limite e offset
-    lista = (select(Produto, Categoria)
-             .join(Categoria, Categoria.id_categoria == Produto.id_categoria)
-             .offset(offset).limit(por_pagina)
-             .order_by(order_by))
-    lista = db_session.execute(lista).fetchall()
-
-    total_veterinarios = db_session.query(Produto).count()
-    total_paginas = (total_veterinarios + por_pagina - 1) // por_pagina
+    ordenacao = ORDENS_PRODUTO.get(ordem, ORDENS_PRODUTO['id_produto_desc'])
+
+    # Selecionar os produtos pela página ou pelo cursor
+    # A categoria vem no mesmo JOIN (contains_eager): uma consulta por página
+    lista = (select(Produto)
+             .join(Produto.categoria)
+             .options(contains_eager(Produto.categoria)))
+    pagina = paginar(db_leitura, lista, ordenacao, por_pagina,
+                     pagina=pagina_atual,
+                     apos=request.args.get('apos'),
+                     antes=request.args.get('antes'))
 
     return render_template('produto.html',
-                           cavalo=lista,
-                           pagina_atual=pagina_atual,
-                           total_paginas=total_paginas,
+                           cavalo=pagina.itens,
+                           total_registros=contar('produtos'),
+                           proximo=pagina.proximo,
+                           anterior=pagina.anterior,
                            ordem=ordem)
 
 
-@app.route('/novo_produto', methods=["POST", "GET"])
+@rota('/produto/estoque', methods=['GET'])
+def estoque_data():
+    # Estoque de cada produto ao fim de um dia passado, pelos fechamentos mensais (fechamentos.py).
+    # Sem ETag de página: sem ?data= o conteúdo muda com a virada do dia, não só com os dados.
+    erro = None
+    try:
+        data = date.fromisoformat(request.args['data']) if request.args.get('data') else date.today()
+    except ValueError:
+        data, erro = date.today(), "Data inválida: use o formato AAAA-MM-DD."
+
+    lista = (select(Produto)
+             .join(Produto.categoria)
+             .options(contains_eager(Produto.categoria)))
+    pagina = paginar(db_leitura, lista, ORDENS_PRODUTO['nome_asc'], POR_PAGINA['estoque'],
+                     apos=request.args.get('apos'),
+                     antes=request.args.get('antes'))
+
+    return render_template('estoque_data.html',
+                           cavalo=pagina.itens,
+                           quantidades=estoque_em(data, [item.id_produto for item in pagina.itens]),
+                           data=data,
+                           erro=erro,
+                           proximo=pagina.proximo,
+                           anterior=pagina.anterior)
+
+
+@rota('/novo_produto', methods=["POST", "GET"])
 def novo_produto():
-    lista = db_session.execute(select(Categoria).order_by(Categoria.nome_categoria.asc())
+    lista = db_leitura.execute(select(Categoria).order_by(Categoria.nome_categoria.asc())
                                ).scalars().all()
     if request.method == "POST":
         # Captura os valores dos campos do formulário
@@ -311,9 +485,11 @@ def novo_produto():
     return render_template('novo_produto.html', cavalo=lista)
 
 
-@app.route('/editar_produto/<int:id_produto>', methods=["GET", "POST"])
+@rota('/editar_produto/<int:id_produto>', methods=["GET", "POST"])
 def editar_produto(id_produto):
-    produto = db_session.query(Produto).filter(Produto.id_produto == id_produto).first()
+    # Só o POST grava; o GET usa a sessão de leitura
+    sessao = db_session if request.method == "POST" else db_leitura
+    produto = sessao.query(Produto).filter(Produto.id_produto == id_produto).first()
     if not produto:
         flash("Produto não encontrado.", "error")
         return redirect(url_for('produto'))
@@ -345,70 +521,73 @@ def editar_produto(id_produto):
         else:
             try:
                 # Atualiza os dados do produto
-                produto.nome_produto = nome_produto
-                produto.preco_produto = float(preco_produto)
-                produto.id_categoria = int(id_categoria)
+                with unidade_de_trabalho():
+                    produto.nome_produto = nome_produto
+                    produto.preco_produto = float(preco_produto)
+                    produto.id_categoria = int(id_categoria)
 
-                db_session.commit()
                 flash("Produto atualizado com sucesso!", "success")
                 return redirect(url_for('produto'))
             except Exception as e:
                 flash(f"Ocorreu um erro ao editar o produto: {str(e)}", "error")
 
     # Carregar todas as categorias para exibição no formulário
-    categorias = db_session.query(Categoria).all()
+    categorias = db_leitura.query(Categoria).all()
     return render_template('editar_produto.html', produto=produto, categorias=categorias)
 
 
-@app.route('/movimentacao', methods=['GET'])
+ORDENS_MOVIMENTACAO = {
+    'nome_asc': Ordenacao(Produto.nome_produto, Movimentacao.id_movimentacao, False),
+    'nome_desc': Ordenacao(Produto.nome_produto, Movimentacao.id_movimentacao, True),
+    'preco_asc': Ordenacao(Movimentacao.valor_movimentacao, Movimentacao.id_movimentacao, False),
+    'preco_desc': Ordenacao(Movimentacao.valor_movimentacao, Movimentacao.id_movimentacao, True),
+    'data_asc': Ordenacao(Movimentacao.data_da_movimentacao, Movimentacao.id_movimentacao, False),
+    'data_desc': Ordenacao(Movimentacao.data_da_movimentacao, Movimentacao.id_movimentacao, True),
+    'id_movimentacao_asc': Ordenacao(None, Movimentacao.id_movimentacao, False),
+    'id_movimentacao_desc': Ordenacao(None, Movimentacao.id_movimentacao, True),
+}
+
+
+@rota('/movimentacao', methods=['GET'])
+@pagina_condicional('movimentacoes', 'funcionarios', 'produtos')
 def movimentacao():
-    por_pagina = 10
-    pagina_atual = int(request.args.get('pagina', 1))
+    por_pagina = POR_PAGINA['movimentacao']
+    pagina_atual = request.args.get('pagina', 1, type=int)
     ordem = request.args.get('ordem', 'id_movimentacao_desc')
-    offset = (pagina_atual - 1) * por_pagina
 
     # Determinar a ordem
-    if ordem == 'nome_asc':
-        order_by = Produto.nome_produto.asc()  # Verifique se isso está correto
-    elif ordem == 'nome_desc':
-        order_by = Produto.nome_produto.desc()
-    elif ordem == 'preco_asc':
-        order_by = Produto.preco_produto * Movimentacao.quantidade_produto.asc()
-    elif ordem == 'preco_desc':
-        order_by = Produto.preco_produto * Movimentacao.quantidade_produto.desc()
-    elif ordem == 'data_asc':
-        order_by = Movimentacao.data_da_movimentacao.asc()
-    elif ordem == 'data_desc':
-        order_by = Movimentacao.data_da_movimentacao.desc()
-    elif ordem == 'id_movimentacao_asc':
-        order_by = Movimentacao.id_movimentacao.asc()
-    else:  # padrão
-        order_by = Movimentacao.id_movimentacao.desc()
-
-    # Selecionar as movimentações com limite e offset
-    lista = (select(Movimentacao, Funcionario, Produto)
-             .order_by(order_by)
-             .join(Funcionario, Funcionario.id_funcionario == Movimentacao.id_funcionario)
-             .join(Produto, Produto.id_produto == Movimentacao.id_produto)
-             .offset(offset).limit(por_pagina))
-    lista = db_session.execute(lista).fetchall()
-
-    total_veterinarios = db_session.query(Movimentacao).count()
-    total_paginas = (total_veterinarios + por_pagina - 1) // por_pagina
+    ordenacao = ORDENS_MOVIMENTACAO.get(ordem, ORDENS_MOVIMENTACAO['id_movimentacao_desc'])
+
+    # Selecionar as movimentações pela página ou pelo cursor
+    # Funcionário e produto vêm nos JOINs, que também servem à ordenação por nome do produto
+    def lista(m):
+        return (select(m)
+                .join(m.funcionario)
+                .join(m.Produto)
+                .options(contains_eager(m.funcionario), contains_eager(m.Produto)))
+
+    # Sem período a lista cobre o histórico todo: com arquivo, as arquivadas entram intercaladas
+    complemento = None
+    if alcanca_arquivo():
+        complemento = (consulta_arquivada(lista(MovimentacaoArquivada).where(so_no_arquivo())),
+                       no_arquivo(ordenacao))
+    pagina = paginar(db_leitura, lista(Movimentacao), ordenacao, por_pagina,
+                     pagina=pagina_atual,
+                     apos=request.args.get('apos'),
+                     antes=request.args.get('antes'),
+                     complemento=complemento)
 
     return render_template('movimentacao.html',
-                           cavalo=lista,
-                           pagina_atual=pagina_atual,
-                           total_paginas=total_paginas,
+                           cavalo=pagina.itens,
+                           total_registros=contar('movimentacoes'),
+                           proximo=pagina.proximo,
+                           anterior=pagina.anterior,
                            ordem=ordem)
 
 
-@app.route('/nova_movimentacao', methods=["POST", "GET"])
+@rota('/nova_movimentacao', methods=["POST", "GET"])
 def nova_movimentacao():
-    # Carrega listas necessárias
-    lista_funcionarios = db_session.execute(select(Funcionario).order_by(Funcionario.nome_funcionario)).scalars().all()
-    lista_produtos = db_session.execute(select(Produto).order_by(Produto.nome_produto)).scalars().all()
-
+    # Funcionário e produto são buscados pelo formulário em /api/v1/busca/*
     if request.method == "POST":
         # Captura dados do formulário
         id_funcionario = request.form.get("form_id_funcionario")
@@ -426,71 +605,155 @@ def nova_movimentacao():
 
         # Processa movimentação se não houver erros
         if not erros:
-            produto = db_session.execute(
-                select(Produto).where(Produto.id_produto == int(id_produto))).scalar_one_or_none()
-
-            if produto:
-                if status.lower() == "0" and quantidade > produto.qtd:
-                    erros.append(f"Estoque insuficiente. Disponível: {produto.qtd}.")
-                else:
-                    produto.qtd += quantidade if status.lower() == "1" else -quantidade
-                    db_session.add(Movimentacao(
-                        id_funcionario=int(id_funcionario),
-                        id_produto=int(id_produto),
-                        fornecedor=fornecedor,
-                        quantidade_produto=quantidade,
-                        data_da_movimentacao=datetime.now(),
-                        status=status
-                    ))
-                    db_session.commit()
-                    flash("Movimentação registrada com sucesso!", "success")
-                    return redirect(url_for('movimentacao'))
-            else:
-                erros.append("Produto não encontrado.")
+            with unidade_de_trabalho() as sessao:
+                erro = registrar_movimentacao(sessao, int(id_funcionario), int(id_produto),
+                                              fornecedor, quantidade, status)
+            if erro is None:
+                flash("Movimentação registrada com sucesso!", "success")
+                return redirect(url_for('movimentacao'))
+            erros.append(erro)
 
         # Mostra erros, se existirem
         for erro in erros:
             flash(erro, "error")
 
-    return render_template('nova_movimentacao.html',
-                           funcionarios=lista_funcionarios,
-                           produtos=lista_produtos)
+    return render_template('nova_movimentacao.html', valores=request.form)
 
 
-@app.route('/categoria', methods=['GET'])
+@rota('/movimentacao/importar', methods=["POST", "GET"])
+def importar_movimentacao():
+    relatorio = None
+    if request.method == "POST":
+        arquivo = request.files.get("form_arquivo")
+        if not arquivo or not arquivo.filename:
+            flash("Selecione um arquivo CSV ou NDJSON.", "error")
+        else:
+            formato = 'ndjson' if arquivo.filename.endswith(('.ndjson', '.jsonl')) else 'csv'
+            relatorio = importar_movimentacoes(arquivo.stream, formato)
+            flash(f"{relatorio['importadas']} de {relatorio['linhas']} movimentações importadas.", "success")
+
+    return render_template('importar_movimentacoes.html', relatorio=relatorio)
+
+
+@rota('/movimentacao/exportar', methods=['GET'])
+def exportar_movimentacao():
+    formato = request.args.get('formato', 'csv')
+    try:
+        de = request.args.get('de')
+        ate = request.args.get('ate')
+        de = datetime.strptime(de, '%Y-%m-%d').date() if de else None
+        ate = datetime.strptime(ate, '%Y-%m-%d').date() if ate else None
+    except ValueError:
+        flash("Datas devem estar no formato AAAA-MM-DD.", "error")
+        return redirect(url_for('movimentacao'))
+
+    if formato == 'xlsx':
+        # A planilha só pode ser enviada depois de pronta: vira tarefa e a página acompanha o progresso
+        try:
+            id_tarefa = enviar('exportacao', {'de': de, 'ate': ate, 'id_produto': request.args.get('id_produto'),
+                                              'status': request.args.get('status'), 'formato': 'xlsx'})
+        except ErroTarefa as e:
+            flash(str(e), "error")
+            return redirect(url_for('movimentacao'))
+        return redirect(url_for('tarefa', id_tarefa=id_tarefa))
+
+    stmt = consulta_exportacao(de, ate,
+                               request.args.get('id_produto', type=int),
+                               request.args.get('status') or None)
+    nome = f"movimentacoes_{de or 'inicio'}_{ate or 'hoje'}"
+    return Response(gerar_csv(stmt), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename={nome}.csv'})
+
+
+# Campos do formulário aceitos por tipo de tarefa em /tarefas
+CAMPOS_TAREFA = {
+    'exportacao': ['de', 'ate', 'id_produto', 'status', 'formato'],
+    'grafico': ['tipo_grafico'],
+    'manutencao': ['operacao', 'meses'],
+}
+
+
+@rota('/tarefas', methods=['GET', 'POST'])
+def tarefas():
+    if request.method == 'POST':
+        tipo = request.form.get('tipo')
+        try:
+            id_tarefa = enviar(tipo, {campo: request.form.get(campo) for campo in CAMPOS_TAREFA.get(tipo, [])})
+        except ErroTarefa as e:
+            flash(str(e), "error")
+            return redirect(url_for('tarefas'))
+        return redirect(url_for('tarefa', id_tarefa=id_tarefa))
+
+    return render_template('tarefas.html', tarefas=listar_tarefas(), manutencoes=list(MANUTENCOES),
+                           terminadas=TERMINADAS)
+
+
+@rota('/tarefas/<int:id_tarefa>', methods=['GET'])
+def tarefa(id_tarefa):
+    tarefa = obter_tarefa(id_tarefa)
+    if tarefa is None:
+        flash("Tarefa não encontrada.", "error")
+        return redirect(url_for('tarefas'))
+    return render_template('tarefa.html', tarefa=tarefa, terminada=tarefa.estado in TERMINADAS,
+                           cancelavel=cancelavel(tarefa), tem_arquivo=arquivo_pronto(tarefa) is not None)
+
+
+@rota('/tarefas/<int:id_tarefa>/arquivo', methods=['GET'])
+def arquivo_tarefa(id_tarefa):
+    tarefa = obter_tarefa(id_tarefa)
+    caminho = arquivo_pronto(tarefa)
+    if caminho is None:
+        flash("O arquivo desta tarefa não está disponível.", "error")
+        return redirect(url_for('tarefas'))
+    return send_file(caminho, as_attachment=True, download_name=tarefa.nome_download)
+
+
+@rota('/tarefas/<int:id_tarefa>/cancelar', methods=['POST'])
+def cancelar_tarefa(id_tarefa):
+    if cancelar(id_tarefa):
+        flash("Cancelamento pedido.", "success")
+    else:
+        flash("A tarefa já terminou ou, sendo uma manutenção em andamento, não pode ser interrompida.", "error")
+    return redirect(url_for('tarefa', id_tarefa=id_tarefa))
+
+
+ORDENS_CATEGORIA = {
+    'nome_asc': Ordenacao(Categoria.nome_categoria, Categoria.id_categoria, False),
+    'nome_desc': Ordenacao(Categoria.nome_categoria, Categoria.id_categoria, True),
+    'id_categoria_asc': Ordenacao(None, Categoria.id_categoria, False),
+    'id_categoria_desc': Ordenacao(None, Categoria.id_categoria, True),
+}
+
+
+@rota('/categoria', methods=['GET'])
+@pagina_condicional('categorias')
 def categoria():
-    por_pagina = 5
-    pagina_atual = int(request.args.get('pagina', 1))
+    por_pagina = POR_PAGINA['categoria']
+    pagina_atual = request.args.get('pagina', 1, type=int)
     ordem = request.args.get('ordem', 'id_categoria_desc')
-    offset = (pagina_atual - 1) * por_pagina
 
     # Determinar a ordem
-    if ordem == 'nome_asc':
-        order_by = Categoria.nome_categoria.asc()
-    elif ordem == 'nome_desc':
-        order_by = Categoria.nome_categoria.desc()
-    elif ordem == 'id_categoria_asc':
-        order_by = Categoria.id_categoria.asc()
-    else:  # padrão
-        order_by = Categoria.id_categoria.desc()
-
-    # Selecionar as categorias com limite e offset
-    lista = (select(Categoria).order_by(order_by).offset(offset).limit(por_pagina))
-    lista = db_session.execute(lista).scalars().all()
-
-    total_categorias = db_session.query(Categoria).count()
-    total_paginas = (total_categorias + por_pagina - 1) // por_pagina
+    ordenacao = ORDENS_CATEGORIA.get(ordem, ORDENS_CATEGORIA['id_categoria_desc'])
+
+    # Selecionar as categorias pela página ou pelo cursor
+    pagina = paginar(db_leitura, select(Categoria), ordenacao, por_pagina,
+                     pagina=pagina_atual,
+                     apos=request.args.get('apos'),
+                     antes=request.args.get('antes'))
 
     return render_template('categoria.html',
-                           cavalo=lista,
-                           pagina_atual=pagina_atual,
-                           total_paginas=total_paginas,
+                           cavalo=pagina.itens,
+                           total_registros=contar('categorias'),
+                           proximo=pagina.proximo,
+                           anterior=pagina.anterior,
                            ordem=ordem)
 
 
-@app.route('/editar_categoria/<int:id_categoria>', methods=["GET", "POST"])
+@rota('/editar_categoria/<int:id_categoria>', methods=["GET", "POST"])
 def editar_categoria(id_categoria):
-    categoria = db_session.query(Categoria).filter(Categoria.id_categoria == id_categoria).first()
+    # Só o POST grava; o GET usa a sessão de leitura
+    sessao = db_session if request.method == "POST" else db_leitura
+    categoria = sessao.query(Categoria).filter(Categoria.id_categoria == id_categoria).first()
     if not categoria:
         flash("Categoria não encontrada.", "error")
         return redirect(url_for('categoria'))
@@ -513,9 +776,9 @@ def editar_categoria(id_categoria):
         else:
             try:
                 # Atualiza os dados da categoria
-                categoria.nome_categoria = nome_categoria
+                with unidade_de_trabalho():
+                    categoria.nome_categoria = nome_categoria
 
-                db_session.commit()
                 flash("Categoria atualizada com sucesso!", "success")
                 return redirect(url_for('categoria'))
             except Exception as e:
@@ -524,9 +787,9 @@ def editar_categoria(id_categoria):
     return render_template('editar_categoria.html', categoria=categoria)
 
 
-@app.route('/nova_categoria', methods=["POST", "GET"])
+@rota('/nova_categoria', methods=["POST", "GET"])
 def nova_categoria():
-    lista = db_session.execute(select(Categoria).order_by(Categoria.nome_categoria.asc())
+    lista = db_leitura.execute(select(Categoria).order_by(Categoria.nome_categoria.asc())
                                ).scalars().all()
     if request.method == "POST":
         # Captura os valores dos campos do formulário
@@ -558,5 +821,8 @@ def nova_categoria():
     return render_template('nova_categoria.html', cavalo=lista)
 
 
+# `flask --app app run`, gunicorn app:app e os scripts que fazem `from app import app`
+app = criar_app()
+
 if __name__ == '__main__':
     app.run(debug=True)
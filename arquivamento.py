@@ -0,0 +1,304 @@
+"""Arquivamento das movimentações antigas num segundo banco SQLite.
+
+Uso: python arquivamento.py [--antes AAAA-MM-DD | --meses N] [--lote 5000] [--sem-vacuum]
+                            [--status]
+
+Move, em lotes, as movimentações anteriores ao corte (dia 1º de um mês; padrão:
+ARQUIVAR_APOS_MESES meses atrás) para o arquivo models.CAMINHO_ARQUIVO e termina
+com VACUUM no banco principal. Listas, exportação, API e estoque numa data só
+anexam e juntam o arquivo quando o período pedido começa antes do corte.
+Contadores, resumos mensais e fechamentos continuam valendo para o histórico
+inteiro.
+
+O corte fica no próprio arquivo e é publicado antes de qualquer linha sair do
+banco principal; até o lote ser apagado a linha existe nos dois lados, e as
+consultas ao arquivo ignoram as que ainda estão no principal.
+"""
+from contextlib import closing
+from datetime import date, datetime
+import argparse
+import os
+import sqlite3
+import threading
+import time
+
+from sqlalchemy import exists, func, select
+from sqlalchemy.dialects.sqlite import insert
+from config import ARQUIVAR_APOS_MESES
+from models import (CAMINHO_ARQUIVO, DIMENSOES_RESUMO, SALDO_MOVIMENTACAO, Movimentacao, MovimentacaoArquivada,
+                    anexar_arquivo, arquivamentos, engine, exigir_sqlite, metadata_arquivo)
+from paginacao import Ordenacao
+
+LOTE = 5000
+# Tempo entre publicar o corte e apagar o primeiro lote: uma consulta que leu o corte
+# anterior termina antes de as linhas saírem do banco principal
+ESPERA_PUBLICACAO = 2.0
+
+_trava = threading.Lock()
+_corte = {}  # 'contador' -> bytes 24-28 do cabeçalho, 'corte' -> data
+
+
+def _contador_de_alteracoes(caminho):
+    # O SQLite incrementa estes 4 bytes do cabeçalho a cada commit (journal de rollback)
+    try:
+        with open(caminho, 'rb') as arquivo:
+            cabecalho = arquivo.read(28)
+    except OSError:
+        return None
+    return cabecalho[24:28] if len(cabecalho) == 28 else None
+
+
+def corte_arquivo():
+    """Data a partir da qual as movimentações estão só no banco principal; None sem arquivo.
+
+    Relida do arquivo só quando ele muda, sem passar pelas engines.
+    """
+    if CAMINHO_ARQUIVO is None:
+        return None
+    contador = _contador_de_alteracoes(CAMINHO_ARQUIVO)
+    if contador is None:
+        return None
+    with _trava:
+        if _corte.get('contador') == contador:
+            return _corte['corte']
+    with closing(sqlite3.connect(f'file:{CAMINHO_ARQUIVO}?mode=ro', uri=True)) as conexao:
+        try:
+            valor = conexao.execute('SELECT max(corte) FROM arquivamentos').fetchone()[0]
+        except sqlite3.OperationalError:  # arquivo ainda sem as tabelas
+            valor = None
+    corte = date.fromisoformat(valor) if valor else None
+    with _trava:
+        _corte.update(contador=contador, corte=corte)
+    return corte
+
+
+def alcanca_arquivo(de=None):
+    # O período que começa em `de` (None = desde o início) inclui datas arquivadas?
+    corte = corte_arquivo()
+    return corte is not None and (de is None or de < corte)
+
+
+def so_no_arquivo():
+    # Linha arquivada que já saiu do principal (durante o arquivamento ela fica nos dois)
+    return ~exists().where(Movimentacao.id_movimentacao == MovimentacaoArquivada.id_movimentacao)
+
+
+def no_arquivo(ordenacao):
+    # A mesma ordenação com as colunas de Movimentacao trocadas pelas de MovimentacaoArquivada
+    def trocar(coluna):
+        if coluna is not None and getattr(coluna, 'class_', None) is Movimentacao:
+            return getattr(MovimentacaoArquivada, coluna.key)
+        return coluna
+    return Ordenacao(trocar(ordenacao.chave), trocar(ordenacao.id_coluna), ordenacao.descendente)
+
+
+def consulta_arquivada(stmt):
+    # Marca a consulta para a engine anexar o arquivo à conexão antes de executá-la
+    return stmt.execution_options(arquivo=True)
+
+
+# ----------------------------------------------------------------------------------------
+# Arquivamento
+
+COLUNAS = ', '.join(coluna.name for coluna in Movimentacao.__table__.columns)
+# Linhas do lote [:primeiro, :ultimo] que já estão no arquivo e podem sair do principal
+LOTE_COPIADO = ("m.id_movimentacao BETWEEN :primeiro AND :ultimo AND m.data_da_movimentacao < :corte "
+                "AND m.id_movimentacao IN (SELECT id_movimentacao FROM arquivo.movimentacoes "
+                "WHERE id_movimentacao BETWEEN :primeiro AND :ultimo)")
+# Linhas que só existem no arquivo
+SO_ARQUIVADAS = "m.id_movimentacao NOT IN (SELECT id_movimentacao FROM main.movimentacoes)"
+
+
+def _sql_somar_contador(tabela, filtro):
+    return (f"UPDATE contadores SET valor = valor + (SELECT count(*) FROM {tabela} m WHERE {filtro}) "
+            f"WHERE nome = 'movimentacoes'")
+
+
+def _sql_somar_resumos(tabela, filtro):
+    comandos = []
+    for dimensao, chave in DIMENSOES_RESUMO.items():
+        comandos.append(
+            f"INSERT INTO resumos_mensais (dimensao, chave, mes_ano, total_produtos, total_movimentacoes) "
+            f"SELECT '{dimensao}', {chave.format(linha='m')} AS chave_resumo, "
+            f"strftime('%Y-%m', m.data_da_movimentacao) AS mes, COALESCE(SUM(m.quantidade_produto), 0), COUNT(*) "
+            f"FROM {tabela} m WHERE {filtro} AND m.data_da_movimentacao IS NOT NULL GROUP BY chave_resumo, mes "
+            f"ON CONFLICT (dimensao, chave, mes_ano) DO UPDATE SET "
+            f"total_produtos = total_produtos + excluded.total_produtos, "
+            f"total_movimentacoes = total_movimentacoes + excluded.total_movimentacoes"
+        )
+    return comandos
+
+
+def _sql_compensacoes():
+    # Os gatilhos de exclusão descontam cada linha dos contadores, resumos e fechamentos;
+    # somadas antes do DELETE, as linhas do lote saem do banco sem sair dos totais
+    return [
+        _sql_somar_contador('movimentacoes', LOTE_COPIADO),
+        *_sql_somar_resumos('movimentacoes', LOTE_COPIADO),
+        # Saldo do lote por produto e dia, com índice: cada fechamento soma só as linhas do seu produto
+        "CREATE TEMP TABLE IF NOT EXISTS saldos_lote (id_produto INTEGER, data_da_movimentacao DATE, saldo INTEGER)",
+        "CREATE INDEX IF NOT EXISTS temp.ix_saldos_lote ON saldos_lote (id_produto, data_da_movimentacao)",
+        "DELETE FROM saldos_lote",
+        f"INSERT INTO saldos_lote SELECT m.id_produto, m.data_da_movimentacao, "
+        f"sum({SALDO_MOVIMENTACAO.format(linha='m')}) FROM movimentacoes m WHERE {LOTE_COPIADO} "
+        f"GROUP BY m.id_produto, m.data_da_movimentacao",
+        "UPDATE fechamentos_estoque SET quantidade = quantidade + COALESCE(("
+        "SELECT sum(s.saldo) FROM saldos_lote s WHERE s.id_produto = fechamentos_estoque.id_produto "
+        "AND s.data_da_movimentacao < fechamentos_estoque.data_corte), 0) "
+        "WHERE id_produto IN (SELECT id_produto FROM saldos_lote)",
+    ]
+
+
+def somar_arquivadas(conexao, contador=False, resumos=False):
+    # As reconstruções recontam só o banco principal: devolve a parte arquivada aos totais
+    if not alcanca_arquivo():
+        return
+    anexar_arquivo(conexao)
+    comandos = ([_sql_somar_contador('arquivo.movimentacoes', SO_ARQUIVADAS)] if contador else []) + \
+        (_sql_somar_resumos('arquivo.movimentacoes', SO_ARQUIVADAS) if resumos else [])
+    for comando in comandos:
+        conexao.exec_driver_sql(comando)
+
+
+def corte_padrao(meses=ARQUIVAR_APOS_MESES, hoje=None):
+    hoje = hoje or date.today()
+    total = hoje.year * 12 + hoje.month - 1 - meses
+    return date(total // 12, total % 12 + 1, 1)
+
+
+def _preparar_arquivo():
+    # Cria o arquivo e as tabelas; journal de rollback para o contador do cabeçalho valer
+    with engine.connect() as conexao:
+        anexar_arquivo(conexao)
+        conexao.exec_driver_sql("PRAGMA arquivo.journal_mode = DELETE")
+        metadata_arquivo.create_all(conexao)
+        conexao.commit()
+
+
+def _publicar_corte(corte):
+    with engine.connect() as conexao:
+        anexar_arquivo(conexao)
+        conexao.execute(insert(arquivamentos).values(corte=corte, movimentacoes=0, executado_em=datetime.now())
+                        .on_conflict_do_update(index_elements=['corte'], set_={'executado_em': datetime.now()}))
+        conexao.commit()
+
+
+def _proximo_lote(conexao, corte, apos, lote):
+    ids = conexao.exec_driver_sql(
+        "SELECT id_movimentacao FROM movimentacoes WHERE data_da_movimentacao < ? AND id_movimentacao > ? "
+        "ORDER BY id_movimentacao LIMIT ?", (corte.isoformat(), apos, lote)).scalars().all()
+    return (ids[0], ids[-1]) if ids else None
+
+
+def _mover_lote(corte, primeiro, ultimo):
+    parametros = {'primeiro': primeiro, 'ultimo': ultimo, 'corte': corte.isoformat()}
+    # Primeiro a cópia, confirmada; só então a exclusão. Uma queda no meio deixa a linha nos
+    # dois bancos (as consultas ao arquivo a ignoram) e a próxima execução termina o lote.
+    with engine.connect() as conexao:
+        anexar_arquivo(conexao)
+        conexao.exec_driver_sql(
+            f"INSERT OR IGNORE INTO arquivo.movimentacoes ({COLUNAS}) SELECT {COLUNAS} FROM main.movimentacoes "
+            f"WHERE id_movimentacao BETWEEN :primeiro AND :ultimo AND data_da_movimentacao < :corte", parametros)
+        conexao.commit()
+    with engine.connect() as conexao:
+        anexar_arquivo(conexao)
+        for comando in _sql_compensacoes():
+            conexao.exec_driver_sql(comando, parametros)
+        movidas = conexao.exec_driver_sql(f"DELETE FROM movimentacoes AS m WHERE {LOTE_COPIADO}",
+                                          parametros).rowcount
+        conexao.commit()
+    return movidas
+
+
+def _vacuum():
+    # Devolve ao sistema as páginas liberadas e zera o WAL. Em WAL o VACUUM grava o banco
+    # refeito no próprio WAL: só o checkpoint depois dele encolhe o arquivo principal.
+    with engine.connect() as conexao:
+        conexao = conexao.execution_options(isolation_level='AUTOCOMMIT')
+        conexao.exec_driver_sql("PRAGMA main.wal_checkpoint(TRUNCATE)")
+        conexao.exec_driver_sql("VACUUM main")
+        conexao.exec_driver_sql("PRAGMA main.wal_checkpoint(TRUNCATE)")
+
+
+def arquivar(corte, lote=LOTE, vacuum=True, espera=ESPERA_PUBLICACAO):
+    """Move as movimentações anteriores a `corte` para o arquivo; retorna (movidas, lotes)."""
+    from fechamentos import fechar_periodos
+
+    exigir_sqlite('O arquivamento')
+    if CAMINHO_ARQUIVO is None:
+        raise RuntimeError('Arquivamento só funciona com o banco principal num arquivo SQLite.')
+    corte = corte.replace(day=1)
+    # Com os meses até o corte fechados, o estoque numa data a partir do corte não precisa do arquivo
+    fechar_periodos(ate=corte)
+    _preparar_arquivo()
+    _publicar_corte(corte)
+    time.sleep(espera)
+
+    movidas = lotes = 0
+    apos = 0
+    while True:
+        with engine.connect() as conexao:
+            intervalo = _proximo_lote(conexao, corte, apos, lote)
+        if intervalo is None:
+            break
+        movidas += _mover_lote(corte, *intervalo)
+        lotes += 1
+        apos = intervalo[1]
+
+    with engine.connect() as conexao:
+        anexar_arquivo(conexao)
+        conexao.execute(arquivamentos.update().where(arquivamentos.c.corte == corte)
+                        .values(movimentacoes=arquivamentos.c.movimentacoes + movidas))
+        conexao.commit()
+    if movidas and vacuum:
+        _vacuum()
+    return movidas, lotes
+
+
+def situacao():
+    # (corte, movimentações no principal, no arquivo)
+    corte = corte_arquivo()
+    with engine.connect() as conexao:
+        principal = conexao.execute(select(func.count()).select_from(Movimentacao)).scalar()
+        arquivadas = 0
+        if corte is not None:
+            arquivadas = conexao.execute(consulta_arquivada(
+                select(func.count()).select_from(MovimentacaoArquivada))).scalar()
+    return corte, principal, arquivadas
+
+
+def _megabytes(caminho):
+    return os.path.getsize(caminho) / 1024 / 1024 if caminho and os.path.exists(caminho) else 0.0
+
+
+def main():
+    from sqlalchemy.engine import make_url
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    grupo = parser.add_mutually_exclusive_group()
+    grupo.add_argument('--antes', type=date.fromisoformat, help='arquiva as movimentações anteriores a esta data')
+    grupo.add_argument('--meses', type=int, default=ARQUIVAR_APOS_MESES,
+                       help='mantém no banco principal os últimos N meses')
+    parser.add_argument('--lote', type=int, default=LOTE)
+    parser.add_argument('--sem-vacuum', action='store_true')
+    parser.add_argument('--status', action='store_true', help='só mostra o corte atual e as contagens')
+    args = parser.parse_args()
+
+    principal = make_url(str(engine.url)).database
+    if not args.status:
+        corte = (args.antes or corte_padrao(args.meses)).replace(day=1)
+        antes_mb = _megabytes(principal)
+        inicio = time.perf_counter()
+        movidas, lotes = arquivar(corte, args.lote, vacuum=not args.sem_vacuum)
+        print(f'{movidas} movimentação(ões) anteriores a {corte} arquivadas em {lotes} lote(s) '
+              f'({time.perf_counter() - inicio:.1f} s).')
+        print(f'Banco principal: {antes_mb:.1f} MB -> {_megabytes(principal):.1f} MB; '
+              f'arquivo: {_megabytes(CAMINHO_ARQUIVO):.1f} MB ({CAMINHO_ARQUIVO})')
+
+    corte, no_principal, arquivadas = situacao()
+    print(f"Corte: {corte or 'sem arquivo'}; {no_principal} movimentação(ões) no banco principal, "
+          f'{arquivadas} no arquivo.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+"""Auditoria dos índices: coleta as consultas que as rotas realmente fazem,
+roda EXPLAIN QUERY PLAN em cada uma e aponta índices sem uso e consultas
+que varrem a tabela ou ordenam numa B-tree temporária.
+
+Uso: python auditoria_indices.py [--vazao 20000]
+
+--vazao mede inserções de movimentações por segundo numa cópia do banco com
+os índices atuais e noutra com as migrações pendentes aplicadas.
+"""
+from collections import defaultdict
+import argparse
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from sqlalchemy import event, inspect
+
+# Rotas exercitadas na coleta: as listas em cada ordem, o dashboard, a API e as buscas
+ROTAS = [
+    '/dashboard',
+    '/funcionario', '/funcionario?ordem=nome_asc', '/funcionario?ordem=nome_desc&pagina=2',
+    '/produto', '/produto?ordem=nome_asc', '/produto?ordem=nome_desc&pagina=2',
+    '/categoria', '/categoria?ordem=nome_asc',
+    '/movimentacao', '/movimentacao?ordem=data_desc', '/movimentacao?ordem=data_asc&pagina=2',
+    '/movimentacao?ordem=nome_asc', '/movimentacao?ordem=preco_desc',
+    '/movimentacao/exportar?formato=csv&de=2020-01-01&ate=2030-12-31',
+    '/movimentacao/exportar?formato=csv&id_produto=1',
+    '/produto/grafico/dados',
+    '/produto/estoque?data=2023-06-30', '/api/v1/estoque?data=2023-06-30&id_produto=1',
+    '/busca?q=cerveja', '/busca?q=ana&tipo=funcionarios',
+    '/api/v1/movimentacoes?id_produto=1&de=2020-01-01', '/api/v1/movimentacoes?ordem=-data',
+    '/api/v1/movimentacoes?id_funcionario=1&status=1',
+    '/api/v1/produtos?nome=Ce', '/api/v1/funcionarios?email=x@x.com', '/api/v1/funcionarios?cpf=00000000000',
+    '/api/v1/busca/produtos?q=ce', '/api/v1/busca/funcionarios?q=an',
+    '/editar_produto/1', '/editar_funcionario/1', '/editar_categoria/1',
+]
+# Uma escrita de cada tipo, para auditar os UPDATE/DELETE com WHERE
+ESCRITAS = [
+    ('/nova_movimentacao', {'form_id_funcionario': '1', 'form_id_produto': '1', 'form_fornecedor': 'Auditoria',
+                            'form_quantidade': '1', 'form_status': '1'}),
+]
+COMANDOS_AUDITADOS = ('SELECT', 'UPDATE', 'DELETE', 'WITH')
+INDICE_USADO = re.compile(r'USING (?:COVERING )?INDEX (\w+)')
+VARREDURA = re.compile(r'^SCAN (\w+)$')
+COM_LIMITE = re.compile(r'\bLIMIT\b', re.IGNORECASE)
+
+
+def coletar_consultas(app, engines, rotas=ROTAS, escritas=ESCRITAS):
+    # Retorna {sql: (parâmetros do primeiro uso, rotas que o executaram)}
+    consultas = {}
+    rota_atual = [None]
+
+    def anotar(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(COMANDOS_AUDITADOS):
+            if executemany:
+                parameters = parameters[0]
+            consultas.setdefault(statement, (parameters, set()))[1].add(rota_atual[0])
+
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', anotar)
+    try:
+        cliente = app.test_client()
+        for rota in rotas:
+            rota_atual[0] = rota
+            cliente.get(rota)
+        for rota, dados in escritas:
+            rota_atual[0] = f'POST {rota}'
+            cliente.post(rota, data=dados)
+    finally:
+        for engine in engines:
+            event.remove(engine, 'before_cursor_execute', anotar)
+    return consultas
+
+
+def plano(conexao, sql, parametros):
+    linhas = conexao.exec_driver_sql('EXPLAIN QUERY PLAN ' + sql, parametros).all()
+    return [linha[-1] for linha in linhas]
+
+
+def indices_existentes(engine):
+    # {nome: (tabela, colunas, único)}, sem os autoindex das constraints UNIQUE
+    inspetor = inspect(engine)
+    indices = {}
+    for tabela in inspetor.get_table_names():
+        for indice in inspetor.get_indexes(tabela):
+            indices[indice['name']] = (tabela, tuple(indice['column_names']), bool(indice['unique']))
+    return indices
+
+
+def auditar(app, engine, engines):
+    consultas = coletar_consultas(app, engines)
+    uso = defaultdict(int)
+    problemas = []
+    with engine.connect() as conexao:
+        for sql, (parametros, rotas) in consultas.items():
+            detalhes = plano(conexao, sql, parametros)
+            alertas = []
+            for detalhe in detalhes:
+                for nome in INDICE_USADO.findall(detalhe):
+                    uso[nome] += 1
+                # Varrer na ordem da chave primária com LIMIT para cedo; sem LIMIT lê a tabela toda
+                varredura = VARREDURA.match(detalhe)
+                if varredura and not COM_LIMITE.search(sql):
+                    alertas.append(f'varre {varredura.group(1)} inteira')
+                if 'TEMP B-TREE' in detalhe:
+                    alertas.append(detalhe.lower())
+            if alertas:
+                problemas.append((sorted(r for r in rotas if r), ' '.join(sql.split()), detalhes, alertas))
+
+    indices = indices_existentes(engine)
+    sem_uso = {nome: definicao for nome, definicao in indices.items() if nome not in uso}
+    return {'consultas': len(consultas), 'uso': dict(uso), 'sem_uso': sem_uso, 'problemas': problemas}
+
+
+def imprimir_relatorio(relatorio, indices):
+    print(f"{relatorio['consultas']} consultas distintas analisadas\n")
+    print('Índices usados:')
+    for nome, vezes in sorted(relatorio['uso'].items(), key=lambda item: -item[1]):
+        print(f'  {nome}: {vezes} consulta(s)')
+    print('\nÍndices sem uso (custam em toda escrita):')
+    for nome, (tabela, colunas, unico) in sorted(relatorio['sem_uso'].items()):
+        observacao = ' — UNIQUE, mantém a restrição' if unico else ''
+        print(f"  {nome} em {tabela}({', '.join(colunas)}){observacao}")
+    print('\nConsultas que varrem tabela ou ordenam em B-tree temporária:')
+    for rotas, sql, detalhes, alertas in relatorio['problemas']:
+        print(f"  [{', '.join(rotas[:3])}{' ...' if len(rotas) > 3 else ''}] {'; '.join(sorted(set(alertas)))}")
+        print(f'    {sql[:200]}')
+        for detalhe in detalhes:
+            print(f'      {detalhe}')
+    escrita = sum(1 for _, _, unico in indices.values() if not unico)
+    print(f'\n{len(indices)} índices declarados, {escrita} sem UNIQUE')
+
+
+def _vazao(caminho, quantidade, lote=1000):
+    # Movimentações + ajuste de estoque, um lote por transação, como importacao.py
+    conexao = sqlite3.connect(caminho, isolation_level=None)
+    conexao.execute('PRAGMA journal_mode=WAL')
+    conexao.execute('PRAGMA synchronous=NORMAL')
+    id_funcionario = conexao.execute('SELECT min(id_funcionario) FROM funcionarios').fetchone()[0]
+    produtos = [linha[0] for linha in conexao.execute('SELECT id_produto FROM produtos')]
+    inicio = time.perf_counter()
+    for comeco in range(0, quantidade, lote):
+        linhas = [(i % 97 + 1, f'Fornecedor {i % 50}', str(i % 2), f'2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}',
+                   id_funcionario, produtos[i % len(produtos)]) for i in range(comeco, min(comeco + lote, quantidade))]
+        conexao.execute('BEGIN')
+        conexao.executemany(
+            'INSERT INTO movimentacoes (quantidade_produto, fornecedor, status, data_da_movimentacao, '
+            'id_funcionario, id_produto) VALUES (?, ?, ?, ?, ?, ?)', linhas)
+        conexao.executemany('UPDATE produtos SET qtd = coalesce(qtd, 0) + ? WHERE id_produto = ?',
+                            [(linha[0], linha[5]) for linha in linhas])
+        conexao.execute('COMMIT')
+    segundos = time.perf_counter() - inicio
+    conexao.close()
+    return quantidade / segundos
+
+
+def comparar_vazao(caminho_banco, quantidade):
+    # Mede numa cópia com os índices atuais e noutra com as migrações aplicadas
+    from sqlalchemy import create_engine
+    from migracoes import migrar
+
+    pasta = tempfile.mkdtemp()
+    try:
+        antes, depois = os.path.join(pasta, 'antes.db'), os.path.join(pasta, 'depois.db')
+        with sqlite3.connect(caminho_banco) as origem:
+            for destino in (antes, depois):
+                with sqlite3.connect(destino) as copia:
+                    origem.backup(copia)
+        engine_depois = create_engine(f'sqlite:///{depois}')
+        migrar(engine_depois)
+        engine_depois.dispose()
+        return _vazao(antes, quantidade), _vazao(depois, quantidade)
+    finally:
+        shutil.rmtree(pasta)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--vazao', type=int, metavar='N', help='mede a inserção de N movimentações')
+    args = parser.parse_args()
+
+    # A coleta faz uma escrita de verdade; roda numa cópia do banco
+    import config
+    from sqlalchemy.engine import make_url
+    caminho = make_url(config.DATABASE_URL).database
+    pasta = tempfile.mkdtemp()
+    copia = os.path.join(pasta, 'auditoria.db')
+    with sqlite3.connect(caminho) as origem, sqlite3.connect(copia) as destino:
+        origem.backup(destino)
+    # As engines de models.py são criadas na importação, a partir desta URL
+    config.DATABASE_URL = f'sqlite:///{copia}'
+    try:
+        from app import app
+        from models import engine, engine_leitura
+        relatorio = auditar(app, engine, [engine, engine_leitura])
+        imprimir_relatorio(relatorio, indices_existentes(engine))
+        engine.dispose()
+        engine_leitura.dispose()
+    finally:
+        shutil.rmtree(pasta)
+
+    if args.vazao:
+        antes, depois = comparar_vazao(caminho, args.vazao)
+        print(f'\nInserção de {args.vazao} movimentações: {antes:.0f}/s com os índices atuais, '
+              f'{depois:.0f}/s após as migrações ({depois / antes - 1:+.0%})')
+
+
+if __name__ == '__main__':
+    main()
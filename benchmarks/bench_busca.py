@@ -0,0 +1,83 @@
+"""Compara a busca por FTS5 (MATCH) com LIKE '%termo%' sobre muitos produtos.
+
+Uso: python -m benchmarks.bench_busca [--produtos 100000] [--repeticoes 20]
+                                      [--termos televisao "bola fut" carvalho]
+
+Cria um banco temporário (DATABASE_URL) com os produtos sintéticos, instala os
+índices de busca e mede o tempo médio de cada consulta.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+NOMES = ['Televisão', 'Smartphone', 'Notebook', 'Bola de Futebol', 'Geladeira', 'Fogão', 'Sofá', 'Cafeteira']
+SOBRENOMES = ['Carvalho', 'Araújo', 'Gonçalves', 'Conceição', 'Magalhães', 'Simões', 'Ribeiro', 'Lopes']
+LOTE = 50000
+
+
+def preparar_dados(n_produtos, semente=42):
+    from sqlalchemy import insert
+    from models import Categoria, Produto, engine, init_db
+
+    init_db()
+    aleatorio = random.Random(semente)
+    with engine.begin() as conexao:
+        conexao.execute(insert(Categoria.__table__), [{'nome_categoria': nome} for nome in ['Eletrônicos', 'Móveis']])
+    for inicio in range(0, n_produtos, LOTE):
+        with engine.begin() as conexao:
+            conexao.execute(insert(Produto.__table__), [
+                {'nome_produto': f'{aleatorio.choice(NOMES)} {aleatorio.choice(SOBRENOMES)}',
+                 'preco_produto': 1.0, 'qtd': 1, 'id_categoria': i % 2 + 1}
+                for i in range(inicio, min(inicio + LOTE, n_produtos))])
+
+
+def cronometrar(conexao, sql, parametros, repeticoes):
+    conexao.exec_driver_sql(sql, parametros).all()  # aquece o cache de páginas
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        linhas = conexao.exec_driver_sql(sql, parametros).all()
+    return (time.perf_counter() - inicio) / repeticoes * 1000, len(linhas)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--produtos', type=int, default=100000)
+    parser.add_argument('--repeticoes', type=int, default=20)
+    parser.add_argument('--termos', nargs='+', default=['televisao', 'Televisão', 'bola fut', 'Gonçalves', 'xyz'])
+    args = parser.parse_args()
+
+    pasta = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(pasta, 'busca.db')}"
+    sys.path.insert(0, RAIZ)
+    from busca import expressao_fts
+    from models import engine, fts_disponivel
+
+    inicio = time.perf_counter()
+    preparar_dados(args.produtos)
+    print(f'{args.produtos} produtos gravados e indexados em {time.perf_counter() - inicio:.2f}s')
+
+    with engine.connect() as conexao:
+        if not fts_disponivel(conexao):
+            sys.exit('Este SQLite não foi compilado com FTS5.')
+        print(f"{'termo':<14}{'FTS (ms)':>10}{'FTS+bm25':>10}{'achados':>9}{'LIKE (ms)':>11}{'achados':>9}")
+        for termo in args.termos:
+            fts, _ = cronometrar(
+                conexao, "SELECT rowid FROM produtos_fts WHERE produtos_fts MATCH ? LIMIT 20",
+                (expressao_fts(termo),), args.repeticoes)
+            # Ordenar por relevância exige pontuar todos os documentos que casam
+            ranqueada, n_fts = cronometrar(
+                conexao, "SELECT rowid FROM produtos_fts WHERE produtos_fts MATCH ? "
+                         "ORDER BY bm25(produtos_fts) LIMIT 20", (expressao_fts(termo),), args.repeticoes)
+            # LIKE não ignora acentos: "televisao" não acha "Televisão"; sem achados, varre a tabela toda
+            like, n_like = cronometrar(
+                conexao, "SELECT id_produto FROM produtos WHERE nome_produto LIKE ? LIMIT 20",
+                (f'%{termo}%',), args.repeticoes)
+            print(f'{termo:<14}{fts:>10.2f}{ranqueada:>10.2f}{n_fts:>9}{like:>11.2f}{n_like:>9}')
+
+
+if __name__ == '__main__':
+    main()
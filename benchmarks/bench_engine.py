@@ -0,0 +1,116 @@
+"""Compara a vazão de leitura/escrita de cada perfil de engine sob requisições concorrentes.
+
+Uso: python -m benchmarks.bench_engine [--perfis desempenho compatibilidade]
+                                       [--leitores 8] [--escritores 2] [--segundos 10]
+
+Cada perfil roda num subprocesso com DATABASE_URL/DB_PERFIL próprios, sobre um
+banco temporário, disparando GETs das listas e POSTs de nova_movimentacao pelo
+cliente de teste do Flask a partir de várias threads.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROTAS_LEITURA = ['/movimentacao', '/movimentacao?ordem=data_desc', '/produto?ordem=nome_asc', '/dashboard']
+
+
+def preparar_dados(n_produtos=200, n_movimentacoes=20000):
+    from datetime import date, timedelta
+    from sqlalchemy import insert
+    from models import Categoria, Funcionario, Movimentacao, Produto, engine, init_db
+
+    init_db()
+    with engine.begin() as conexao:
+        conexao.execute(insert(Categoria.__table__), [{'nome_categoria': 'Benchmark'}])
+        conexao.execute(insert(Funcionario.__table__), [{
+            'nome_funcionario': 'Bench', 'sobrenome': 'Mark', 'email': 'bench@exemplo.com', 'cpf': '00000000000'}])
+        conexao.execute(insert(Produto.__table__), [
+            {'nome_produto': f'Produto {i:05d}', 'preco_produto': 1.0 + i, 'qtd': 10 ** 6, 'id_categoria': 1}
+            for i in range(n_produtos)])
+        conexao.execute(insert(Movimentacao.__table__), [
+            {'quantidade_produto': 1, 'fornecedor': 'Bench', 'status': '1', 'id_funcionario': 1,
+             'id_produto': i % n_produtos + 1, 'data_da_movimentacao': date(2024, 1, 1) + timedelta(days=i % 365)}
+            for i in range(n_movimentacoes)])
+
+
+def executar(leitores, escritores, segundos):
+    # Roda dentro do subprocesso, já com o ambiente do perfil
+    preparar_dados()
+    from app import app
+
+    contagem = {'leituras': 0, 'escritas': 0, 'erros': 0}
+    trava = threading.Lock()
+    fim = time.perf_counter() + segundos
+
+    def somar(chave):
+        with trava:
+            contagem[chave] += 1
+
+    def ler(n):
+        cliente = app.test_client()
+        while time.perf_counter() < fim:
+            try:
+                resposta = cliente.get(ROTAS_LEITURA[n % len(ROTAS_LEITURA)])
+                somar('leituras' if resposta.status_code == 200 else 'erros')
+            except Exception:
+                somar('erros')
+            n += 1
+
+    def escrever(n):
+        cliente = app.test_client()
+        while time.perf_counter() < fim:
+            try:
+                resposta = cliente.post('/nova_movimentacao', data={
+                    'form_id_funcionario': 1, 'form_id_produto': n % 200 + 1, 'form_fornecedor': 'Bench',
+                    'form_quantidade': 1, 'form_status': str(n % 2)})
+                somar('escritas' if resposta.status_code == 302 else 'erros')
+            except Exception:
+                somar('erros')
+            n += 1
+
+    threads = ([threading.Thread(target=ler, args=(i,)) for i in range(leitores)]
+               + [threading.Thread(target=escrever, args=(i,)) for i in range(escritores)])
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {chave: valor / segundos for chave, valor in contagem.items()}
+
+
+def main():
+    from config import PERFIS
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--perfis', nargs='+', default=list(PERFIS), choices=list(PERFIS))
+    parser.add_argument('--leitores', type=int, default=8)
+    parser.add_argument('--escritores', type=int, default=2)
+    parser.add_argument('--segundos', type=float, default=10)
+    parser.add_argument('--executar', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.executar:
+        print(json.dumps(executar(args.leitores, args.escritores, args.segundos)))
+        return
+
+    print(f"{'perfil':<16}{'leituras/s':>12}{'escritas/s':>12}{'erros/s':>10}")
+    for perfil in args.perfis:
+        with tempfile.TemporaryDirectory() as pasta:
+            ambiente = dict(os.environ, DB_PERFIL=perfil,
+                            DATABASE_URL=f"sqlite:///{os.path.join(pasta, 'bench.db')}")
+            saida = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.bench_engine', '--executar',
+                 '--leitores', str(args.leitores), '--escritores', str(args.escritores),
+                 '--segundos', str(args.segundos)],
+                cwd=RAIZ, env=ambiente, capture_output=True, text=True, check=True)
+        resultado = json.loads(saida.stdout.strip().splitlines()[-1])
+        print(f"{perfil:<16}{resultado['leituras']:>12.1f}{resultado['escritas']:>12.1f}{resultado['erros']:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,284 @@
+"""Latência e vazão de todas as rotas do app, em bases de vários tamanhos.
+
+Uso: python -m benchmarks.bench_rotas [--escalas 10000 100000 1000000] [--modos cliente servidor]
+                                      [--repeticoes 30] [--threads 8] [--segundos 2]
+                                      [--dados benchmarks/dados] [-o resultado.json]
+
+Cada escala é uma base gerada pelo populate_db.py com esse número de
+movimentações sorteadas, guardada em --dados e reaproveitada nas próximas
+execuções. A medição roda num subprocesso com o DATABASE_URL de uma cópia da
+base (as rotas POST gravam nela).
+
+Modo "cliente": cada rota recebe --repeticoes requisições seguidas pelo
+cliente de teste do Flask. Modo "servidor": o app sobe num servidor WSGI com
+threads e --threads clientes HTTP disparam contra cada rota por --segundos.
+Para cada rota saem p50/p95/p99 (ms), requisições/s e comandos SQL por
+requisição. Compare duas execuções com benchmarks.regressao.
+"""
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import HTTPRedirectHandler, Request, build_opener
+import argparse
+import io
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy import event
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ESCALAS = [10000, 100000, 1000000]
+
+# dados: None (GET) ou função do número da requisição que devolve o formulário
+Rota = namedtuple('Rota', ['metodo', 'url', 'dados', 'servidor'])
+
+
+def _rota(url, metodo='GET', dados=None, servidor=True):
+    return Rota(metodo, url, dados, servidor)
+
+
+def _csv_importacao(i):
+    linhas = ''.join(f'1,{n % 20 + 1},{n % 5 + 1},Bench,1\n' for n in range(10))
+    return {'form_arquivo': (io.BytesIO(('id_funcionario,id_produto,quantidade,fornecedor,status\n'
+                                         + linhas).encode()), f'bench{i}.csv')}
+
+
+ROTAS = [
+    _rota('/'),
+    _rota('/dashboard'),
+    _rota('/produto/grafico'),
+    _rota('/produto/grafico?tipo_grafico=line'),
+    _rota('/produto/grafico/dados'),
+    _rota('/produto/estoque?data=2023-06-30'),
+    _rota('/api/v1/estoque?data=2023-06-30'),
+    _rota('/busca?q=cerveja'),
+    _rota('/busca?q=ana&tipo=funcionarios'),
+    _rota('/funcionario'),
+    _rota('/funcionario?ordem=nome_asc'),
+    _rota('/novo_funcionario'),
+    _rota('/editar_funcionario/1'),
+    _rota('/produto'),
+    _rota('/produto?ordem=nome_asc'),
+    _rota('/novo_produto'),
+    _rota('/editar_produto/1'),
+    _rota('/movimentacao'),
+    _rota('/movimentacao?ordem=data_desc'),
+    _rota('/movimentacao?ordem=preco_desc'),
+    _rota('/movimentacao?ordem=nome_asc'),
+    _rota('/movimentacao?pagina=50'),
+    _rota('/nova_movimentacao'),
+    _rota('/movimentacao/importar'),
+    _rota('/movimentacao/exportar?formato=csv&de=2021-03-01&ate=2021-03-31'),
+    _rota('/categoria'),
+    _rota('/editar_categoria/1'),
+    _rota('/nova_categoria'),
+    _rota('/api/v1/movimentacoes?limite=100'),
+    _rota('/api/v1/movimentacoes?id_produto=1&de=2021-01-01'),
+    _rota('/api/v1/produtos/1'),
+    _rota('/api/v1/busca/produtos?q=ce'),
+    _rota('/nova_movimentacao', 'POST', lambda i: {
+        'form_id_funcionario': '1', 'form_id_produto': str(i % 20 + 1), 'form_fornecedor': 'Bench',
+        'form_quantidade': '1', 'form_status': '1'}),
+    _rota('/nova_categoria', 'POST', lambda i: {'form_nome_categoria': f'Bench {i}'}),
+    _rota('/movimentacao/importar', 'POST', _csv_importacao, servidor=False),
+]
+
+
+def nome_rota(rota):
+    return f'{rota.metodo} {rota.url}'
+
+
+def percentil(valores, p):
+    # Interpolação linear entre os vizinhos, como numpy.percentile
+    ordenados = sorted(valores)
+    if not ordenados:
+        return None
+    posicao = (len(ordenados) - 1) * p / 100
+    abaixo = int(posicao)
+    acima = min(abaixo + 1, len(ordenados) - 1)
+    return ordenados[abaixo] + (ordenados[acima] - ordenados[abaixo]) * (posicao - abaixo)
+
+
+def resumir(latencias, segundos, erros, comandos_sql):
+    n = len(latencias)
+    return {
+        'requisicoes': n,
+        'erros': erros,
+        'p50_ms': percentil(latencias, 50),
+        'p95_ms': percentil(latencias, 95),
+        'p99_ms': percentil(latencias, 99),
+        'req_s': n / segundos if segundos else None,
+        'sql_por_req': comandos_sql / n if n else None,
+    }
+
+
+class ContadorSQL:
+    def __init__(self, engines):
+        self.total = 0
+        self._trava = threading.Lock()
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute', self._somar)
+
+    def _somar(self, *args):
+        with self._trava:
+            self.total += 1
+
+
+def medir_cliente(app, contador, repeticoes):
+    cliente = app.test_client()
+    resultados = {}
+    for rota in ROTAS:
+        enviar = cliente.post if rota.metodo == 'POST' else cliente.get
+        enviar(rota.url, data=rota.dados(0) if rota.dados else None)  # aquece caches e conexões
+        latencias, erros = [], 0
+        sql_antes = contador.total
+        inicio = time.perf_counter()
+        for i in range(1, repeticoes + 1):
+            comeco = time.perf_counter()
+            resposta = enviar(rota.url, data=rota.dados(i) if rota.dados else None)
+            latencias.append((time.perf_counter() - comeco) * 1000)
+            erros += resposta.status_code >= 400
+        resultados[nome_rota(rota)] = resumir(latencias, time.perf_counter() - inicio, erros,
+                                              contador.total - sql_antes)
+    return resultados
+
+
+class _SemRedirecionar(HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def medir_servidor(app, contador, threads, segundos):
+    from werkzeug.serving import make_server
+
+    servidor = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{servidor.server_port}'
+    abrir = build_opener(_SemRedirecionar).open
+    resultados = {}
+    try:
+        for rota in ROTAS:
+            if not rota.servidor:
+                continue
+
+            def disparar(n):
+                latencias, erros, i = [], 0, n * 10 ** 6
+                fim = time.perf_counter() + segundos
+                while time.perf_counter() < fim:
+                    i += 1
+                    corpo = urlencode(rota.dados(i)).encode() if rota.dados else None
+                    comeco = time.perf_counter()
+                    try:
+                        with abrir(Request(base + rota.url, data=corpo, method=rota.metodo)) as resposta:
+                            resposta.read()
+                    except HTTPError as erro:
+                        erros += erro.code >= 400
+                    latencias.append((time.perf_counter() - comeco) * 1000)
+                return latencias, erros
+
+            sql_antes = contador.total
+            inicio = time.perf_counter()
+            with ThreadPoolExecutor(threads) as pool:
+                parciais = list(pool.map(disparar, range(threads)))
+            duracao = time.perf_counter() - inicio
+            latencias = [valor for parcial, _ in parciais for valor in parcial]
+            resultados[nome_rota(rota)] = resumir(latencias, duracao, sum(e for _, e in parciais),
+                                                  contador.total - sql_antes)
+    finally:
+        servidor.shutdown()
+    return resultados
+
+
+def executar(modos, repeticoes, threads, segundos):
+    # Roda dentro do subprocesso, já com o DATABASE_URL da escala
+    from app import app
+    from models import engine, engine_leitura
+
+    contador = ContadorSQL([engine, engine_leitura])
+    resultado = {}
+    if 'cliente' in modos:
+        resultado['cliente'] = medir_cliente(app, contador, repeticoes)
+    if 'servidor' in modos:
+        resultado['servidor'] = medir_servidor(app, contador, threads, segundos)
+    return resultado
+
+
+def preparar_base(pasta, escala):
+    # Gera a base da escala com o populate_db.py, ou reaproveita a existente
+    caminho = os.path.join(pasta, f'movimentacoes_{escala}.db')
+    if not os.path.exists(caminho):
+        print(f'Gerando base com {escala} movimentações em {caminho}...', file=sys.stderr)
+        ambiente = dict(os.environ, DATABASE_URL=f'sqlite:///{caminho}')
+        subprocess.run([sys.executable, 'populate_db.py', '--funcionarios', str(max(50, escala // 1000)),
+                        '--produtos', str(max(24, escala // 100)), '--movimentacoes', str(escala)],
+                       cwd=RAIZ, env=ambiente, check=True, stdout=subprocess.DEVNULL)
+    with sqlite3.connect(caminho) as conexao:
+        return caminho, conexao.execute('SELECT count(*) FROM movimentacoes').fetchone()[0]
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=RAIZ, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--escalas', type=int, nargs='+', default=ESCALAS)
+    parser.add_argument('--modos', nargs='+', choices=['cliente', 'servidor'], default=['cliente', 'servidor'])
+    parser.add_argument('--repeticoes', type=int, default=30)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--segundos', type=float, default=2)
+    parser.add_argument('--dados', default=os.path.join(RAIZ, 'benchmarks', 'dados'))
+    parser.add_argument('-o', '--saida', default=f"bench_rotas_{datetime.now():%Y%m%d_%H%M%S}.json")
+    parser.add_argument('--executar', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.executar:
+        print(json.dumps(executar(args.modos, args.repeticoes, args.threads, args.segundos)))
+        return
+
+    os.makedirs(args.dados, exist_ok=True)
+    relatorio = {'gerado_em': datetime.now().isoformat(timespec='seconds'), 'commit': _commit(),
+                 'python': sys.version.split()[0], 'escalas': {}, 'resultados': {}}
+    for escala in args.escalas:
+        origem, movimentacoes = preparar_base(args.dados, escala)
+        with tempfile.TemporaryDirectory() as pasta:
+            copia = os.path.join(pasta, 'bench.db')
+            with sqlite3.connect(origem) as fonte, sqlite3.connect(copia) as destino:
+                fonte.backup(destino)
+            ambiente = dict(os.environ, DATABASE_URL=f'sqlite:///{copia}')
+            ambiente.pop('CACHE_COMPARTILHADO', None)
+            saida = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.bench_rotas', '--executar', '--modos', *args.modos,
+                 '--repeticoes', str(args.repeticoes), '--threads', str(args.threads),
+                 '--segundos', str(args.segundos)],
+                cwd=RAIZ, env=ambiente, capture_output=True, text=True, check=True)
+        resultado = json.loads(saida.stdout.strip().splitlines()[-1])
+        relatorio['escalas'][str(escala)] = {'movimentacoes': movimentacoes}
+        relatorio['resultados'][str(escala)] = resultado
+
+        for modo, rotas in resultado.items():
+            print(f'\n{escala} movimentações sorteadas ({movimentacoes} gravadas), modo {modo}')
+            print(f"{'rota':<62}{'p50':>8}{'p95':>8}{'p99':>8}{'req/s':>9}{'sql':>6}{'erros':>6}")
+            for nome, r in rotas.items():
+                print(f"{nome[:61]:<62}{r['p50_ms']:>8.1f}{r['p95_ms']:>8.1f}{r['p99_ms']:>8.1f}"
+                      f"{r['req_s']:>9.1f}{r['sql_por_req']:>6.1f}{r['erros']:>6}")
+
+    with open(args.saida, 'w', encoding='utf-8') as arquivo:
+        json.dump(relatorio, arquivo, indent=2, ensure_ascii=False)
+    print(f'\nResultados gravados em {args.saida}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""Confere que cada lista faz um número fixo de consultas, seja qual for o tamanho da página.
+
+Uso: python -m benchmarks.contagem_consultas [--tamanhos 1 5 50]
+
+Roda numa cópia do banco com CARGA_ESTRITA ligada: um relacionamento
+carregado sob demanda levanta erro (a página responde 500) em vez de somar
+uma consulta por linha. Sai com código 1 se alguma rota falhar ou fugir do
+número esperado. ESPERADO também é a tabela de tests/test_consultas.py, que
+faz a mesma conferência no pytest.
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+from sqlalchemy import event
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# rota: (chave em app.POR_PAGINA ou parâmetro de limite da API, consultas esperadas)
+# As páginas HTML fazem a leitura das versões dos dados (ETag), a consulta da lista e a
+# leitura do contador de registros.
+ESPERADO = {
+    '/funcionario': ('funcionario', 3),
+    '/funcionario?ordem=nome_asc': ('funcionario', 3),
+    '/produto': ('produto', 3),
+    '/produto?ordem=nome_desc': ('produto', 3),
+    '/movimentacao': ('movimentacao', 3),
+    '/movimentacao?ordem=nome_asc': ('movimentacao', 3),
+    '/movimentacao?ordem=preco_desc': ('movimentacao', 3),
+    '/movimentacao?ordem=data_desc&pagina=2': ('movimentacao', 3),
+    '/categoria': ('categoria', 3),
+    # Página de produtos e uma consulta do estoque na data para todos eles
+    '/produto/estoque?data=2023-06-30': ('estoque', 2),
+    '/api/v1/estoque?data=2023-06-30': ('limite', 2),
+    '/api/v1/movimentacoes': ('limite', 1),
+    '/api/v1/produtos': ('limite', 1),
+    '/api/v1/funcionarios?ordem=nome': ('limite', 1),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tamanhos', type=int, nargs='+', default=[1, 5, 50])
+    args = parser.parse_args()
+
+    sys.path.insert(0, RAIZ)
+    import config
+    from sqlalchemy.engine import make_url
+
+    pasta = tempfile.mkdtemp()
+    copia = os.path.join(pasta, 'consultas.db')
+    with sqlite3.connect(make_url(config.DATABASE_URL).database) as origem, sqlite3.connect(copia) as destino:
+        origem.backup(destino)
+    # models.py lê estas configurações na importação
+    config.DATABASE_URL = f'sqlite:///{copia}'
+    config.CARGA_ESTRITA = True
+    import app as aplicacao
+    from models import engine, engine_leitura
+
+    comandos = [0]
+
+    def contar(*args):
+        comandos[0] += 1
+
+    for conexao in (engine, engine_leitura):
+        event.listen(conexao, 'before_cursor_execute', contar)
+
+    cliente = aplicacao.app.test_client()
+    falhas = 0
+    print(f"{'rota':<44}" + ''.join(f'{f"página {t}":>11}' for t in args.tamanhos) + f"{'esperado':>10}")
+    for rota, (chave, esperado) in ESPERADO.items():
+        contagens = []
+        for tamanho in args.tamanhos:
+            url = rota
+            if chave == 'limite':
+                url += ('&' if '?' in rota else '?') + f'limite={tamanho}'
+            else:
+                aplicacao.POR_PAGINA[chave] = tamanho
+            comandos[0] = 0
+            resposta = cliente.get(url)
+            contagens.append(comandos[0] if resposta.status_code == 200 else f'HTTP {resposta.status_code}')
+        ok = all(contagem == esperado for contagem in contagens)
+        falhas += not ok
+        print(f'{rota:<44}' + ''.join(f'{contagem:>11}' for contagem in contagens)
+              + f"{esperado:>10}{'' if ok else '  << FALHOU'}")
+
+    engine.dispose()
+    engine_leitura.dispose()
+    shutil.rmtree(pasta)
+    sys.exit(1 if falhas else 0)
+
+
+if __name__ == '__main__':
+    main()
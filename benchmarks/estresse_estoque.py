@@ -0,0 +1,102 @@
+"""Mede a vazão de movimentações concorrentes por perfil da engine.
+
+Uso: python -m benchmarks.estresse_estoque [--threads 8] [--movimentacoes 500] [--perfil desempenho]
+
+A garantia de que o estoque nunca fica negativo e de que saídas conflitantes
+são recusadas é testada em tests/test_estoque.py; aqui o estoque final só é
+conferido para a medição não esconder erros.
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+from sqlalchemy import select, func
+from sqlalchemy.orm import sessionmaker
+
+from config import PERFIS, criar_engine
+from estoque import ENTRADA, SAIDA, registrar_movimentacao
+from models import Base, Categoria, Funcionario, Movimentacao, Produto
+
+
+def preparar_banco(caminho, perfil, n_produtos, estoque_inicial):
+    engine = criar_engine(f'sqlite:///{caminho}', perfil, connect_args={'timeout': 60})
+    Base.metadata.create_all(engine)
+    Sessao = sessionmaker(bind=engine)
+    with Sessao() as session:
+        categoria = Categoria(nome_categoria='Estresse')
+        session.add(categoria)
+        session.add(Funcionario(nome_funcionario='Teste', sobrenome='Estresse',
+                                email='estresse@exemplo.com', cpf='00000000000'))
+        session.flush()
+        session.add_all([Produto(nome_produto=f'Produto {i}', preco_produto=1.0, qtd=estoque_inicial,
+                                 id_categoria=categoria.id_categoria) for i in range(n_produtos)])
+        session.commit()
+    return engine, Sessao
+
+
+def trabalhador(Sessao, ids_produtos, n_movimentacoes, semente, aceitas):
+    aleatorio = random.Random(semente)
+    saldo = {}
+    n_aceitas = 0
+    for _ in range(n_movimentacoes):
+        id_produto = aleatorio.choice(ids_produtos)
+        quantidade = aleatorio.randint(1, 20)
+        status = SAIDA if aleatorio.random() < 0.7 else ENTRADA
+        with Sessao.begin() as session:
+            erro = registrar_movimentacao(session, 1, id_produto, 'Estresse', quantidade, status)
+        if erro is None:
+            n_aceitas += 1
+            saldo[id_produto] = saldo.get(id_produto, 0) + (quantidade if status == ENTRADA else -quantidade)
+    aceitas.append((saldo, n_aceitas))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--movimentacoes', type=int, default=500, help='por thread')
+    parser.add_argument('--produtos', type=int, default=4)
+    parser.add_argument('--estoque-inicial', type=int, default=200)
+    parser.add_argument('--perfil', default='desempenho', choices=list(PERFIS))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as pasta:
+        engine, Sessao = preparar_banco(os.path.join(pasta, 'estresse.db'), args.perfil, args.produtos, args.estoque_inicial)
+        with Sessao() as session:
+            ids_produtos = session.execute(select(Produto.id_produto)).scalars().all()
+
+        aceitas = []
+        threads = [threading.Thread(target=trabalhador,
+                                    args=(Sessao, ids_produtos, args.movimentacoes, semente, aceitas))
+                   for semente in range(args.threads)]
+        inicio = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        duracao = time.perf_counter() - inicio
+
+        esperado = {id_produto: args.estoque_inicial for id_produto in ids_produtos}
+        for saldo, _ in aceitas:
+            for id_produto, delta in saldo.items():
+                esperado[id_produto] += delta
+
+        with Sessao() as session:
+            final = dict(session.execute(select(Produto.id_produto, Produto.qtd)).all())
+            n_gravadas = session.execute(select(func.count()).select_from(Movimentacao)).scalar()
+        engine.dispose()
+
+    n_aceitas = sum(n for _, n in aceitas)
+    total = args.threads * args.movimentacoes
+    print(f'{total} movimentações em {duracao:.2f}s ({total / duracao:.0f}/s), {n_gravadas} gravadas')
+    print(f'estoque final: {final}')
+    assert len(aceitas) == args.threads, 'alguma thread falhou'
+    assert n_gravadas == n_aceitas, f'{n_aceitas} aceitas, {n_gravadas} gravadas'
+    assert final == esperado, f'estoque divergente: esperado {esperado}'
+    assert min(final.values()) >= 0, 'estoque negativo'
+
+
+if __name__ == '__main__':
+    main()
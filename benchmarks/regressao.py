@@ -0,0 +1,69 @@
+"""Compara duas execuções do bench_rotas e aponta as rotas que ficaram mais lentas.
+
+Uso: python -m benchmarks.regressao base.json novo.json [--metrica p95_ms] [--limite 1.2]
+                                    [--minimo-ms 1] [--rotas "GET /dashboard" ...] [--todas]
+
+Uma rota regrediu quando a métrica cresceu mais que --limite vezes (e mais que
+--minimo-ms, para ignorar ruído em rotas rápidas) ou quando passou a fazer mais
+comandos SQL por requisição. Por padrão só as rotas vigiadas derrubam a saída
+(código 1); as demais aparecem no relatório.
+"""
+import argparse
+import json
+import sys
+
+VIGIADAS = ['GET /movimentacao', 'GET /dashboard', 'GET /produto/grafico', 'GET /produto/grafico/dados']
+
+
+def comparar(base, novo, metrica='p95_ms', limite=1.2, minimo_ms=1.0):
+    # Retorna [(escala, modo, rota, antes, depois, razão, sql antes, sql depois, regrediu)]
+    linhas = []
+    for escala, modos in novo['resultados'].items():
+        for modo, rotas in modos.items():
+            anteriores = base['resultados'].get(escala, {}).get(modo, {})
+            for rota, depois in rotas.items():
+                antes = anteriores.get(rota)
+                if not antes or antes.get(metrica) is None or depois.get(metrica) is None:
+                    continue
+                razao = depois[metrica] / antes[metrica] if antes[metrica] else float('inf')
+                mais_lenta = razao > limite and depois[metrica] - antes[metrica] > minimo_ms
+                mais_sql = (depois['sql_por_req'] or 0) > (antes['sql_por_req'] or 0) + 0.5
+                linhas.append((escala, modo, rota, antes[metrica], depois[metrica], razao,
+                               antes['sql_por_req'], depois['sql_por_req'], mais_lenta or mais_sql))
+    return linhas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('base')
+    parser.add_argument('novo')
+    parser.add_argument('--metrica', default='p95_ms', choices=['p50_ms', 'p95_ms', 'p99_ms'])
+    parser.add_argument('--limite', type=float, default=1.2)
+    parser.add_argument('--minimo-ms', type=float, default=1.0)
+    parser.add_argument('--rotas', nargs='+', default=VIGIADAS)
+    parser.add_argument('--todas', action='store_true', help='qualquer rota que piorar derruba a saída')
+    args = parser.parse_args()
+
+    with open(args.base, encoding='utf-8') as arquivo:
+        base = json.load(arquivo)
+    with open(args.novo, encoding='utf-8') as arquivo:
+        novo = json.load(arquivo)
+
+    linhas = comparar(base, novo, args.metrica, args.limite, args.minimo_ms)
+    print(f"{'escala':>8} {'modo':<9}{'rota':<56}{'antes':>9}{'depois':>9}{'razão':>7}{'sql':>12}")
+    falhou = False
+    for escala, modo, rota, antes, depois, razao, sql_antes, sql_depois, regrediu in \
+            sorted(linhas, key=lambda linha: -linha[5]):
+        # "GET /movimentacao" vigia também as variantes com query string
+        vigiada = args.todas or rota in args.rotas or rota.split('?')[0] in args.rotas
+        marca = ''
+        if regrediu:
+            marca = '  << REGRESSÃO' if vigiada else '  < piorou'
+            falhou = falhou or vigiada
+        print(f'{escala:>8} {modo:<9}{rota[:55]:<56}{antes:>9.1f}{depois:>9.1f}{razao:>7.2f}'
+              f'{sql_antes:>6.1f}→{sql_depois:<5.1f}{marca}')
+    sys.exit(1 if falhou else 0)
+
+
+if __name__ == '__main__':
+    main()
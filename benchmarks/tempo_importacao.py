@@ -0,0 +1,117 @@
+"""Tempo de importação e memória na subida do app, a partir do relatório -X importtime.
+
+Uso: python -m benchmarks.tempo_importacao [--modulos app models api] [--repeticoes 5]
+                                           [--top 12] [--grafico] [-o resultado.json]
+
+Cada módulo é importado num interpretador novo com -X importtime, --repeticoes
+vezes (vale a melhor). Saem o tempo acumulado da importação, o pico de memória
+(RSS) do processo e os pacotes que mais pesaram, somando o tempo próprio de cada
+submódulo. --grafico mede também o custo de servir o primeiro gráfico (a página
+e a série de /produto/grafico/dados).
+
+Sai com código 1 se importar o app carregar algum dos pacotes de CARGA_SOB_DEMANDA:
+eles só podem entrar na primeira requisição que precisa deles.
+"""
+from collections import defaultdict
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULOS = ['app', 'models', 'api', 'exportacao', 'importacao']
+# Pacotes pesados que o app só pode importar na primeira vez que usa
+CARGA_SOB_DEMANDA = ['plotly', 'pandas', 'numpy', 'openpyxl']
+# "import time: self [us] | cumulative | imported package", com o nome indentado pela profundidade
+LINHA = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$')
+
+PROGRAMA = '''
+import json, resource, sys
+import {modulo}
+{depois}
+print(json.dumps({{'rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                  'carregados': sorted({{nome.split('.')[0] for nome in sys.modules}})}}))
+'''
+PRIMEIRO_GRAFICO = '''
+import time
+inicio = time.perf_counter()
+cliente = app.app.test_client()
+cliente.get('/produto/grafico')
+cliente.get('/produto/grafico/dados')
+print(time.perf_counter() - inicio, file=sys.stderr)
+'''
+
+
+def medir(modulo, depois=''):
+    # Retorna (ms acumulados do módulo, {pacote: ms próprios}, rss em KB, pacotes carregados, saída extra)
+    processo = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                               PROGRAMA.format(modulo=modulo, depois=depois)],
+                              cwd=RAIZ, capture_output=True, text=True, check=True)
+    total = 0
+    por_pacote = defaultdict(float)
+    extra = []
+    for linha in processo.stderr.splitlines():
+        casou = LINHA.match(linha)
+        if not casou:
+            extra.append(linha)
+            continue
+        proprio, acumulado, recuo, nome = casou.groups()
+        por_pacote[nome.split('.')[0]] += int(proprio) / 1000
+        if not recuo and nome == modulo:
+            total = int(acumulado) / 1000
+    resultado = json.loads(processo.stdout.splitlines()[-1])
+    return total, dict(por_pacote), resultado['rss_kb'], resultado['carregados'], extra
+
+
+def melhor_de(repeticoes, modulo, depois=''):
+    medicoes = [medir(modulo, depois) for _ in range(repeticoes)]
+    return min(medicoes, key=lambda medicao: medicao[0])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modulos', nargs='+', default=MODULOS)
+    parser.add_argument('--repeticoes', type=int, default=5)
+    parser.add_argument('--top', type=int, default=12)
+    parser.add_argument('--grafico', action='store_true', help='mede também o primeiro /produto/grafico')
+    parser.add_argument('-o', '--saida')
+    args = parser.parse_args()
+
+    relatorio = {}
+    falhou = False
+    print(f"{'módulo':<14}{'importação':>12}{'RSS':>10}  carregou sob demanda")
+    for modulo in args.modulos:
+        total, por_pacote, rss_kb, carregados, _ = melhor_de(args.repeticoes, modulo)
+        indevidos = [pacote for pacote in CARGA_SOB_DEMANDA if pacote in carregados]
+        if modulo == 'app' and indevidos:
+            falhou = True
+        relatorio[modulo] = {'importacao_ms': round(total, 1), 'rss_mb': round(rss_kb / 1024, 1),
+                             'indevidos': indevidos,
+                             'pacotes_ms': {pacote: round(ms, 1) for pacote, ms in
+                                            sorted(por_pacote.items(), key=lambda item: -item[1])[:args.top]}}
+        print(f'{modulo:<14}{total:>10.0f}ms{rss_kb / 1024:>8.1f}MB  '
+              f"{', '.join(indevidos) or '-'}{'  << FALHOU' if modulo == 'app' and indevidos else ''}")
+
+    if 'app' in relatorio:
+        print('\nPacotes mais pesados ao importar o app (tempo próprio somado):')
+        for pacote, ms in relatorio['app']['pacotes_ms'].items():
+            print(f'  {pacote:<24}{ms:>8.1f} ms')
+
+    if args.grafico:
+        total, por_pacote, rss_kb, _, extra = melhor_de(args.repeticoes, 'app', PRIMEIRO_GRAFICO)
+        segundos = float(extra[-1])
+        relatorio['primeiro_grafico'] = {'ms': round(segundos * 1000, 1), 'rss_mb': round(rss_kb / 1024, 1)}
+        print(f"\nPrimeiro /produto/grafico: {segundos * 1000:.0f} ms, RSS {rss_kb / 1024:.1f} MB "
+              f"(+{rss_kb / 1024 - relatorio['app']['rss_mb']:.1f} MB sobre o app recém-importado)"
+              if 'app' in relatorio else f'\nPrimeiro /produto/grafico: {segundos * 1000:.0f} ms')
+
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as arquivo:
+            json.dump(relatorio, arquivo, indent=2, ensure_ascii=False)
+    sys.exit(1 if falhou else 0)
+
+
+if __name__ == '__main__':
+    main()
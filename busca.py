@@ -0,0 +1,52 @@
+"""Busca textual de produtos e funcionários (SQLite FTS5).
+
+Uso: python busca.py   (reconstrói os índices de busca)
+"""
+import re
+
+from sqlalchemy import text
+from models import Base, db_leitura, engine, exigir_sqlite, fts_disponivel, instalar_busca
+
+# Pesos do bm25 por coluna: o nome pesa mais que categoria, e-mail ou CPF
+CONSULTA_PRODUTOS = text(
+    "SELECT p.id_produto, p.nome_produto, p.qtd, p.preco_produto, produtos_fts.nome_categoria "
+    "FROM produtos_fts JOIN produtos p ON p.id_produto = produtos_fts.rowid "
+    "WHERE produtos_fts MATCH :termo "
+    "ORDER BY bm25(produtos_fts, 10.0, 1.0), p.id_produto LIMIT :limite OFFSET :inicio")
+CONSULTA_FUNCIONARIOS = text(
+    "SELECT f.id_funcionario, f.nome_funcionario, f.sobrenome, f.email, f.cpf "
+    "FROM funcionarios_fts JOIN funcionarios f ON f.id_funcionario = funcionarios_fts.rowid "
+    "WHERE funcionarios_fts MATCH :termo "
+    "ORDER BY bm25(funcionarios_fts, 10.0, 8.0, 2.0, 2.0), f.id_funcionario LIMIT :limite OFFSET :inicio")
+CONSULTAS = {'produtos': CONSULTA_PRODUTOS, 'funcionarios': CONSULTA_FUNCIONARIOS}
+
+
+def expressao_fts(termo):
+    # Cada palavra vira um prefixo entre aspas (sem operadores do FTS vindos do usuário)
+    palavras = re.findall(r'\w+', termo)
+    return ' '.join(f'"{palavra}"*' for palavra in palavras)
+
+
+def buscar(tipo, termo, pagina=1, por_pagina=20, session=db_leitura):
+    # Retorna (linhas, tem_mais)
+    exigir_sqlite('A busca textual')
+    expressao = expressao_fts(termo)
+    if not expressao:
+        return [], False
+    linhas = session.execute(CONSULTAS[tipo], {
+        'termo': expressao, 'limite': por_pagina + 1, 'inicio': (pagina - 1) * por_pagina}).all()
+    return linhas[:por_pagina], len(linhas) > por_pagina
+
+
+def reconstruir_busca():
+    with engine.begin() as conexao:
+        if not fts_disponivel(conexao):
+            raise RuntimeError('Este SQLite não foi compilado com FTS5.')
+        conexao.exec_driver_sql("DROP TABLE IF EXISTS produtos_fts")
+        conexao.exec_driver_sql("DROP TABLE IF EXISTS funcionarios_fts")
+        instalar_busca(Base.metadata, conexao)
+
+
+if __name__ == '__main__':
+    reconstruir_busca()
+    print('Índices de busca reconstruídos.')
@@ -0,0 +1,149 @@
+from collections import OrderedDict
+import pickle
+import sqlite3
+import threading
+import time
+
+from config import CACHE_COMPARTILHADO, CACHE_MAXIMO, CACHE_TTL
+
+CACHES = {}
+
+
+class MemoriaLRU:
+    """Backend em memória do processo: descarta o item menos usado e os expirados."""
+
+    def __init__(self, maximo=CACHE_MAXIMO, ttl=CACHE_TTL, maximo_bytes=None):
+        self.maximo = maximo
+        self.ttl = ttl
+        # Com maximo_bytes, a soma dos valores bytes/str também limita o cache
+        self.maximo_bytes = maximo_bytes
+        self._bytes = 0
+        self._itens = OrderedDict()
+        self._trava = threading.Lock()
+
+    @staticmethod
+    def _tamanho(valor):
+        return len(valor) if isinstance(valor, (bytes, str)) else 0
+
+    def _remover(self, chave):
+        self._bytes -= self._tamanho(self._itens.pop(chave)[1])
+
+    def ler(self, chave):
+        # Retorna (versão, valor) ou None
+        with self._trava:
+            item = self._itens.get(chave)
+            if item is None:
+                return None
+            if item[2] is not None and item[2] < time.time():
+                self._remover(chave)
+                return None
+            self._itens.move_to_end(chave)
+            return item[0], item[1]
+
+    def gravar(self, chave, versao, valor):
+        expira = time.time() + self.ttl if self.ttl else None
+        tamanho = self._tamanho(valor)
+        with self._trava:
+            if chave in self._itens:
+                self._remover(chave)
+            if self.maximo_bytes is not None and tamanho > self.maximo_bytes:
+                return
+            self._itens[chave] = (versao, valor, expira)
+            self._bytes += tamanho
+            while len(self._itens) > self.maximo or \
+                    (self.maximo_bytes is not None and self._bytes > self.maximo_bytes):
+                self._remover(next(iter(self._itens)))
+
+    def limpar(self, prefixo=''):
+        with self._trava:
+            for chave in [chave for chave in self._itens if chave.startswith(prefixo)]:
+                self._remover(chave)
+
+    def __len__(self):
+        return len(self._itens)
+
+
+class ArmazemSQLite:
+    """Backend num arquivo SQLite à parte, compartilhado pelos workers.
+
+    Guarda os fragmentos já gerados; as versões que os validam vêm do banco
+    principal (versoes.py), então qualquer backend enxerga as escritas de todos.
+    """
+
+    def __init__(self, caminho, ttl=CACHE_TTL):
+        self.caminho = caminho
+        self.ttl = ttl
+        self._local = threading.local()
+        conexao = self._conexao()
+        conexao.execute("PRAGMA journal_mode=WAL")
+        conexao.execute("CREATE TABLE IF NOT EXISTS fragmentos "
+                        "(chave TEXT PRIMARY KEY, dados BLOB NOT NULL, expira REAL)")
+
+    def _conexao(self):
+        # Uma conexão por thread; autocommit (isolation_level=None)
+        conexao = getattr(self._local, 'conexao', None)
+        if conexao is None:
+            conexao = sqlite3.connect(self.caminho, timeout=5, isolation_level=None)
+            conexao.execute("PRAGMA synchronous=NORMAL")
+            self._local.conexao = conexao
+        return conexao
+
+    def ler(self, chave):
+        linha = self._conexao().execute(
+            "SELECT dados FROM fragmentos WHERE chave = ? AND (expira IS NULL OR expira >= ?)",
+            (chave, time.time())).fetchone()
+        return pickle.loads(linha[0]) if linha else None
+
+    def gravar(self, chave, versao, valor):
+        expira = time.time() + self.ttl if self.ttl else None
+        self._conexao().execute(
+            "INSERT OR REPLACE INTO fragmentos (chave, dados, expira) VALUES (?, ?, ?)",
+            (chave, pickle.dumps((versao, valor)), expira))
+
+    def limpar(self, prefixo=''):
+        self._conexao().execute("DELETE FROM fragmentos WHERE substr(chave, 1, ?) = ?", (len(prefixo), prefixo))
+
+    def __len__(self):
+        return self._conexao().execute("SELECT count(*) FROM fragmentos").fetchone()[0]
+
+
+_armazem = ArmazemSQLite(CACHE_COMPARTILHADO) if CACHE_COMPARTILHADO else None
+
+
+class CacheVersionado:
+    """Guarda um valor por chave, válido enquanto a versão dos dados não mudar."""
+
+    def __init__(self, nome, backend=None):
+        self.nome = nome
+        self.acertos = 0
+        self.falhas = 0
+        if backend is None:
+            backend = MemoriaLRU() if _armazem is None else _armazem
+        self.backend = backend
+        self._prefixo = f'{nome}:'
+        CACHES[nome] = self
+
+    def obter(self, chave, versao, gerar):
+        # Retorna (valor, acerto); sem versão (versoes.assinatura() devolveu None) nada é guardado
+        if versao is None:
+            self.falhas += 1
+            return gerar(), False
+        item = self.backend.ler(self._prefixo + str(chave))
+        if item is not None and item[0] == versao:
+            self.acertos += 1
+            return item[1], True
+        self.falhas += 1
+        valor = gerar()
+        self.backend.gravar(self._prefixo + str(chave), versao, valor)
+        return valor, False
+
+    def limpar(self):
+        self.backend.limpar(self._prefixo)
+
+    def estatisticas(self):
+        return {'acertos': self.acertos, 'falhas': self.falhas,
+                'backend': type(self.backend).__name__, 'itens_no_backend': len(self.backend)}
+
+
+def estatisticas():
+    return {nome: cache.estatisticas() for nome, cache in CACHES.items()}
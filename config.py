@@ -0,0 +1,133 @@
+"""Configuração do banco de dados.
+
+DATABASE_URL escolhe o banco (padrão: o SQLite local) e DB_PERFIL escolhe o
+perfil de desempenho da engine, ambos lidos do ambiente; DB_POOL_TAMANHO e
+DB_POOL_EXTRA ajustam o pool de um banco servidor. As variáveis CACHE_*
+configuram o cache de fragmentos, SQL_LENTA_MS o log de consultas lentas,
+METRICAS_TOKEN o acesso às métricas e COMPRESSAO_MINIMO o tamanho a partir do qual as respostas são comprimidas.
+ARQUIVO_MOVIMENTACOES e ARQUIVAR_APOS_MESES configuram o arquivamento das
+movimentações antigas (arquivamento.py) e as variáveis TAREFAS_* as tarefas em
+segundo plano (tarefas.py).
+"""
+import os
+import tempfile
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+
+DATABASE_URL = os.environ.get('DATABASE_URL', 'sqlite:///sql_prejetofinal.db')
+DB_PERFIL = os.environ.get('DB_PERFIL', 'desempenho')
+DB_POOL_TAMANHO = os.environ.get('DB_POOL_TAMANHO')
+DB_POOL_EXTRA = os.environ.get('DB_POOL_EXTRA')
+
+# Cache de fragmentos: em memória (LRU) por padrão. CACHE_COMPARTILHADO aponta um
+# arquivo SQLite usado por todos os workers para os fragmentos. A validade vem sempre
+# da versão dos dados guardada no banco principal (versoes.py).
+CACHE_COMPARTILHADO = os.environ.get('CACHE_COMPARTILHADO')
+CACHE_MAXIMO = int(os.environ.get('CACHE_MAXIMO', 512))
+CACHE_TTL = float(os.environ.get('CACHE_TTL', 0)) or None  # segundos; vazio ou 0 = sem expiração
+
+# CARGA_ESTRITA=1 (testes e desenvolvimento): carregar um relacionamento sob demanda
+# com SQL levanta erro, em vez de fazer uma consulta por linha em silêncio
+CARGA_ESTRITA = os.environ.get('CARGA_ESTRITA') == '1'
+
+# Comandos SQL a partir deste tempo entram no log de consultas lentas (metricas.py)
+SQL_LENTA_MS = float(os.environ.get('SQL_LENTA_MS', 200))
+# Por padrão o log só guarda os tipos dos parâmetros (podem ser CPF, e-mail, telefone);
+# SQL_LENTA_PARAMETROS=1 grava os valores, só para depuração local
+SQL_LENTA_PARAMETROS = os.environ.get('SQL_LENTA_PARAMETROS') == '1'
+
+# /metrics, /metrics/lentas e /cache/estatisticas ficam desligados (404) sem METRICAS_TOKEN;
+# com ele, exigem o cabeçalho "Authorization: Bearer <token>" (bearer_token do Prometheus)
+METRICAS_TOKEN = os.environ.get('METRICAS_TOKEN')
+
+# Respostas de texto menores que isto saem sem compressão (respostas.py)
+COMPRESSAO_MINIMO = int(os.environ.get('COMPRESSAO_MINIMO', 500))
+
+# Movimentações antigas vão para um segundo arquivo SQLite (padrão: <banco>_arquivo.db ao
+# lado do banco principal); ARQUIVAR_APOS_MESES é o corte padrão do arquivamento
+ARQUIVO_MOVIMENTACOES = os.environ.get('ARQUIVO_MOVIMENTACOES')
+ARQUIVAR_APOS_MESES = int(os.environ.get('ARQUIVAR_APOS_MESES', 24))
+
+# Tarefas em segundo plano: threads do pool, pasta dos arquivos gerados e por quantas
+# horas as tarefas terminadas (e seus arquivos) são guardadas
+TAREFAS_TRABALHADORES = int(os.environ.get('TAREFAS_TRABALHADORES', 4))
+TAREFAS_PASTA = os.environ.get('TAREFAS_PASTA') or os.path.join(tempfile.gettempdir(), 'estoque_tarefas')
+TAREFAS_RETENCAO_HORAS = float(os.environ.get('TAREFAS_RETENCAO_HORAS', 24))
+
+PERFIS = {
+    # Comportamento original: journal de rollback, sem ajustes
+    'compatibilidade': {
+        'sqlite': {},
+        'servidor': {},
+    },
+    # WAL: leitores não bloqueiam o escritor; synchronous=NORMAL é seguro com WAL
+    'desempenho': {
+        'sqlite': {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'cache_size': -64000,  # em KiB (64 MiB)
+            'mmap_size': 268435456,
+            'temp_store': 'MEMORY',
+            'busy_timeout': 5000,
+        },
+        'servidor': {'pool_size': 10, 'max_overflow': 20, 'pool_pre_ping': True, 'pool_recycle': 1800},
+    },
+    # WAL com fsync a cada commit
+    'seguro': {
+        'sqlite': {
+            'journal_mode': 'WAL',
+            'synchronous': 'FULL',
+            'busy_timeout': 10000,
+        },
+        'servidor': {'pool_size': 5, 'max_overflow': 5, 'pool_pre_ping': True, 'pool_recycle': 900},
+    },
+}
+
+
+def opcoes_servidor(configuracao):
+    # Pool do perfil, com o tamanho sobrescrito pelo ambiente
+    opcoes = dict(configuracao['servidor'])
+    if DB_POOL_TAMANHO:
+        opcoes['pool_size'] = int(DB_POOL_TAMANHO)
+    if DB_POOL_EXTRA:
+        opcoes['max_overflow'] = int(DB_POOL_EXTRA)
+    return opcoes
+
+
+def criar_engine(url=None, perfil=None, somente_leitura=False, **kwargs):
+    url = make_url(url or DATABASE_URL)
+    configuracao = PERFIS[perfil or DB_PERFIL]
+
+    if url.get_backend_name() != 'sqlite':
+        # Os recursos que dependem de gatilhos, FTS5 ou ATTACH ficam desligados (models.exigir_sqlite)
+        engine = create_engine(url, **{**opcoes_servidor(configuracao), **kwargs})
+        if somente_leitura and url.get_backend_name() == 'postgresql':
+            engine = engine.execution_options(postgresql_readonly=True)
+        return engine
+
+    engine = create_engine(url, **kwargs)
+    pragmas = dict(configuracao['sqlite'])
+    if somente_leitura:
+        # Qualquer escrita nesta engine falha em vez de pegar o lock de escrita
+        pragmas['query_only'] = 'ON'
+
+    @event.listens_for(engine, 'connect')
+    def _aplicar_pragmas(conexao_dbapi, registro):
+        cursor = conexao_dbapi.cursor()
+        for nome, valor in pragmas.items():
+            cursor.execute(f'PRAGMA {nome} = {valor}')
+        cursor.close()
+
+    return engine
+
+
+def caminho_arquivo(url=None):
+    # Caminho absoluto do banco de arquivo; None quando o principal não é um arquivo SQLite
+    if ARQUIVO_MOVIMENTACOES:
+        return os.path.abspath(ARQUIVO_MOVIMENTACOES)
+    url = make_url(url or DATABASE_URL)
+    if url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:'):
+        return None
+    raiz, _ = os.path.splitext(os.path.abspath(url.database))
+    return f'{raiz}_arquivo.db'
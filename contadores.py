@@ -0,0 +1,32 @@
+from sqlalchemy import select, delete, func
+from models import Base, Contador, Produto, db_leitura, engine, exigir_sqlite, instalar_contadores, usa_sqlite
+from arquivamento import somar_arquivadas
+
+
+def contar(nome, session=db_leitura):
+    # Leitura O(1) pela chave primária, no lugar de COUNT(*)
+    if not usa_sqlite():
+        return _contar_direto(nome, session)
+    return session.execute(select(Contador.valor).where(Contador.nome == nome)).scalar() or 0
+
+
+def _contar_direto(nome, session):
+    # Sem os gatilhos do SQLite não há contadores: conta na hora
+    if nome == 'estoque_total':
+        return session.execute(select(func.coalesce(func.sum(Produto.qtd), 0))).scalar()
+    return session.execute(select(func.count()).select_from(Base.metadata.tables[nome])).scalar()
+
+
+def reconstruir_contadores():
+    # Recalcula todos os contadores e recria os gatilhos que faltarem
+    exigir_sqlite('A reconstrução dos contadores')
+    with engine.begin() as conexao:
+        conexao.execute(delete(Contador))
+        instalar_contadores(Base.metadata, conexao)
+        somar_arquivadas(conexao, contador=True)
+        return dict(conexao.execute(select(Contador.nome, Contador.valor)).all())
+
+
+if __name__ == '__main__':
+    for nome, valor in reconstruir_contadores().items():
+        print(f'{nome}: {valor}')
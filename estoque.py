@@ -0,0 +1,47 @@
+from datetime import datetime
+
+from sqlalchemy import select, update, func
+from models import Movimentacao, Produto
+
+ENTRADA = '1'
+SAIDA = '0'
+
+
+def ajustar_estoque(session, id_produto, delta):
+    # UPDATE condicional: a checagem de saldo e a escrita são uma única instrução,
+    # então saídas concorrentes não perdem atualizações nem vendem além do estoque.
+    stmt = update(Produto).where(Produto.id_produto == id_produto)
+    if delta < 0:
+        stmt = stmt.where(Produto.qtd >= -delta)
+    stmt = stmt.values(qtd=func.coalesce(Produto.qtd, 0) + delta).execution_options(synchronize_session=False)
+    return session.execute(stmt).rowcount == 1
+
+
+def registrar_movimentacao(session, id_funcionario, id_produto, fornecedor, quantidade, status, data=None):
+    """Atualiza o estoque e adiciona a movimentação à transação da sessão.
+
+    Retorna None em caso de sucesso ou a mensagem de erro; quem chama confirma
+    a transação (ex.: ``unidade_de_trabalho()``).
+    """
+    if status not in (ENTRADA, SAIDA):
+        return "Status inválido."
+    delta = quantidade if status == ENTRADA else -quantidade
+
+    if not ajustar_estoque(session, id_produto, delta):
+        disponivel = session.execute(select(Produto.qtd).where(Produto.id_produto == id_produto)).first()
+        if disponivel is None:
+            return "Produto não encontrado."
+        return f"Estoque insuficiente. Disponível: {disponivel.qtd or 0}."
+
+    # O valor é calculado no próprio INSERT, com o preço vigente na transação
+    valor = select(func.round(Produto.preco_produto * quantidade, 2)).where(Produto.id_produto == id_produto).scalar_subquery()
+    session.add(Movimentacao(
+        id_funcionario=id_funcionario,
+        id_produto=id_produto,
+        fornecedor=fornecedor,
+        quantidade_produto=quantidade,
+        valor_movimentacao=valor,
+        data_da_movimentacao=data or datetime.now(),
+        status=status
+    ))
+    return None
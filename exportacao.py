@@ -0,0 +1,126 @@
+"""Exportação de movimentações em CSV ou XLSX, com memória limitada.
+
+Uso: python exportacao.py [--de AAAA-MM-DD] [--ate AAAA-MM-DD] [--id-produto N]
+                          [--status 0|1] [--formato csv|xlsx] -o arquivo
+"""
+from datetime import date
+import argparse
+import csv
+import io
+
+from sqlalchemy import select, union_all
+from models import Categoria, Funcionario, Movimentacao, MovimentacaoArquivada, Produto, engine_leitura
+from arquivamento import alcanca_arquivo, consulta_arquivada, so_no_arquivo
+
+LOTE = 5000
+CABECALHO = ['id_movimentacao', 'data', 'status', 'quantidade', 'fornecedor',
+             'produto', 'categoria', 'preco_unitario', 'funcionario', 'valor']
+STATUS = {'1': 'Entrada', '0': 'Saída'}
+
+
+def _consulta(m, de, ate, id_produto, status):
+    stmt = (select(m.id_movimentacao,
+                   m.data_da_movimentacao,
+                   m.status,
+                   m.quantidade_produto,
+                   m.fornecedor,
+                   Produto.nome_produto,
+                   Categoria.nome_categoria,
+                   Produto.preco_produto,
+                   (Funcionario.nome_funcionario + ' ' + Funcionario.sobrenome).label('funcionario'),
+                   m.valor_movimentacao)
+            .join(Produto, Produto.id_produto == m.id_produto)
+            .outerjoin(Categoria, Categoria.id_categoria == Produto.id_categoria)
+            .join(Funcionario, Funcionario.id_funcionario == m.id_funcionario))
+    if de:
+        stmt = stmt.where(m.data_da_movimentacao >= de)
+    if ate:
+        stmt = stmt.where(m.data_da_movimentacao <= ate)
+    if id_produto:
+        stmt = stmt.where(m.id_produto == id_produto)
+    if status:
+        stmt = stmt.where(m.status == status)
+    return stmt
+
+
+def consulta_exportacao(de=None, ate=None, id_produto=None, status=None):
+    stmt = _consulta(Movimentacao, de, ate, id_produto, status)
+    if not alcanca_arquivo(de):
+        return stmt.order_by(Movimentacao.data_da_movimentacao, Movimentacao.id_movimentacao)
+    # Período que começa antes do corte: as arquivadas entram na mesma ordem
+    arquivadas = _consulta(MovimentacaoArquivada, de, ate, id_produto, status).where(so_no_arquivo())
+    uniao = union_all(stmt, arquivadas)
+    return consulta_arquivada(uniao.order_by(uniao.selected_columns.data_da_movimentacao,
+                                             uniao.selected_columns.id_movimentacao))
+
+
+def linhas_exportacao(stmt, a_cada_lote=None):
+    # Cursor do lado do servidor lido em lotes; tuplas do Core, sem montar objetos do ORM.
+    # a_cada_lote(linhas lidas) roda a cada LOTE linhas (progresso e cancelamento das tarefas).
+    with engine_leitura.connect() as conexao:
+        resultado = conexao.execution_options(stream_results=True, yield_per=LOTE).execute(stmt)
+        for n, linha in enumerate(resultado, start=1):
+            if a_cada_lote is not None and n % LOTE == 0:
+                a_cada_lote(n)
+            linha = list(linha)
+            linha[1] = linha[1].isoformat() if linha[1] else ''
+            linha[2] = STATUS.get(linha[2], linha[2])
+            yield linha
+
+
+def gerar_csv(stmt, a_cada_lote=None):
+    # Devolve o CSV em pedaços de até LOTE linhas
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    escritor.writerow(CABECALHO)
+    for n, linha in enumerate(linhas_exportacao(stmt, a_cada_lote), start=1):
+        escritor.writerow(linha)
+        if n % LOTE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def gravar_xlsx(stmt, destino, a_cada_lote=None):
+    # Modo write_only do openpyxl: as linhas vão para o disco, não ficam na memória.
+    # Importado só aqui: o openpyxl é opcional e pesa na subida de quem nunca exporta XLSX.
+    try:
+        from openpyxl import Workbook
+    except ImportError:
+        raise RuntimeError("Exportar XLSX requer o pacote 'openpyxl'.")
+    planilha = Workbook(write_only=True)
+    aba = planilha.create_sheet('Movimentações')
+    aba.append(CABECALHO)
+    try:
+        for linha in linhas_exportacao(stmt, a_cada_lote):
+            aba.append(linha)
+    except BaseException:
+        # Interrompida (erro ou tarefa cancelada): fecha a aba e o arquivo temporário dela
+        aba.close()
+        raise
+    planilha.save(destino)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--de', type=date.fromisoformat)
+    parser.add_argument('--ate', type=date.fromisoformat)
+    parser.add_argument('--id-produto', type=int)
+    parser.add_argument('--status', choices=['0', '1'])
+    parser.add_argument('--formato', choices=['csv', 'xlsx'])
+    parser.add_argument('-o', '--saida', required=True)
+    args = parser.parse_args()
+
+    stmt = consulta_exportacao(args.de, args.ate, args.id_produto, args.status)
+    formato = args.formato or ('xlsx' if args.saida.endswith('.xlsx') else 'csv')
+    if formato == 'xlsx':
+        gravar_xlsx(stmt, args.saida)
+    else:
+        with open(args.saida, 'w', newline='', encoding='utf-8') as saida:
+            for pedaco in gerar_csv(stmt):
+                saida.write(pedaco)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+"""Fechamentos mensais de estoque e consulta do estoque numa data passada.
+
+Uso: python fechamentos.py [--reconstruir] [--ate AAAA-MM-DD] [--verificar N]
+                           [--em AAAA-MM-DD [--produto ID]]
+
+Sem opções fecha, de forma incremental, os meses completos desde o último
+fechamento (rode no começo de cada mês, por exemplo pelo cron). O estoque numa
+data sai do fechamento mais próximo anterior a ela mais as movimentações entre
+os dois: no máximo as do mês em aberto, em vez do histórico inteiro. Datas
+anteriores ao corte do arquivamento juntam as movimentações arquivadas.
+
+--verificar compara o resultado com a reprodução de todas as movimentações em
+N datas sorteadas e nas viradas de mês, e sai com código 1 se divergir.
+"""
+from datetime import date, timedelta
+import argparse
+import random
+import sys
+import time
+
+from sqlalchemy import Date, and_, case, delete, func, insert, literal, select, union_all
+from models import FechamentoEstoque, Movimentacao, MovimentacaoArquivada, Produto, db_leitura, engine, exigir_sqlite
+from estoque import ENTRADA
+from arquivamento import alcanca_arquivo, consulta_arquivada, so_no_arquivo
+
+# data_corte do saldo anterior a qualquer movimentação
+CORTE_INICIAL = date(1, 1, 1)
+
+
+def _saldo(m):
+    return case((m.status == ENTRADA, m.quantidade_produto), else_=-m.quantidade_produto)
+
+
+def _somar(filtro, com_arquivo):
+    # Soma dos saldos das movimentações em filtro(m), no banco principal e, se pedido, no arquivo
+    soma = select(func.coalesce(func.sum(_saldo(Movimentacao)), 0)).where(*filtro(Movimentacao)).scalar_subquery()
+    if com_arquivo:
+        soma = soma + (select(func.coalesce(func.sum(_saldo(MovimentacaoArquivada)), 0))
+                       .where(*filtro(MovimentacaoArquivada), so_no_arquivo()).scalar_subquery())
+    return soma
+
+
+def _executar(conexao, stmt, com_arquivo):
+    return conexao.execute(consulta_arquivada(stmt) if com_arquivo else stmt)
+
+
+def _mes_seguinte(dia):
+    return (dia.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+def _saldos_antes(corte, produtos, com_arquivo=False):
+    # (id_produto, quantidade) antes de `corte` para os produtos da subconsulta `produtos`:
+    # o último fechamento até o corte (índice da chave primária) mais as movimentações
+    # desde ele (índice produto/data). Como o arquivamento fecha os meses antes de mover,
+    # o arquivo só entra com o corte dentro do período arquivado.
+    ultimo = (select(func.max(FechamentoEstoque.data_corte))
+              .where(FechamentoEstoque.id_produto == produtos.c.id_produto,
+                     FechamentoEstoque.data_corte <= corte)
+              .scalar_subquery())
+    base = select(produtos.c.id_produto, ultimo.label('data_corte')).subquery()
+    desde = _somar(lambda m: [m.id_produto == base.c.id_produto,
+                              m.data_da_movimentacao >= func.coalesce(base.c.data_corte, CORTE_INICIAL),
+                              m.data_da_movimentacao < corte], com_arquivo)
+    return (select(base.c.id_produto, (func.coalesce(FechamentoEstoque.quantidade, 0) + desde).label('quantidade'))
+            .select_from(base)
+            .outerjoin(FechamentoEstoque, and_(FechamentoEstoque.id_produto == base.c.id_produto,
+                                               FechamentoEstoque.data_corte == base.c.data_corte)))
+
+
+def estoque_em(data, ids_produtos=None, session=db_leitura):
+    """{id_produto: quantidade} ao fim do dia `data`, para os produtos pedidos ou para todos."""
+    exigir_sqlite('O estoque numa data')
+    produtos = select(Produto.id_produto)
+    if ids_produtos is not None:
+        produtos = produtos.where(Produto.id_produto.in_(ids_produtos))
+    com_arquivo = alcanca_arquivo(data)
+    linhas = _executar(session, _saldos_antes(data + timedelta(days=1), produtos.subquery(), com_arquivo),
+                       com_arquivo).all()
+    return dict(linhas)
+
+
+def estoque_reproduzido(data, ids_produtos=None, session=db_leitura):
+    # Sem fechamentos: o estoque atual menos tudo o que entrou (mais o que saiu) depois da data.
+    # Percorre todas as movimentações posteriores; serve de referência para verificar().
+    com_arquivo = alcanca_arquivo(data + timedelta(days=1))
+    depois = _somar(lambda m: [m.id_produto == Produto.id_produto, m.data_da_movimentacao > data], com_arquivo)
+    stmt = select(Produto.id_produto, func.coalesce(Produto.qtd, 0) - depois)
+    if ids_produtos is not None:
+        stmt = stmt.where(Produto.id_produto.in_(ids_produtos))
+    return dict(_executar(session, stmt, com_arquivo).all())
+
+
+def _fechar_mes(conexao, corte):
+    # Fecha o mês anterior a `corte` para os produtos que se movimentaram nele
+    inicio = (corte - timedelta(days=1)).replace(day=1)
+    com_arquivo = alcanca_arquivo(inicio)
+    fontes = [Movimentacao, MovimentacaoArquivada] if com_arquivo else [Movimentacao]
+    movimentados = union_all(*[select(m.id_produto).where(m.data_da_movimentacao >= inicio,
+                                                          m.data_da_movimentacao < corte)
+                               for m in fontes]).subquery()
+    movimentados = select(movimentados.c.id_produto).distinct().subquery()
+    saldos = _saldos_antes(corte, movimentados, com_arquivo).subquery()
+    return _executar(conexao, insert(FechamentoEstoque).from_select(
+        ['id_produto', 'data_corte', 'quantidade'],
+        select(saldos.c.id_produto, literal(corte, Date), saldos.c.quantidade)), com_arquivo).rowcount
+
+
+def _extremos(conexao):
+    # (primeira, última) data de movimentação, contando as arquivadas
+    fontes = [Movimentacao, MovimentacaoArquivada] if alcanca_arquivo() else [Movimentacao]
+    datas = union_all(*[select(func.min(m.data_da_movimentacao).label('primeira'),
+                               func.max(m.data_da_movimentacao).label('ultima')) for m in fontes]).subquery()
+    return tuple(_executar(conexao, select(func.min(datas.c.primeira), func.max(datas.c.ultima)),
+                           len(fontes) > 1).one())
+
+
+def _gravar_saldo_inicial(conexao):
+    # Saldo antes da primeira movimentação: o estoque atual menos o efeito de todas elas
+    com_arquivo = alcanca_arquivo()
+    total = _somar(lambda m: [m.id_produto == Produto.id_produto], com_arquivo)
+    _executar(conexao, insert(FechamentoEstoque).from_select(
+        ['id_produto', 'data_corte', 'quantidade'],
+        select(Produto.id_produto, literal(CORTE_INICIAL, Date), func.coalesce(Produto.qtd, 0) - total)),
+        com_arquivo)
+
+
+def fechar_periodos(ate=None, conexao=None):
+    """Fecha os meses completos desde o último fechamento até `ate` (padrão: hoje).
+
+    Retorna [(data_corte, produtos fechados)].
+    """
+    exigir_sqlite('O fechamento de estoque')
+    if conexao is None:
+        with engine.begin() as conexao:
+            return fechar_periodos(ate, conexao)
+
+    limite = (ate or date.today()).replace(day=1)
+    if conexao.execute(select(FechamentoEstoque.id_produto).limit(1)).first() is None:
+        _gravar_saldo_inicial(conexao)
+    ultimo = conexao.execute(select(func.max(FechamentoEstoque.data_corte))
+                             .where(FechamentoEstoque.data_corte > CORTE_INICIAL)).scalar()
+    if ultimo is None:
+        primeira = _extremos(conexao)[0]
+        if primeira is None:
+            return []
+        corte = _mes_seguinte(primeira)
+    else:
+        corte = _mes_seguinte(ultimo)
+
+    fechados = []
+    while corte <= limite:
+        fechados.append((corte, _fechar_mes(conexao, corte)))
+        corte = _mes_seguinte(corte)
+    return fechados
+
+
+def reconstruir_fechamentos(ate=None):
+    # Apaga e refaz todos os fechamentos a partir do estoque atual e das movimentações
+    with engine.begin() as conexao:
+        conexao.execute(delete(FechamentoEstoque))
+        return fechar_periodos(ate, conexao)
+
+
+def datas_de_verificacao(quantidade, semente=0, session=db_leitura):
+    # Viradas de mês do histórico, a véspera da primeira movimentação, hoje e datas sorteadas
+    primeira, ultima = _extremos(session)
+    if primeira is None:
+        return [date.today()]
+    datas = {primeira - timedelta(days=1), primeira, ultima, date.today()}
+    dia = _mes_seguinte(primeira)
+    while dia <= ultima:
+        datas.update({dia - timedelta(days=1), dia})
+        dia = _mes_seguinte(dia)
+    aleatorio = random.Random(semente)
+    intervalo = (ultima - primeira).days
+    datas.update(primeira + timedelta(days=aleatorio.randint(0, intervalo)) for _ in range(quantidade))
+    return sorted(datas)
+
+
+def verificar(datas, session=db_leitura):
+    """Compara estoque_em com a reprodução completa; retorna (divergências, s com fechamentos, s reproduzindo)."""
+    divergencias = []
+    tempo_fechamentos = tempo_reproducao = 0.0
+    for data in datas:
+        inicio = time.perf_counter()
+        obtido = estoque_em(data, session=session)
+        tempo_fechamentos += time.perf_counter() - inicio
+        inicio = time.perf_counter()
+        esperado = estoque_reproduzido(data, session=session)
+        tempo_reproducao += time.perf_counter() - inicio
+        for id_produto, quantidade in esperado.items():
+            if obtido.get(id_produto) != quantidade:
+                divergencias.append((data, id_produto, quantidade, obtido.get(id_produto)))
+    return divergencias, tempo_fechamentos, tempo_reproducao
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--reconstruir', action='store_true', help='apaga e refaz todos os fechamentos')
+    parser.add_argument('--ate', type=date.fromisoformat, help='fecha só os meses anteriores a esta data')
+    parser.add_argument('--verificar', type=int, metavar='N', help='compara com a reprodução em N datas sorteadas')
+    parser.add_argument('--em', type=date.fromisoformat, metavar='DATA', help='mostra o estoque nesta data')
+    parser.add_argument('--produto', type=int, help='com --em, só este produto')
+    args = parser.parse_args()
+
+    fechados = reconstruir_fechamentos(args.ate) if args.reconstruir else fechar_periodos(args.ate)
+    # Meses sem movimentação não geram linhas e voltam a ser conferidos na próxima execução
+    fechados = [(corte, produtos) for corte, produtos in fechados if produtos]
+    for corte, produtos in fechados:
+        print(f'{corte - timedelta(days=1):%Y-%m}: {produtos} produto(s) fechado(s)')
+    if not fechados:
+        print('Nenhum mês a fechar.')
+
+    if args.em:
+        ids = [args.produto] if args.produto else None
+        for id_produto, quantidade in sorted(estoque_em(args.em, ids).items()):
+            print(f'produto {id_produto}: {quantidade}')
+
+    if args.verificar is not None:
+        datas = datas_de_verificacao(args.verificar)
+        divergencias, com_fechamentos, reproduzindo = verificar(datas)
+        print(f'{len(datas)} datas verificadas: {com_fechamentos / len(datas) * 1000:.1f} ms por data com '
+              f'fechamentos, {reproduzindo / len(datas) * 1000:.1f} ms reproduzindo as movimentações')
+        for data, id_produto, esperado, obtido in divergencias[:20]:
+            print(f'  DIVERGE {data} produto {id_produto}: esperado {esperado}, obtido {obtido}')
+        if divergencias:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+"""Importação em massa de movimentações a partir de CSV ou NDJSON.
+
+Uso: python importacao.py arquivo.csv [--formato csv|ndjson] [--lote 5000] [--erros erros.csv]
+"""
+from datetime import date
+from itertools import islice
+import argparse
+import csv
+import io
+import json
+import sys
+import time
+
+from sqlalchemy import bindparam, func, insert, select, update
+from models import Funcionario, Movimentacao, Produto, engine
+from estoque import ENTRADA, SAIDA
+
+TAMANHO_LOTE = 5000
+TENTATIVAS = 5
+STATUS = {'1': ENTRADA, 'entrada': ENTRADA, '0': SAIDA, 'saida': SAIDA, 'saída': SAIDA}
+
+# Atualiza o estoque só se ele ainda for o valor lido na validação do lote
+_ajuste_estoque = (update(Produto.__table__)
+                   .where(Produto.__table__.c.id_produto == bindparam('b_id_produto'),
+                          func.coalesce(Produto.__table__.c.qtd, 0) == bindparam('b_qtd_lida'))
+                   .values(qtd=bindparam('b_qtd_nova')))
+
+
+class ConflitoEstoque(Exception):
+    pass
+
+
+def ler_linhas(arquivo, formato='csv'):
+    # Aceita arquivo em modo texto ou binário (ex.: upload do Flask)
+    if not isinstance(arquivo, io.TextIOBase):
+        arquivo = io.TextIOWrapper(arquivo, encoding='utf-8-sig', newline='')
+    if formato == 'ndjson':
+        for linha in arquivo:
+            if linha.strip():
+                try:
+                    yield json.loads(linha)
+                except ValueError:
+                    yield None
+    else:
+        yield from csv.DictReader(arquivo)
+
+
+def _validar(dados, ids_funcionarios, ids_produtos):
+    # Retorna (movimentação, None) ou (None, motivo)
+    if not isinstance(dados, dict):
+        return None, "Linha malformada."
+    # 'quantidade' só vale quando 'quantidade_produto' está ausente ou vazio: 0 não é ausência
+    quantidade = dados.get('quantidade_produto')
+    if quantidade is None or quantidade == '':
+        quantidade = dados.get('quantidade')
+    try:
+        id_funcionario = int(dados.get('id_funcionario'))
+        id_produto = int(dados.get('id_produto'))
+        quantidade = int(quantidade)
+    except (TypeError, ValueError):
+        return None, "Os campos id_funcionario, id_produto e quantidade devem ser inteiros."
+    fornecedor = (dados.get('fornecedor') or '').strip()
+    status = STATUS.get(str(dados.get('status', '')).strip().lower())
+    if not fornecedor:
+        return None, "O campo 'fornecedor' é obrigatório."
+    if status is None:
+        return None, "Status inválido."
+    if quantidade <= 0:
+        return None, "Quantidade deve ser maior que zero."
+    if id_funcionario not in ids_funcionarios:
+        return None, f"Funcionário {id_funcionario} não encontrado."
+    if id_produto not in ids_produtos:
+        return None, f"Produto {id_produto} não encontrado."
+    try:
+        data = date.fromisoformat(str(dados['data_da_movimentacao'])[:10]) \
+            if dados.get('data_da_movimentacao') else date.today()
+    except ValueError:
+        return None, "Data inválida (use AAAA-MM-DD)."
+    return {
+        'id_funcionario': id_funcionario,
+        'id_produto': id_produto,
+        'fornecedor': fornecedor,
+        'quantidade_produto': quantidade,
+        'status': status,
+        'data_da_movimentacao': data,
+    }, None
+
+
+def _gravar_lote(conexao, validas):
+    """Aplica um lote já validado e retorna (movimentações gravadas, rejeitadas).
+
+    O estoque de cada produto é lido uma vez, as linhas são aplicadas em ordem
+    (saídas sem saldo são rejeitadas) e o saldo líquido vira um único UPDATE
+    por produto, todos num executemany.
+    """
+    ids = {mov['id_produto'] for _, mov in validas}
+    produtos = conexao.execute(
+        select(Produto.id_produto, func.coalesce(Produto.qtd, 0), Produto.preco_produto)
+        .where(Produto.id_produto.in_(ids))).all()
+    estoque = {id_produto: qtd for id_produto, qtd, _ in produtos}
+    precos = {id_produto: preco for id_produto, _, preco in produtos}
+    lido = dict(estoque)
+
+    gravar, rejeitadas = [], []
+    for numero, mov in validas:
+        delta = mov['quantidade_produto'] if mov['status'] == ENTRADA else -mov['quantidade_produto']
+        if estoque[mov['id_produto']] + delta < 0:
+            rejeitadas.append((numero, f"Estoque insuficiente. Disponível: {estoque[mov['id_produto']]}."))
+            continue
+        estoque[mov['id_produto']] += delta
+        preco = precos[mov['id_produto']]
+        mov['valor_movimentacao'] = round(preco * mov['quantidade_produto'], 2) if preco is not None else None
+        gravar.append(mov)
+
+    ajustes = [{'b_id_produto': id_produto, 'b_qtd_lida': lido[id_produto], 'b_qtd_nova': qtd}
+               for id_produto, qtd in estoque.items() if qtd != lido[id_produto]]
+    if ajustes and conexao.execute(_ajuste_estoque, ajustes).rowcount != len(ajustes):
+        # Outro processo mexeu no estoque entre a leitura e a escrita
+        raise ConflitoEstoque()
+    if gravar:
+        conexao.execute(insert(Movimentacao.__table__), gravar)
+    return gravar, rejeitadas
+
+
+def importar_movimentacoes(arquivo, formato='csv', tamanho_lote=TAMANHO_LOTE):
+    inicio = time.perf_counter()
+    with engine.connect() as conexao:
+        ids_funcionarios = set(conexao.execute(select(Funcionario.id_funcionario)).scalars())
+        ids_produtos = set(conexao.execute(select(Produto.id_produto)).scalars())
+
+    relatorio = {'linhas': 0, 'importadas': 0, 'rejeitadas': []}
+    # Linha 1 do CSV é o cabeçalho
+    primeira = 2 if formato == 'csv' else 1
+    linhas = enumerate(ler_linhas(arquivo, formato), start=primeira)
+    while True:
+        lote = list(islice(linhas, tamanho_lote))
+        if not lote:
+            break
+        relatorio['linhas'] += len(lote)
+
+        validas = []
+        for numero, dados in lote:
+            mov, erro = _validar(dados, ids_funcionarios, ids_produtos)
+            if erro:
+                relatorio['rejeitadas'].append((numero, erro))
+            else:
+                validas.append((numero, mov))
+        if not validas:
+            continue
+
+        for _ in range(TENTATIVAS):
+            try:
+                with engine.begin() as conexao:
+                    gravadas, rejeitadas = _gravar_lote(conexao, validas)
+                break
+            except ConflitoEstoque:
+                continue
+        else:
+            gravadas, rejeitadas = [], [(numero, "Conflito de estoque; tente novamente.") for numero, _ in validas]
+        relatorio['importadas'] += len(gravadas)
+        relatorio['rejeitadas'] += rejeitadas
+
+    relatorio['rejeitadas'].sort()
+    relatorio['segundos'] = time.perf_counter() - inicio
+    return relatorio
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('arquivo')
+    parser.add_argument('--formato', choices=['csv', 'ndjson'])
+    parser.add_argument('--lote', type=int, default=TAMANHO_LOTE)
+    parser.add_argument('--erros', help='grava as linhas rejeitadas neste CSV')
+    args = parser.parse_args()
+
+    formato = args.formato or ('ndjson' if args.arquivo.endswith(('.ndjson', '.jsonl')) else 'csv')
+    with open(args.arquivo, encoding='utf-8-sig', newline='') as arquivo:
+        relatorio = importar_movimentacoes(arquivo, formato, args.lote)
+
+    segundos = relatorio['segundos']
+    print(f"{relatorio['importadas']} de {relatorio['linhas']} movimentações importadas em {segundos:.2f}s "
+          f"({relatorio['linhas'] / segundos if segundos else 0:.0f} linhas/s)")
+    if relatorio['rejeitadas']:
+        print(f"{len(relatorio['rejeitadas'])} linhas rejeitadas", file=sys.stderr)
+        if args.erros:
+            with open(args.erros, 'w', newline='', encoding='utf-8') as saida:
+                escritor = csv.writer(saida)
+                escritor.writerow(['linha', 'erro'])
+                escritor.writerows(relatorio['rejeitadas'])
+
+
+if __name__ == '__main__':
+    main()
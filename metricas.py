@@ -0,0 +1,238 @@
+"""Métricas por requisição e por comando SQL, no formato texto do Prometheus.
+
+instrumentar(app, engines) mede cada requisição (rota, método, status e
+latência) e, pelos eventos before/after_cursor_execute, o número e o tempo
+dos comandos SQL. Comandos acima de SQL_LENTA_MS vão para o log
+'consultas_lentas' e para uma lista em memória com as mais recentes; dos
+parâmetros só vão os tipos, salvo com SQL_LENTA_PARAMETROS=1.
+
+As rotas que expõem isso passam por @restrita: desligadas sem METRICAS_TOKEN.
+"""
+from collections import deque
+from datetime import datetime
+from functools import wraps
+import bisect
+import hmac
+import logging
+import threading
+import time
+
+from flask import Response, abort, g, has_request_context, request
+from sqlalchemy import event
+
+from cache import estatisticas as estatisticas_cache
+from config import METRICAS_TOKEN, SQL_LENTA_MS, SQL_LENTA_PARAMETROS
+
+log_lentas = logging.getLogger('consultas_lentas')
+
+BALDES_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BALDES_COMANDOS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+MAX_LENTAS = 100
+
+
+class Histograma:
+    def __init__(self, nome, ajuda, rotulos, baldes):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = rotulos
+        self.baldes = baldes
+        self._series = {}  # valores dos rótulos -> [contagem por balde, soma, total]
+        self._trava = threading.Lock()
+
+    def observar(self, valor, *rotulos):
+        indice = bisect.bisect_left(self.baldes, valor)
+        with self._trava:
+            serie = self._series.get(rotulos)
+            if serie is None:
+                serie = self._series[rotulos] = [[0] * len(self.baldes), 0.0, 0]
+            if indice < len(self.baldes):
+                serie[0][indice] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def exportar(self):
+        linhas = [f'# HELP {self.nome} {self.ajuda}', f'# TYPE {self.nome} histogram']
+        with self._trava:
+            series = [(rotulos, list(contagens), soma, total)
+                      for rotulos, (contagens, soma, total) in sorted(self._series.items())]
+        for rotulos, contagens, soma, total in series:
+            base = _rotulos(self.rotulos, rotulos)
+            acumulado = 0
+            for limite, contagem in zip(self.baldes, contagens):
+                acumulado += contagem
+                linhas.append(f'{self.nome}_bucket{_rotulos(self.rotulos + ("le",), rotulos + (limite,))} {acumulado}')
+            linhas.append(f'{self.nome}_bucket{_rotulos(self.rotulos + ("le",), rotulos + ("+Inf",))} {total}')
+            linhas.append(f'{self.nome}_sum{base} {soma}')
+            linhas.append(f'{self.nome}_count{base} {total}')
+        return linhas
+
+
+def _rotulos(nomes, valores):
+    if not nomes:
+        return ''
+    pares = []
+    for nome, valor in zip(nomes, valores):
+        valor = str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pares.append(f'{nome}="{valor}"')
+    return '{' + ','.join(pares) + '}'
+
+
+def _metrica(nome, tipo, ajuda, amostras):
+    # amostras: [(nomes dos rótulos, valores dos rótulos, valor)]
+    linhas = [f'# HELP {nome} {ajuda}', f'# TYPE {nome} {tipo}']
+    linhas += [f'{nome}{_rotulos(nomes, valores)} {valor}' for nomes, valores, valor in amostras]
+    return linhas
+
+
+latencia = Histograma('http_requisicao_segundos', 'Latência das requisições por rota.',
+                      ('rota', 'metodo', 'status'), BALDES_LATENCIA)
+comandos_por_requisicao = Histograma('http_sql_comandos', 'Comandos SQL por requisição.',
+                                     ('rota',), BALDES_COMANDOS)
+sql_por_requisicao = Histograma('http_sql_segundos', 'Tempo total em SQL por requisição.',
+                                ('rota',), BALDES_LATENCIA)
+sql_comando = Histograma('sql_comando_segundos', 'Duração de cada comando SQL por engine.',
+                         ('engine',), BALDES_LATENCIA)
+
+_lentas = deque(maxlen=MAX_LENTAS)
+_total_lentas = [0]
+_trava_lentas = threading.Lock()
+_engines = {}
+
+
+def consultas_lentas():
+    return list(_lentas)
+
+
+def _rota_atual():
+    # O padrão da rota (ex.: /editar_produto/<int:id_produto>) e não a URL, para não explodir os rótulos
+    return request.url_rule.rule if request.url_rule is not None else 'desconhecida'
+
+
+def _inicio_sql(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('inicio_sql', []).append(time.perf_counter())
+
+
+def _mascarar(parametros):
+    # Troca cada valor pelo nome do tipo: o log e /metrics/lentas não podem vazar dados pessoais
+    if isinstance(parametros, dict):
+        return {chave: type(valor).__name__ for chave, valor in parametros.items()}
+    if isinstance(parametros, (list, tuple)):
+        return tuple(type(valor).__name__ for valor in parametros)
+    return type(parametros).__name__
+
+
+def _descrever_parametros(parameters, executemany):
+    if executemany:
+        linhas = [p if SQL_LENTA_PARAMETROS else _mascarar(p) for p in parameters[:5]]
+        return f'{len(parameters)} linhas: {linhas!r}'[:500]
+    return repr(parameters if SQL_LENTA_PARAMETROS else _mascarar(parameters))[:500]
+
+
+def _fim_sql(nome_engine):
+    def registrar(conn, cursor, statement, parameters, context, executemany):
+        duracao = time.perf_counter() - conn.info['inicio_sql'].pop()
+        sql_comando.observar(duracao, nome_engine)
+        rota = None
+        if has_request_context():
+            g.sql_comandos = g.get('sql_comandos', 0) + 1
+            g.sql_segundos = g.get('sql_segundos', 0.0) + duracao
+            rota = _rota_atual()
+        if duracao * 1000 >= SQL_LENTA_MS:
+            with _trava_lentas:
+                _total_lentas[0] += 1
+            parametros = _descrever_parametros(parameters, executemany)
+            _lentas.append({'quando': datetime.now().isoformat(timespec='seconds'), 'engine': nome_engine,
+                            'rota': rota, 'ms': round(duracao * 1000, 1), 'sql': statement,
+                            'parametros': parametros})
+            log_lentas.warning('%.1f ms [%s] %s %s', duracao * 1000, rota or '-', statement, parametros)
+    return registrar
+
+
+def _comecar_requisicao():
+    g.inicio_requisicao = time.perf_counter()
+
+
+def _terminar_requisicao(resposta):
+    _observar(resposta.status_code)
+    g.requisicao_medida = True
+    return resposta
+
+
+def _requisicao_com_erro(exc):
+    # Exceção não tratada: o after_request não roda
+    if exc is not None and not g.get('requisicao_medida'):
+        _observar(500)
+
+
+def _observar(status):
+    if 'inicio_requisicao' not in g:
+        return
+    rota = _rota_atual()
+    latencia.observar(time.perf_counter() - g.inicio_requisicao, rota, request.method, status)
+    comandos_por_requisicao.observar(g.get('sql_comandos', 0), rota)
+    sql_por_requisicao.observar(g.get('sql_segundos', 0.0), rota)
+
+
+def instrumentar(app, engines):
+    # engines: {nome: engine}
+    for nome, engine in engines.items():
+        # Cada app criada pela fábrica instrumenta as mesmas engines; os eventos só uma vez
+        if _engines.get(nome) is engine:
+            continue
+        _engines[nome] = engine
+        event.listen(engine, 'before_cursor_execute', _inicio_sql)
+        event.listen(engine, 'after_cursor_execute', _fim_sql(nome))
+    app.before_request(_comecar_requisicao)
+    app.after_request(_terminar_requisicao)
+    app.teardown_request(_requisicao_com_erro)
+
+
+def _pools():
+    amostras = {'checkedout': [], 'checkedin': [], 'overflow': [], 'size': []}
+    for nome, engine in _engines.items():
+        for medida, lista in amostras.items():
+            leitura = getattr(engine.pool, medida, None)
+            if leitura is not None:
+                lista.append((('engine',), (nome,), leitura()))
+    linhas = []
+    ajudas = {'checkedout': 'Conexões em uso.', 'checkedin': 'Conexões livres no pool.',
+              'overflow': 'Conexões além do tamanho do pool.', 'size': 'Tamanho configurado do pool.'}
+    for medida, lista in amostras.items():
+        if lista:
+            linhas += _metrica(f'db_pool_{medida}', 'gauge', ajudas[medida], lista)
+    return linhas
+
+
+def _caches():
+    estatisticas = estatisticas_cache()
+    linhas = []
+    for campo, tipo, ajuda in [('acertos', 'counter', 'Acertos do cache.'),
+                               ('falhas', 'counter', 'Falhas do cache.'),
+                               ('itens_no_backend', 'gauge', 'Itens guardados no backend do cache.')]:
+        linhas += _metrica(f'cache_{campo}', tipo, ajuda,
+                           [(('cache',), (nome,), valores[campo]) for nome, valores in estatisticas.items()])
+    return linhas
+
+
+def exportar():
+    linhas = []
+    for histograma in (latencia, comandos_por_requisicao, sql_por_requisicao, sql_comando):
+        linhas += histograma.exportar()
+    linhas += _metrica('sql_lentas_total', 'counter', f'Comandos SQL acima de {SQL_LENTA_MS} ms.',
+                       [((), (), _total_lentas[0])])
+    linhas += _pools()
+    linhas += _caches()
+    return '\n'.join(linhas) + '\n'
+
+
+def restrita(view):
+    # SQL, tempos por rota e o estado dos caches não são para qualquer visitante
+    @wraps(view)
+    def protegida(*args, **kwargs):
+        if not METRICAS_TOKEN:
+            abort(404)
+        enviado = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(enviado.encode(), f'Bearer {METRICAS_TOKEN}'.encode()):
+            return Response('', 401, {'WWW-Authenticate': 'Bearer'})
+        return view(*args, **kwargs)
+    return protegida
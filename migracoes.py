@@ -0,0 +1,94 @@
+"""Migrações do esquema em bancos já existentes, numeradas pelo PRAGMA user_version.
+
+Uso: python migracoes.py [--status]
+
+Bancos novos já nascem com o esquema atual (create_all); as migrações usam
+IF EXISTS/IF NOT EXISTS para serem inofensivas nesse caso.
+"""
+import argparse
+
+def _valor_movimentacao(conexao):
+    # Movimentações antigas ficam com o preço atual do produto, o único conhecido
+    colunas = {linha[1] for linha in conexao.exec_driver_sql("PRAGMA table_info(movimentacoes)")}
+    if 'valor_movimentacao' not in colunas:
+        conexao.exec_driver_sql("ALTER TABLE movimentacoes ADD COLUMN valor_movimentacao FLOAT")
+    conexao.exec_driver_sql(
+        "UPDATE movimentacoes SET valor_movimentacao = round(quantidade_produto * "
+        "(SELECT preco_produto FROM produtos WHERE produtos.id_produto = movimentacoes.id_produto), 2) "
+        "WHERE valor_movimentacao IS NULL")
+    conexao.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_movimentacoes_valor_id "
+                            "ON movimentacoes (valor_movimentacao, id_movimentacao)")
+    conexao.exec_driver_sql("ANALYZE movimentacoes")
+
+
+def _fechamentos_estoque(conexao):
+    # A tabela e os gatilhos vêm do create_all; aqui entram o saldo inicial e os meses já completos
+    from fechamentos import fechar_periodos
+    fechar_periodos(conexao=conexao)
+
+
+# Cada migração: (nome, comandos SQL ou função que recebe a conexão).
+# A posição na lista (a partir de 1) é a versão.
+MIGRACOES = [
+    # Índices sem uso segundo a auditoria_indices.py saem; entram os compostos das rotas
+    ('indices_recomendados', [
+        "DROP INDEX IF EXISTS ix_produtos_qtd",
+        "DROP INDEX IF EXISTS ix_produtos_preco_produto",
+        "DROP INDEX IF EXISTS ix_movimentacoes_quantidade_produto",
+        "DROP INDEX IF EXISTS ix_movimentacoes_fornecedor",
+        "DROP INDEX IF EXISTS ix_movimentacoes_status",
+        "DROP INDEX IF EXISTS ix_movimentacoes_data_da_movimentacao",
+        "DROP INDEX IF EXISTS ix_funcionarios_sobrenome",
+        "DROP INDEX IF EXISTS ix_funcionarios_data_de_cadastro",
+        "CREATE INDEX IF NOT EXISTS ix_movimentacoes_data_id "
+        "ON movimentacoes (data_da_movimentacao, id_movimentacao)",
+        "CREATE INDEX IF NOT EXISTS ix_movimentacoes_produto_data "
+        "ON movimentacoes (id_produto, data_da_movimentacao)",
+        "CREATE INDEX IF NOT EXISTS ix_movimentacoes_funcionario_data "
+        "ON movimentacoes (id_funcionario, data_da_movimentacao)",
+        "ANALYZE",
+    ]),
+    ('valor_movimentacao', _valor_movimentacao),
+    ('fechamentos_estoque', _fechamentos_estoque),
+]
+
+
+def versao_esquema(conexao):
+    return conexao.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def migrar(engine):
+    # Aplica as migrações pendentes, cada uma na sua transação; retorna os nomes aplicados
+    if engine.dialect.name != 'sqlite':
+        return []
+    aplicadas = []
+    with engine.connect() as conexao:
+        atual = versao_esquema(conexao)
+    for versao, (nome, comandos) in enumerate(MIGRACOES[atual:], start=atual + 1):
+        with engine.begin() as conexao:
+            if callable(comandos):
+                comandos(conexao)
+            else:
+                for comando in comandos:
+                    conexao.exec_driver_sql(comando)
+            conexao.exec_driver_sql(f"PRAGMA user_version = {versao}")
+        aplicadas.append(nome)
+    return aplicadas
+
+
+def main():
+    from models import engine
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--status', action='store_true', help='só mostra a versão do esquema')
+    args = parser.parse_args()
+
+    if not args.status:
+        for nome in migrar(engine):
+            print(f'Aplicada: {nome}')
+    with engine.connect() as conexao:
+        print(f'Esquema na versão {versao_esquema(conexao)} de {len(MIGRACOES)}.')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,67 @@
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, Date, Float
-from sqlalchemy.orm import sessionmaker, scoped_session, relationship, declarative_base
+from contextlib import contextmanager
+import json
+import logging
+from sqlalchemy import event, Column, Integer, String, ForeignKey, Date, DateTime, Float, Index, MetaData, Table
+from sqlalchemy.orm import foreign, sessionmaker, scoped_session, relationship, declarative_base
+from config import CARGA_ESTRITA, caminho_arquivo, criar_engine
+from migracoes import migrar
+
+engine = criar_engine()
+engine_leitura = criar_engine(somente_leitura=True)
+
+# Contadores, versões dos dados, resumos e fechamentos são mantidos por gatilhos do SQLite,
+# a busca usa FTS5 e o arquivamento usa ATTACH. Num banco servidor os contadores e as
+# versões caem para consultas diretas e o resto recusa com RecursoIndisponivel.
+USA_SQLITE = engine.dialect.name == 'sqlite'
+RECURSOS_SQLITE = ['resumo mensal e gráfico', 'estoque numa data (fechamentos)', 'busca textual', 'arquivamento',
+                   'cache de fragmentos e ETags']
+
+
+class RecursoIndisponivel(RuntimeError):
+    pass
+
+
+def usa_sqlite():
+    return USA_SQLITE
+
+
+def exigir_sqlite(recurso):
+    if not usa_sqlite():
+        raise RecursoIndisponivel(f'{recurso} depende do SQLite (gatilhos, FTS5 e ATTACH) e está desligado '
+                                  f"com o banco '{engine.dialect.name}'.")
 
-engine = create_engine('sqlite:///sql_prejetofinal.db')
 
 db_session = scoped_session(sessionmaker(bind=engine))
 
+# Sessão das rotas GET: sem autoflush e numa engine que recusa escritas
+fabrica_leitura = sessionmaker(bind=engine_leitura, autoflush=False)
+db_leitura = scoped_session(fabrica_leitura)
+
+
+@event.listens_for(fabrica_leitura, 'before_flush')
+def _bloquear_escrita(session, flush_context, instances):
+    raise RuntimeError('Sessão somente leitura: use unidade_de_trabalho() para gravar.')
+
+
+@contextmanager
+def unidade_de_trabalho():
+    # Confirma tudo no fim do bloco ou desfaz em caso de erro, sem deixar a sessão quebrada
+    session = db_session()
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+
+
+def remover_sessoes(exc=None):
+    db_session.remove()
+    db_leitura.remove()
+
+# Carga padrão dos relacionamentos; cada rota escolhe a sua (joinedload/contains_eager/selectinload)
+CARGA_PADRAO = 'raise_on_sql' if CARGA_ESTRITA else 'select'
+
 Base = declarative_base()
 Base.query = db_session.query_property()
 
@@ -12,22 +69,22 @@ class Funcionario(Base):
     __tablename__ = 'funcionarios'
     id_funcionario = Column(Integer, primary_key=True)
     nome_funcionario = Column(String(40), nullable=False, index=True)
-    sobrenome = Column(String(16), nullable=False, index=True)
+    sobrenome = Column(String(16), nullable=False)
     email = Column(String(40), nullable=False, index=True, unique=True)
     cpf = Column(String(11), nullable=False, index=True, unique=True)
     telefone = Column(String(16), index=True, unique=True)
-    data_de_cadastro = Column(String, index=True)
+    data_de_cadastro = Column(String)
 
     def __repr__(self):
         return '<Funcionario: {} {}>'.format(self.nome_funcionario, self.sobrenome)
 
     def save(self):
-        db_session.add(self)
-        db_session.commit()
+        with unidade_de_trabalho() as session:
+            session.add(self)
 
     def delete(self):
-        db_session.delete(self)
-        db_session.commit()
+        with unidade_de_trabalho() as session:
+            session.delete(self)
 
     def serialize_funcionario(self):
         dados_funcionario = {
@@ -45,28 +102,29 @@ class Produto(Base):
     __tablename__ = 'produtos'
     id_produto = Column(Integer, primary_key=True)
     nome_produto = Column(String(40), nullable=False, index=True)
-    qtd = Column(Integer, index=True)
-    preco_produto = Column(Float, index=True)
+    qtd = Column(Integer)
+    preco_produto = Column(Float)
     id_categoria = Column(Integer, ForeignKey('categorias.id_categoria'))
-    categoria = relationship("Categoria")
+    categoria = relationship("Categoria", lazy=CARGA_PADRAO)
 
     def __repr__(self):
         return '<Produto: {}>'.format(self.nome_produto)
 
     def save(self):
-        db_session.add(self)
-        db_session.commit()
+        with unidade_de_trabalho() as session:
+            session.add(self)
 
     def delete(self):
-        db_session.delete(self)
-        db_session.commit()
+        with unidade_de_trabalho() as session:
+            session.delete(self)
 
     def serialize_produto(self):
         dados_produto = {
             "id_produto": self.id_produto,
             "nome_produto": self.nome_produto,
             "preco_produto": self.preco_produto,
-            "qtd":self.qtd
+            "qtd":self.qtd,
+            "id_categoria": self.id_categoria
         }
         return dados_produto
 
@@ -79,12 +137,12 @@ class Categoria(Base):
         return '<Categoria: {}>'.format(self.nome_categoria)
 
     def save(self):
-        db_session.add(self)
-        db_session.commit()
+        with unidade_de_trabalho() as session:
+            session.add(self)
 
     def delete(self):
-        db_session.delete(self)
-        db_session.commit()
+        with unidade_de_trabalho() as session:
+            session.delete(self)
 
     def serialize_categoria(self):
         dados_categoria = {
@@ -96,25 +154,35 @@ class Categoria(Base):
 class Movimentacao(Base):
     __tablename__ = 'movimentacoes'
     id_movimentacao = Column(Integer, primary_key=True)
-    quantidade_produto = Column(Integer, index=True)
-    fornecedor = Column(String(11), index=True)
-    status = Column(String(11), index=True)
-    data_da_movimentacao = Column(Date, index=True)
+    quantidade_produto = Column(Integer)
+    fornecedor = Column(String(11))
+    status = Column(String(11))
+    data_da_movimentacao = Column(Date)
+    # Preço unitário × quantidade no momento da movimentação
+    valor_movimentacao = Column(Float)
     id_funcionario = Column(Integer, ForeignKey('funcionarios.id_funcionario'))
-    funcionario = relationship("Funcionario")
+    funcionario = relationship("Funcionario", lazy=CARGA_PADRAO)
     id_produto = Column(Integer, ForeignKey('produtos.id_produto'))
-    Produto = relationship("Produto")
+    Produto = relationship("Produto", lazy=CARGA_PADRAO)
+
+    # Índices escolhidos pela auditoria_indices.py: só os caminhos de acesso que as rotas usam
+    __table_args__ = (
+        Index('ix_movimentacoes_data_id', 'data_da_movimentacao', 'id_movimentacao'),
+        Index('ix_movimentacoes_produto_data', 'id_produto', 'data_da_movimentacao'),
+        Index('ix_movimentacoes_funcionario_data', 'id_funcionario', 'data_da_movimentacao'),
+        Index('ix_movimentacoes_valor_id', 'valor_movimentacao', 'id_movimentacao'),
+    )
 
     def __repr__(self):
         return '<Movimentacao: {}>'.format(self.id_movimentacao)
 
     def save(self):
-        db_session.add(self)
-        db_session.commit()
+        with unidade_de_trabalho() as session:
+            session.add(self)
 
     def delete(self):
-        db_session.delete(self)
-        db_session.commit()
+        with unidade_de_trabalho() as session:
+            session.delete(self)
 
     def serialize_movimentacao(self):
         dados_movimentacao = {
@@ -122,12 +190,407 @@ class Movimentacao(Base):
             "quantidade_produto": self.quantidade_produto,
             "fornecedor": self.fornecedor,
             "status": self.status,
-            "data_da_movimentacao": self.data_da_movimentacao
+            "data_da_movimentacao": self.data_da_movimentacao.isoformat() if self.data_da_movimentacao else None,
+            "valor_movimentacao": self.valor_movimentacao,
+            "id_funcionario": self.id_funcionario,
+            "id_produto": self.id_produto
         }
         return dados_movimentacao
 
+class Contador(Base):
+    __tablename__ = 'contadores'
+    nome = Column(String(40), primary_key=True)
+    valor = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return '<Contador: {}={}>'.format(self.nome, self.valor)
+
+
+# Contadores mantidos por gatilhos do SQLite: valem também para inserts em massa
+# feitos pelo Core, que não passam pelos eventos do ORM.
+TABELAS_CONTADAS = ['funcionarios', 'produtos', 'categorias', 'movimentacoes']
+
+
+def _sql_contadores():
+    comandos = []
+    for tabela in TABELAS_CONTADAS:
+        comandos += [
+            f"CREATE TRIGGER IF NOT EXISTS trg_{tabela}_contador_ins AFTER INSERT ON {tabela} "
+            f"BEGIN UPDATE contadores SET valor = valor + 1 WHERE nome = '{tabela}'; END",
+            f"CREATE TRIGGER IF NOT EXISTS trg_{tabela}_contador_del AFTER DELETE ON {tabela} "
+            f"BEGIN UPDATE contadores SET valor = valor - 1 WHERE nome = '{tabela}'; END",
+            f"INSERT INTO contadores (nome, valor) SELECT '{tabela}', (SELECT COUNT(*) FROM {tabela}) "
+            f"WHERE NOT EXISTS (SELECT 1 FROM contadores WHERE nome = '{tabela}')",
+        ]
+    # Soma do estoque de todos os produtos (métrica do dashboard)
+    comandos += [
+        "CREATE TRIGGER IF NOT EXISTS trg_produtos_estoque_ins AFTER INSERT ON produtos "
+        "BEGIN UPDATE contadores SET valor = valor + COALESCE(NEW.qtd, 0) WHERE nome = 'estoque_total'; END",
+        "CREATE TRIGGER IF NOT EXISTS trg_produtos_estoque_upd AFTER UPDATE OF qtd ON produtos "
+        "BEGIN UPDATE contadores SET valor = valor + COALESCE(NEW.qtd, 0) - COALESCE(OLD.qtd, 0) "
+        "WHERE nome = 'estoque_total'; END",
+        "CREATE TRIGGER IF NOT EXISTS trg_produtos_estoque_del AFTER DELETE ON produtos "
+        "BEGIN UPDATE contadores SET valor = valor - COALESCE(OLD.qtd, 0) WHERE nome = 'estoque_total'; END",
+        "INSERT INTO contadores (nome, valor) SELECT 'estoque_total', (SELECT COALESCE(SUM(qtd), 0) FROM produtos) "
+        "WHERE NOT EXISTS (SELECT 1 FROM contadores WHERE nome = 'estoque_total')",
+    ]
+    return comandos
+
+
+@event.listens_for(Base.metadata, 'after_create')
+def instalar_contadores(target, connection, **kw):
+    if connection.dialect.name != 'sqlite':
+        return
+    for comando in _sql_contadores():
+        connection.exec_driver_sql(comando)
+
+
+class VersaoTabela(Base):
+    __tablename__ = 'versoes_tabelas'
+    # Versão dos dados de cada tabela (versoes.py): chave dos caches de fragmentos e dos ETags
+    tabela = Column(String(40), primary_key=True)
+    numero = Column(Integer, nullable=False, default=0)
+    alterado_em = Column(Float, nullable=False)  # segundos desde 1970 (UTC)
+
+    def __repr__(self):
+        return '<VersaoTabela: {}={}>'.format(self.tabela, self.numero)
+
+
+# Toda escrita nestas tabelas, de qualquer processo, muda a versão dentro da própria transação
+TABELAS_VERSIONADAS = TABELAS_CONTADAS
+AGORA_SQL = "(julianday('now') - 2440587.5) * 86400.0"
+
+
+def _sql_versoes():
+    comandos = []
+    for tabela in TABELAS_VERSIONADAS:
+        for operacao in ('INSERT', 'UPDATE', 'DELETE'):
+            comandos.append(
+                f"CREATE TRIGGER IF NOT EXISTS trg_{tabela}_versao_{operacao[:3].lower()} AFTER {operacao} ON {tabela} "
+                f"BEGIN UPDATE versoes_tabelas SET numero = numero + 1, alterado_em = {AGORA_SQL} "
+                f"WHERE tabela = '{tabela}'; END")
+        # Começa no instante da criação: um banco recriado não repete os ETags do anterior
+        comandos.append(
+            f"INSERT OR IGNORE INTO versoes_tabelas (tabela, numero, alterado_em) "
+            f"VALUES ('{tabela}', CAST(strftime('%s', 'now') AS INTEGER), {AGORA_SQL})")
+    return comandos
+
+
+@event.listens_for(Base.metadata, 'after_create')
+def instalar_versoes(target, connection, **kw):
+    if connection.dialect.name != 'sqlite':
+        return
+    for comando in _sql_versoes():
+        connection.exec_driver_sql(comando)
+
+
+class ResumoMensal(Base):
+    __tablename__ = 'resumos_mensais'
+    # dimensao: 'mes' (chave 0), 'produto' (chave = id_produto) ou 'categoria' (chave = id_categoria)
+    dimensao = Column(String(10), primary_key=True)
+    chave = Column(Integer, primary_key=True)
+    mes_ano = Column(String(7), primary_key=True)
+    total_produtos = Column(Integer, nullable=False, default=0)
+    total_movimentacoes = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return '<ResumoMensal: {} {} {}>'.format(self.dimensao, self.chave, self.mes_ano)
+
+
+class FechamentoEstoque(Base):
+    __tablename__ = 'fechamentos_estoque'
+    # Estoque do produto antes de data_corte, isto é, com todas as movimentações de datas anteriores.
+    # Os fechamentos mensais cortam no dia 1º do mês seguinte e só existem para produtos que se
+    # movimentaram no mês; CORTE_INICIAL guarda o saldo anterior à primeira movimentação.
+    id_produto = Column(Integer, primary_key=True)
+    data_corte = Column(Date, primary_key=True)
+    quantidade = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return '<FechamentoEstoque: {} {}>'.format(self.id_produto, self.data_corte)
+
+
+# Chave de cada dimensão do resumo a partir de uma linha de movimentacoes (NEW/OLD)
+DIMENSOES_RESUMO = {
+    'mes': '0',
+    'produto': '{linha}.id_produto',
+    'categoria': 'COALESCE((SELECT id_categoria FROM produtos WHERE id_produto = {linha}.id_produto), 0)',
+}
+
+
+def _sql_somar_resumo(linha, sinal):
+    comandos = []
+    for dimensao, chave in DIMENSOES_RESUMO.items():
+        chave = chave.format(linha=linha)
+        comandos.append(
+            f"INSERT INTO resumos_mensais (dimensao, chave, mes_ano, total_produtos, total_movimentacoes) "
+            f"VALUES ('{dimensao}', {chave}, strftime('%Y-%m', {linha}.data_da_movimentacao), "
+            f"{sinal}COALESCE({linha}.quantidade_produto, 0), {sinal}1) "
+            f"ON CONFLICT (dimensao, chave, mes_ano) DO UPDATE SET "
+            f"total_produtos = total_produtos + excluded.total_produtos, "
+            f"total_movimentacoes = total_movimentacoes + excluded.total_movimentacoes;"
+        )
+    return ' '.join(comandos)
+
+
+def _sql_mover_categoria(linha, sinal):
+    # Soma (ou subtrai) os meses do produto na categoria {linha}.id_categoria
+    return (f"INSERT INTO resumos_mensais (dimensao, chave, mes_ano, total_produtos, total_movimentacoes) "
+            f"SELECT 'categoria', COALESCE({linha}.id_categoria, 0), mes_ano, "
+            f"{sinal}total_produtos, {sinal}total_movimentacoes FROM resumos_mensais "
+            f"WHERE dimensao = 'produto' AND chave = NEW.id_produto "
+            f"ON CONFLICT (dimensao, chave, mes_ano) DO UPDATE SET "
+            f"total_produtos = total_produtos + excluded.total_produtos, "
+            f"total_movimentacoes = total_movimentacoes + excluded.total_movimentacoes;")
+
+
+def _sql_resumos():
+    comandos = [
+        "CREATE TRIGGER IF NOT EXISTS trg_movimentacoes_resumo_ins AFTER INSERT ON movimentacoes "
+        "WHEN NEW.data_da_movimentacao IS NOT NULL "
+        f"BEGIN {_sql_somar_resumo('NEW', '')} END",
+        "CREATE TRIGGER IF NOT EXISTS trg_movimentacoes_resumo_del AFTER DELETE ON movimentacoes "
+        "WHEN OLD.data_da_movimentacao IS NOT NULL "
+        f"BEGIN {_sql_somar_resumo('OLD', '-')} END",
+        "CREATE TRIGGER IF NOT EXISTS trg_movimentacoes_resumo_upd_old "
+        "AFTER UPDATE OF quantidade_produto, data_da_movimentacao, id_produto ON movimentacoes "
+        "WHEN OLD.data_da_movimentacao IS NOT NULL "
+        f"BEGIN {_sql_somar_resumo('OLD', '-')} END",
+        "CREATE TRIGGER IF NOT EXISTS trg_movimentacoes_resumo_upd_new "
+        "AFTER UPDATE OF quantidade_produto, data_da_movimentacao, id_produto ON movimentacoes "
+        "WHEN NEW.data_da_movimentacao IS NOT NULL "
+        f"BEGIN {_sql_somar_resumo('NEW', '')} END",
+        # A dimensão categoria usa a categoria atual do produto: trocar a categoria leva junto os
+        # meses do produto (a dimensão produto já soma todas as movimentações dele)
+        "CREATE TRIGGER IF NOT EXISTS trg_produtos_resumo_categoria "
+        "AFTER UPDATE OF id_categoria ON produtos "
+        "WHEN OLD.id_categoria IS NOT NEW.id_categoria "
+        f"BEGIN {_sql_mover_categoria('OLD', '-')} {_sql_mover_categoria('NEW', '')} END",
+    ]
+    # Carga inicial a partir do histórico, apenas quando o resumo está vazio
+    for dimensao, chave in DIMENSOES_RESUMO.items():
+        chave = chave.format(linha='movimentacoes')
+        comandos.append(
+            f"INSERT INTO resumos_mensais (dimensao, chave, mes_ano, total_produtos, total_movimentacoes) "
+            f"SELECT '{dimensao}', {chave} AS chave_resumo, strftime('%Y-%m', data_da_movimentacao) AS mes, "
+            f"COALESCE(SUM(quantidade_produto), 0), COUNT(*) FROM movimentacoes "
+            f"WHERE data_da_movimentacao IS NOT NULL "
+            f"AND NOT EXISTS (SELECT 1 FROM resumos_mensais WHERE dimensao = '{dimensao}') "
+            f"GROUP BY chave_resumo, mes"
+        )
+    return comandos
+
+
+@event.listens_for(Base.metadata, 'after_create')
+def instalar_resumos(target, connection, **kw):
+    if connection.dialect.name != 'sqlite':
+        return
+    for comando in _sql_resumos():
+        connection.exec_driver_sql(comando)
+
+
+# Efeito de uma linha de movimentacoes (NEW/OLD) no estoque: status '1' entra, '0' sai
+SALDO_MOVIMENTACAO = ("(CASE {linha}.status WHEN '1' THEN COALESCE({linha}.quantidade_produto, 0) "
+                      "ELSE -COALESCE({linha}.quantidade_produto, 0) END)")
+
+
+def _sql_ajustar_fechamentos(linha, sinal):
+    # Movimentação com data já fechada (importação retroativa, exclusão) corrige os fechamentos seguintes
+    return (f"UPDATE fechamentos_estoque SET quantidade = quantidade {sinal} "
+            f"{SALDO_MOVIMENTACAO.format(linha=linha)} "
+            f"WHERE id_produto = {linha}.id_produto AND data_corte > {linha}.data_da_movimentacao;")
+
+
+def _sql_fechamentos():
+    return [
+        "CREATE TRIGGER IF NOT EXISTS trg_movimentacoes_fechamento_ins AFTER INSERT ON movimentacoes "
+        "WHEN NEW.data_da_movimentacao IS NOT NULL "
+        f"BEGIN {_sql_ajustar_fechamentos('NEW', '+')} END",
+        "CREATE TRIGGER IF NOT EXISTS trg_movimentacoes_fechamento_del AFTER DELETE ON movimentacoes "
+        "WHEN OLD.data_da_movimentacao IS NOT NULL "
+        f"BEGIN {_sql_ajustar_fechamentos('OLD', '-')} END",
+        "CREATE TRIGGER IF NOT EXISTS trg_movimentacoes_fechamento_upd_old "
+        "AFTER UPDATE OF quantidade_produto, status, data_da_movimentacao, id_produto ON movimentacoes "
+        "WHEN OLD.data_da_movimentacao IS NOT NULL "
+        f"BEGIN {_sql_ajustar_fechamentos('OLD', '-')} END",
+        "CREATE TRIGGER IF NOT EXISTS trg_movimentacoes_fechamento_upd_new "
+        "AFTER UPDATE OF quantidade_produto, status, data_da_movimentacao, id_produto ON movimentacoes "
+        "WHEN NEW.data_da_movimentacao IS NOT NULL "
+        f"BEGIN {_sql_ajustar_fechamentos('NEW', '+')} END",
+    ]
+
+
+@event.listens_for(Base.metadata, 'after_create')
+def instalar_fechamentos(target, connection, **kw):
+    # A carga dos fechamentos fica com fechamentos.py (migração e linha de comando)
+    if connection.dialect.name != 'sqlite':
+        return
+    for comando in _sql_fechamentos():
+        connection.exec_driver_sql(comando)
+
+
+class Tarefa(Base):
+    __tablename__ = 'tarefas'
+    # Tarefas em segundo plano (tarefas.py): pendente -> executando -> concluida | falhou | cancelada
+    id_tarefa = Column(Integer, primary_key=True)
+    tipo = Column(String(40), nullable=False)
+    parametros = Column(String, nullable=False, default='{}')  # JSON
+    estado = Column(String(12), nullable=False, default='pendente')
+    progresso = Column(Integer, nullable=False, default=0)  # 0 a 100
+    mensagem = Column(String)  # resumo do resultado ou o erro
+    arquivo = Column(String)  # caminho do arquivo gerado, se houver
+    nome_download = Column(String)
+    processo = Column(String(32))  # versoes.ID_PROCESSO de quem executa
+    cancelar = Column(Integer, nullable=False, default=0)
+    criada_em = Column(DateTime, nullable=False)
+    iniciada_em = Column(DateTime)
+    atualizada_em = Column(DateTime)
+    terminada_em = Column(DateTime)
+
+    __table_args__ = (
+        Index('ix_tarefas_estado_tipo', 'estado', 'tipo'),
+    )
+
+    def __repr__(self):
+        return '<Tarefa: {} {} {}>'.format(self.id_tarefa, self.tipo, self.estado)
+
+    def serialize_tarefa(self):
+        dados_tarefa = {
+            "id_tarefa": self.id_tarefa,
+            "tipo": self.tipo,
+            "parametros": json.loads(self.parametros or '{}'),
+            "estado": self.estado,
+            "progresso": self.progresso,
+            "mensagem": self.mensagem,
+            "tem_arquivo": bool(self.arquivo) and self.estado == 'concluida',
+            "nome_download": self.nome_download,
+            "criada_em": self.criada_em.isoformat(timespec='seconds') if self.criada_em else None,
+            "iniciada_em": self.iniciada_em.isoformat(timespec='seconds') if self.iniciada_em else None,
+            "terminada_em": self.terminada_em.isoformat(timespec='seconds') if self.terminada_em else None
+        }
+        return dados_tarefa
+
+
+# Busca textual (FTS5) sem acento: remove_diacritics faz "televisao" achar "Televisão".
+# O rowid de cada índice é o id do produto/funcionário.
+TOKENIZADOR_FTS = "unicode61 remove_diacritics 2"
+
+
+def _sql_busca():
+    return [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS produtos_fts USING fts5("
+        f"nome_produto, nome_categoria, tokenize='{TOKENIZADOR_FTS}', prefix='2 3')",
+        "CREATE VIRTUAL TABLE IF NOT EXISTS funcionarios_fts USING fts5("
+        f"nome_funcionario, sobrenome, email, cpf, tokenize='{TOKENIZADOR_FTS}', prefix='2 3')",
+
+        "CREATE TRIGGER IF NOT EXISTS trg_produtos_fts_ins AFTER INSERT ON produtos BEGIN "
+        "INSERT INTO produtos_fts (rowid, nome_produto, nome_categoria) VALUES (NEW.id_produto, NEW.nome_produto, "
+        "(SELECT nome_categoria FROM categorias WHERE id_categoria = NEW.id_categoria)); END",
+        "CREATE TRIGGER IF NOT EXISTS trg_produtos_fts_upd AFTER UPDATE OF nome_produto, id_categoria ON produtos BEGIN "
+        "DELETE FROM produtos_fts WHERE rowid = OLD.id_produto; "
+        "INSERT INTO produtos_fts (rowid, nome_produto, nome_categoria) VALUES (NEW.id_produto, NEW.nome_produto, "
+        "(SELECT nome_categoria FROM categorias WHERE id_categoria = NEW.id_categoria)); END",
+        "CREATE TRIGGER IF NOT EXISTS trg_produtos_fts_del AFTER DELETE ON produtos BEGIN "
+        "DELETE FROM produtos_fts WHERE rowid = OLD.id_produto; END",
+        "CREATE TRIGGER IF NOT EXISTS trg_categorias_fts_upd AFTER UPDATE OF nome_categoria ON categorias BEGIN "
+        "UPDATE produtos_fts SET nome_categoria = NEW.nome_categoria "
+        "WHERE rowid IN (SELECT id_produto FROM produtos WHERE id_categoria = NEW.id_categoria); END",
+
+        "CREATE TRIGGER IF NOT EXISTS trg_funcionarios_fts_ins AFTER INSERT ON funcionarios BEGIN "
+        "INSERT INTO funcionarios_fts (rowid, nome_funcionario, sobrenome, email, cpf) "
+        "VALUES (NEW.id_funcionario, NEW.nome_funcionario, NEW.sobrenome, NEW.email, NEW.cpf); END",
+        "CREATE TRIGGER IF NOT EXISTS trg_funcionarios_fts_upd "
+        "AFTER UPDATE OF nome_funcionario, sobrenome, email, cpf ON funcionarios BEGIN "
+        "DELETE FROM funcionarios_fts WHERE rowid = OLD.id_funcionario; "
+        "INSERT INTO funcionarios_fts (rowid, nome_funcionario, sobrenome, email, cpf) "
+        "VALUES (NEW.id_funcionario, NEW.nome_funcionario, NEW.sobrenome, NEW.email, NEW.cpf); END",
+        "CREATE TRIGGER IF NOT EXISTS trg_funcionarios_fts_del AFTER DELETE ON funcionarios BEGIN "
+        "DELETE FROM funcionarios_fts WHERE rowid = OLD.id_funcionario; END",
+
+        # Carga inicial quando o índice está vazio
+        "INSERT INTO produtos_fts (rowid, nome_produto, nome_categoria) "
+        "SELECT p.id_produto, p.nome_produto, c.nome_categoria FROM produtos p "
+        "LEFT JOIN categorias c ON c.id_categoria = p.id_categoria "
+        "WHERE NOT EXISTS (SELECT 1 FROM produtos_fts)",
+        "INSERT INTO funcionarios_fts (rowid, nome_funcionario, sobrenome, email, cpf) "
+        "SELECT id_funcionario, nome_funcionario, sobrenome, email, cpf FROM funcionarios "
+        "WHERE NOT EXISTS (SELECT 1 FROM funcionarios_fts)",
+    ]
+
+
+def fts_disponivel(connection):
+    return connection.dialect.name == 'sqlite' and bool(
+        connection.exec_driver_sql("SELECT sqlite_compileoption_used('ENABLE_FTS5')").scalar())
+
+
+@event.listens_for(Base.metadata, 'after_create')
+def instalar_busca(target, connection, **kw):
+    if not fts_disponivel(connection):
+        return
+    for comando in _sql_busca():
+        connection.exec_driver_sql(comando)
+
+
+# Movimentações arquivadas (arquivamento.py): as mesmas colunas num segundo arquivo SQLite, anexado
+# à conexão como o esquema "arquivo" na primeira consulta marcada com execution_options(arquivo=True)
+CAMINHO_ARQUIVO = caminho_arquivo()
+
+metadata_arquivo = MetaData(schema='arquivo')
+movimentacoes_arquivo = Table(
+    'movimentacoes', metadata_arquivo,
+    *[Column(coluna.name, coluna.type, primary_key=coluna.primary_key) for coluna in Movimentacao.__table__.columns],
+    Index('ix_arquivo_movimentacoes_data_id', 'data_da_movimentacao', 'id_movimentacao'),
+    Index('ix_arquivo_movimentacoes_produto_data', 'id_produto', 'data_da_movimentacao'),
+    Index('ix_arquivo_movimentacoes_valor_id', 'valor_movimentacao', 'id_movimentacao'),
+)
+# Cada execução do arquivamento; o maior corte separa o arquivo (antes) do banco principal
+arquivamentos = Table(
+    'arquivamentos', metadata_arquivo,
+    Column('corte', Date, primary_key=True),
+    Column('movimentacoes', Integer, nullable=False, default=0),
+    Column('executado_em', DateTime),
+)
+BaseArquivo = declarative_base(metadata=metadata_arquivo)
+
+
+class MovimentacaoArquivada(BaseArquivo):
+    # Somente leitura: mesmos atributos e relacionamentos de Movimentacao
+    __table__ = movimentacoes_arquivo
+    funcionario = relationship(Funcionario, lazy=CARGA_PADRAO,
+                               primaryjoin=foreign(movimentacoes_arquivo.c.id_funcionario) == Funcionario.id_funcionario)
+    Produto = relationship(Produto, lazy=CARGA_PADRAO,
+                           primaryjoin=foreign(movimentacoes_arquivo.c.id_produto) == Produto.id_produto)
+
+    serialize_movimentacao = Movimentacao.serialize_movimentacao
+
+    def __repr__(self):
+        return '<MovimentacaoArquivada: {}>'.format(self.id_movimentacao)
+
+
+def anexar_arquivo(conexao):
+    # ATTACH uma vez por conexão do pool; o SQLite cria o arquivo se ele ainda não existir
+    if CAMINHO_ARQUIVO is None or conexao.info.get('arquivo_anexado'):
+        return
+    conexao.exec_driver_sql("ATTACH DATABASE ? AS arquivo", (CAMINHO_ARQUIVO,))
+    conexao.info['arquivo_anexado'] = True
+
+
+def _anexar_se_pedido(conexao, clausula, multiparams, params, execution_options):
+    if execution_options.get('arquivo'):
+        anexar_arquivo(conexao)
+
+
+for _engine in (engine, engine_leitura):
+    if _engine.dialect.name == 'sqlite':
+        event.listen(_engine, 'before_execute', _anexar_se_pedido)
+
+
 def init_db():
     Base.metadata.create_all(bind=engine)
+    migrar(engine)
+    if not usa_sqlite():
+        logging.getLogger(__name__).warning("Banco '%s': recursos desligados: %s.",
+                                            engine.dialect.name, ', '.join(RECURSOS_SQLITE))
 
 if __name__ == '__main__':
     init_db()
\ No newline at end of file
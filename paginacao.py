@@ -0,0 +1,123 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import namedtuple
+from datetime import date
+import json
+
+from sqlalchemy import Date, and_, or_
+
+# chave=None significa ordenar apenas pelo id
+Ordenacao = namedtuple('Ordenacao', ['chave', 'id_coluna', 'descendente'])
+Pagina = namedtuple('Pagina', ['itens', 'proximo', 'anterior'])
+
+
+def codificar_cursor(valor, id_valor):
+    if isinstance(valor, date):
+        valor = valor.isoformat()
+    bruto = json.dumps([valor, id_valor], separators=(',', ':')).encode()
+    return urlsafe_b64encode(bruto).decode().rstrip('=')
+
+
+def decodificar_cursor(cursor, ordenacao):
+    # Cursor inválido ou adulterado é tratado como ausente: só passa um valor escalar
+    # (texto, número ou null) e um id inteiro, os únicos tipos que codificar_cursor gera
+    try:
+        bruto = urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        valor, id_valor = json.loads(bruto)
+    except (ValueError, TypeError):
+        return None
+    if isinstance(valor, bool) or not isinstance(valor, (str, int, float, type(None))):
+        return None
+    if isinstance(id_valor, bool) or not isinstance(id_valor, int):
+        return None
+    if valor is not None and ordenacao.chave is not None and isinstance(ordenacao.chave.type, Date):
+        try:
+            valor = date.fromisoformat(valor)
+        except (ValueError, TypeError):
+            return None
+    return valor, id_valor
+
+
+def _filtro_apos(ordenacao, valor, id_valor, descendente):
+    # No SQLite NULL é o menor valor: vem primeiro no ASC e por último no DESC
+    chave, id_coluna = ordenacao.chave, ordenacao.id_coluna
+    id_seguinte = id_coluna < id_valor if descendente else id_coluna > id_valor
+    if chave is None:
+        return id_seguinte
+    if valor is None:
+        if descendente:
+            return and_(chave.is_(None), id_seguinte)
+        return or_(and_(chave.is_(None), id_seguinte), chave.is_not(None))
+    if descendente:
+        return or_(chave < valor, and_(chave == valor, id_seguinte), chave.is_(None))
+    return or_(chave > valor, and_(chave == valor, id_seguinte))
+
+
+def clausulas_ordem(ordenacao, descendente):
+    colunas = [ordenacao.id_coluna] if ordenacao.chave is None else [ordenacao.chave, ordenacao.id_coluna]
+    return [c.desc() if descendente else c.asc() for c in colunas]
+
+
+def chave_intercalacao(valor, id_valor):
+    # A ordem do SQLite em Python: NULL antes de qualquer valor, id como desempate
+    return (valor is not None, valor), id_valor
+
+
+def _buscar(session, stmt, ordenacao, descendente, cursor, deslocamento, limite):
+    chave = ordenacao.id_coluna if ordenacao.chave is None else ordenacao.chave
+    stmt = stmt.add_columns(chave.label('_cursor_chave'), ordenacao.id_coluna.label('_cursor_id'))
+    stmt = stmt.order_by(*clausulas_ordem(ordenacao, descendente))
+    if cursor is not None:
+        stmt = stmt.where(_filtro_apos(ordenacao, *cursor, descendente))
+    elif deslocamento:
+        stmt = stmt.offset(deslocamento)
+    return session.execute(stmt.limit(limite)).all()
+
+
+def paginar(session, stmt, ordenacao, por_pagina, pagina=None, apos=None, antes=None, complemento=None):
+    """Pagina ``stmt`` por cursor (chave de ordenação + id).
+
+    Com ``apos``/``antes`` a consulta é um seek no índice; sem cursor cai no
+    modo por ``pagina`` (OFFSET) para manter links antigos funcionando.
+    ``complemento`` é um segundo (stmt, ordenacao) com as mesmas colunas vindas
+    de outra fonte (as movimentações arquivadas): as duas consultas usam o mesmo
+    cursor e as linhas são intercaladas na ordem da página.
+    """
+    n_entidades = len(stmt.column_descriptions)
+    cursor_apos = decodificar_cursor(apos, ordenacao) if apos else None
+    cursor_antes = decodificar_cursor(antes, ordenacao) if antes else None
+
+    voltando = cursor_antes is not None
+    descendente = ordenacao.descendente != voltando
+    cursor = cursor_antes if voltando else cursor_apos
+    deslocamento = (pagina - 1) * por_pagina if cursor is None and pagina and pagina > 1 else 0
+
+    if complemento is None:
+        linhas = _buscar(session, stmt, ordenacao, descendente, cursor, deslocamento, por_pagina + 1)
+    else:
+        # O OFFSET só vale sobre o resultado intercalado: cada fonte traz as linhas até o fim da página
+        limite = deslocamento + por_pagina + 1
+        linhas = (_buscar(session, stmt, ordenacao, descendente, cursor, 0, limite)
+                  + _buscar(session, complemento[0], complemento[1], descendente, cursor, 0, limite))
+        linhas.sort(key=lambda linha: chave_intercalacao(linha[-2], linha[-1]), reverse=descendente)
+        linhas = linhas[deslocamento:limite]
+    tem_mais = len(linhas) > por_pagina
+    linhas = linhas[:por_pagina]
+    if voltando:
+        linhas.reverse()
+
+    proximo = anterior = None
+    if linhas:
+        primeiro = codificar_cursor(linhas[0][-2], linhas[0][-1])
+        ultimo = codificar_cursor(linhas[-1][-2], linhas[-1][-1])
+        if voltando:
+            anterior = primeiro if tem_mais else None
+            proximo = ultimo
+        else:
+            anterior = primeiro if cursor_apos is not None or (pagina or 1) > 1 else None
+            proximo = ultimo if tem_mais else None
+
+    if n_entidades == 1:
+        itens = [linha[0] for linha in linhas]
+    else:
+        itens = [tuple(linha[:n_entidades]) for linha in linhas]
+    return Pagina(itens, proximo, anterior)
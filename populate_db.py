@@ -1,118 +1,228 @@
+"""Popula o banco com dados fictícios em massa.
+
+Uso: python populate_db.py [--funcionarios 50] [--produtos 24] [--movimentacoes 24]
+                           [--semente 42] [--lote 10000] [--processos N]
+
+Os valores são gerados pelo Faker em paralelo (um pool de processos, um lote
+por tarefa) e gravados com insert() do Core em executemany, um lote por
+transação.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+import argparse
+import os
 import random
-from faker import Faker
-from models import db_session, Funcionario, Produto, Categoria, Movimentacao, init_db
-
-# Configuração para dados em português
-fake = Faker('pt_BR')
-
-def create_fake_funcionarios(num):
-    for _ in range(num):
-        funcionario = Funcionario(
-            nome_funcionario=fake.first_name(),
-            sobrenome=fake.last_name(),
-            email=fake.unique.email(),
-            cpf=fake.unique.random_int(min=10000000000, max=99999999999),
-            telefone=fake.phone_number(),
-            data_de_cadastro=fake.date_this_decade().isoformat()
-        )
-        funcionario.save()
-    db_session.commit()  # Salvar todos os funcionários no banco
+import time
 
-def create_fake_categorias():
-    categorias = [
-        'Eletrônicos', 'Alimentos', 'Roupas', 'Móveis', 'Livros',
-        'Ferramentas', 'Brinquedos', 'Cosméticos', 'Esporte',
-        'Jardinagem', 'Veículos', 'Informática', 'Bebidas',
-        'Utensílios Domésticos', 'Material Escolar'
-    ]
-    for nome_categoria in categorias:
-        categoria = Categoria(nome_categoria=nome_categoria)
-        categoria.save()
-    db_session.commit()  # Salvar todas as categorias no banco
-
-def create_fake_produtos():
-    categoria_produto_map = {
-        'Eletrônicos': [('Smartphone', 500, 3000), ('Notebook', 1000, 5000), ('Televisão', 800, 4000)],
-        'Alimentos': [('Cerveja', 5, 20), ('Refrigerante', 3, 10)],
-        'Roupas': [('Camiseta', 20, 100)],
-        'Móveis': [('Sofá', 300, 2000), ('Geladeira', 1000, 3000), ('Fogão', 300, 1500)],
-        'Livros': [('Livro', 20, 150)],
-        'Ferramentas': [('Chave Inglesa', 10, 50)],
-        'Brinquedos': [('Boneca', 20, 150), ('Brinquedo de Montar', 30, 200)],
-        'Cosméticos': [('Shampoo', 10, 50)],
-        'Esporte': [('Bola de Futebol', 50, 200)],
-        'Jardinagem': [('Regador', 15, 100)],
-        'Veículos': [('Carro', 15000, 50000), ('Motocicleta', 5000, 20000)],
-        'Informática': [('Mouse', 20, 150), ('Teclado', 50, 300)],
-        'Bebidas': [('Cerveja', 5, 15), ('Refrigerante', 3, 8)],
-        'Utensílios Domésticos': [('Cafeteira', 50, 300)],
-        'Material Escolar': [('Tesoura', 5, 20)]
-    }
-
-    categorias = db_session.query(Categoria).all()
-    categoria_ids = {categoria.nome_categoria: categoria.id_categoria for categoria in categorias}
-
-    for categoria, produtos in categoria_produto_map.items():
-        for nome_produto, preco_min, preco_max in produtos:
-            produto = Produto(
-                nome_produto=nome_produto,
-                preco_produto=round(random.uniform(preco_min, preco_max), 2),
-                qtd=random.randint(10, 100),  # Quantidade inicial de produtos
-                id_categoria=categoria_ids[categoria]
-            )
-            produto.save()
-    db_session.commit()  # Salvar todos os produtos no banco
-
-def create_fake_movimentacoes(num, funcionario_ids, produto_ids):
-    # Consulta os produtos para atualizar a quantidade
-    produtos_map = {produto.id_produto: produto for produto in db_session.query(Produto).all()}
-
-    for _ in range(num):
-        id_produto = random.choice(produto_ids)
-        quantidade = random.randint(1, 100)
-        status = random.choice(['1', '0'])
-
-        # Atualiza a quantidade de produtos com base na movimentação
-        if status == '1':
-            produtos_map[id_produto].qtd += quantidade
-        elif status == '0' and produtos_map[id_produto].qtd >= quantidade:
-            produtos_map[id_produto].qtd -= quantidade
-        else:
-            # Evita movimentações de saída que resultem em quantidade negativa
-            continue
-
-        movimentacao = Movimentacao(
-            quantidade_produto=quantidade,
-            fornecedor=fake.company(),
-            status=status,
-            data_da_movimentacao=fake.date_this_decade(),
-            id_funcionario=random.choice(funcionario_ids),
-            id_produto=id_produto
-        )
-        movimentacao.save()
-
-    # Salva as atualizações no banco
-    db_session.commit()
+from faker import Faker
+from sqlalchemy import bindparam, func, insert, select, update
+from models import engine, Funcionario, Produto, Categoria, Movimentacao, init_db
+from fechamentos import reconstruir_fechamentos
+
+CATEGORIA_PRODUTO_MAP = {
+    'Eletrônicos': [('Smartphone', 500, 3000), ('Notebook', 1000, 5000), ('Televisão', 800, 4000)],
+    'Alimentos': [('Cerveja', 5, 20), ('Refrigerante', 3, 10)],
+    'Roupas': [('Camiseta', 20, 100)],
+    'Móveis': [('Sofá', 300, 2000), ('Geladeira', 1000, 3000), ('Fogão', 300, 1500)],
+    'Livros': [('Livro', 20, 150)],
+    'Ferramentas': [('Chave Inglesa', 10, 50)],
+    'Brinquedos': [('Boneca', 20, 150), ('Brinquedo de Montar', 30, 200)],
+    'Cosméticos': [('Shampoo', 10, 50)],
+    'Esporte': [('Bola de Futebol', 50, 200)],
+    'Jardinagem': [('Regador', 15, 100)],
+    'Veículos': [('Carro', 15000, 50000), ('Motocicleta', 5000, 20000)],
+    'Informática': [('Mouse', 20, 150), ('Teclado', 50, 300)],
+    'Bebidas': [('Cerveja', 5, 15), ('Refrigerante', 3, 8)],
+    'Utensílios Domésticos': [('Cafeteira', 50, 300)],
+    'Material Escolar': [('Tesoura', 5, 20)]
+}
+MODELOS_PRODUTO = [(categoria, *produto)
+                   for categoria, produtos in CATEGORIA_PRODUTO_MAP.items() for produto in produtos]
+INICIO_DECADA = date(date.today().year // 10 * 10, 1, 1)
+
+
+def _faker(semente):
+    # Configuração para dados em português
+    fake = Faker('pt_BR')
+    fake.seed_instance(semente)
+    return fake
+
+
+def gerar_funcionarios(inicio, fim, semente):
+    # e-mail, CPF e telefone derivados do índice para continuarem únicos entre processos
+    fake = _faker(semente)
+    linhas = []
+    for i in range(inicio, fim):
+        nome, sobrenome = fake.first_name(), fake.last_name()
+        linhas.append({
+            'nome_funcionario': nome,
+            'sobrenome': sobrenome,
+            'email': f'{fake.user_name()}.{i}@{fake.free_email_domain()}',
+            'cpf': f'{10000000000 + i:011d}',
+            'telefone': f'(11) 9{i:08d}',
+            'data_de_cadastro': fake.date_between(INICIO_DECADA, date.today()).isoformat(),
+        })
+    return linhas
+
+
+def gerar_produtos(inicio, fim, semente):
+    # Retorna o índice do modelo (categoria) no lugar do id, resolvido no processo principal
+    fake = _faker(semente)
+    aleatorio = random.Random(semente)
+    linhas = []
+    for i in range(inicio, fim):
+        indice = i % len(MODELOS_PRODUTO)
+        _, nome, preco_min, preco_max = MODELOS_PRODUTO[indice]
+        # Os primeiros produtos mantêm o nome do catálogo original
+        if i >= len(MODELOS_PRODUTO):
+            nome = f'{nome} {fake.last_name()}'[:40]
+        linhas.append({
+            'modelo': indice,
+            'nome_produto': nome,
+            'preco_produto': round(aleatorio.uniform(preco_min, preco_max), 2),
+            'qtd': aleatorio.randint(10, 100),  # Quantidade inicial de produtos
+        })
+    return linhas
+
+
+def gerar_movimentacoes(quantidade, semente):
+    # Funcionário e produto saem como sorteio em [0, 1); o processo principal converte em ids
+    fake = _faker(semente)
+    aleatorio = random.Random(semente)
+    fornecedores = [fake.company() for _ in range(min(quantidade, 200))]
+    dias = (date.today() - INICIO_DECADA).days
+    return [(aleatorio.random(), aleatorio.random(), aleatorio.randint(1, 100),
+             aleatorio.choice(['1', '0']), aleatorio.choice(fornecedores),
+             INICIO_DECADA + timedelta(days=aleatorio.randint(0, dias)))
+            for _ in range(quantidade)]
+
+
+def _lotes(total, tamanho):
+    return [(inicio, min(inicio + tamanho, total)) for inicio in range(0, total, tamanho)]
+
+
+def _mapear(pool, funcao, tarefas):
+    # pool.map com uma tupla de argumentos por tarefa
+    return pool.map(funcao, *zip(*tarefas)) if tarefas else []
+
+
+def _gravar(tabela, linhas):
+    with engine.begin() as conexao:
+        conexao.execute(insert(tabela), linhas)
+
+
+def create_fake_funcionarios(pool, num, lote, semente):
+    # Os índices continuam depois do maior id existente: rodar de novo não repete e-mail, CPF e telefone
+    with engine.connect() as conexao:
+        deslocamento = conexao.execute(select(func.coalesce(func.max(Funcionario.id_funcionario), 0))).scalar()
+    tarefas = [(deslocamento + i, deslocamento + f, semente + deslocamento + n)
+               for n, (i, f) in enumerate(_lotes(num, lote))]
+    for linhas in _mapear(pool, gerar_funcionarios, tarefas):
+        _gravar(Funcionario.__table__, linhas)
 
-def main():
-    init_db()
 
-    # Criando dados fictícios
-    create_fake_funcionarios(50)
-    funcionarios = db_session.query(Funcionario).all()
-    funcionario_ids = [f.id_funcionario for f in funcionarios]
+def create_fake_categorias():
+    with engine.begin() as conexao:
+        existentes = set(conexao.execute(select(Categoria.nome_categoria)).scalars())
+        novas = [{'nome_categoria': nome} for nome in CATEGORIA_PRODUTO_MAP if nome not in existentes]
+        if novas:
+            conexao.execute(insert(Categoria.__table__), novas)
+        return dict(conexao.execute(select(Categoria.nome_categoria, Categoria.id_categoria)).all())
+
+
+def create_fake_produtos(pool, num, lote, semente, categoria_ids):
+    tarefas = [(i, f, semente + n) for n, (i, f) in enumerate(_lotes(num, lote))]
+    for linhas in _mapear(pool, gerar_produtos, tarefas):
+        for linha in linhas:
+            linha['id_categoria'] = categoria_ids[MODELOS_PRODUTO[linha.pop('modelo')][0]]
+        _gravar(Produto.__table__, linhas)
+
+
+def create_fake_movimentacoes(pool, num, lote, semente, funcionario_ids, precos):
+    # O estoque é acompanhado em memória e gravado uma vez no final
+    with engine.connect() as conexao:
+        estoque = dict(conexao.execute(select(Produto.id_produto, Produto.qtd)).all())
+
+    produto_ids = list(precos)
+    if not funcionario_ids or not produto_ids:
+        return 0
+    tarefas = [(f - i, semente + n) for n, (i, f) in enumerate(_lotes(num, lote))]
+    gravadas = 0
+    for candidatas in _mapear(pool, gerar_movimentacoes, tarefas):
+        linhas = []
+        for sorteio_funcionario, sorteio_produto, quantidade, status, fornecedor, data in candidatas:
+            id_produto = produto_ids[int(sorteio_produto * len(produto_ids))]
+            # Atualiza a quantidade de produtos com base na movimentação
+            if status == '1':
+                estoque[id_produto] = (estoque[id_produto] or 0) + quantidade
+            elif (estoque[id_produto] or 0) >= quantidade:
+                estoque[id_produto] -= quantidade
+            else:
+                # Evita movimentações de saída que resultem em quantidade negativa
+                continue
+            linhas.append({
+                'quantidade_produto': quantidade,
+                'valor_movimentacao': round(precos[id_produto] * quantidade, 2),
+                'fornecedor': fornecedor,
+                'status': status,
+                'data_da_movimentacao': data,
+                'id_funcionario': funcionario_ids[int(sorteio_funcionario * len(funcionario_ids))],
+                'id_produto': id_produto,
+            })
+        if linhas:
+            _gravar(Movimentacao.__table__, linhas)
+            gravadas += len(linhas)
+
+    atualizar = (update(Produto.__table__)
+                 .where(Produto.__table__.c.id_produto == bindparam('b_id_produto'))
+                 .values(qtd=bindparam('b_qtd')))
+    ajustes = [{'b_id_produto': id_produto, 'b_qtd': qtd} for id_produto, qtd in estoque.items()]
+    for inicio, fim in _lotes(len(ajustes), lote):
+        with engine.begin() as conexao:
+            conexao.execute(atualizar, ajustes[inicio:fim])
+    return gravadas
+
+
+def _cronometrar(nome, funcao, *args):
+    inicio = time.perf_counter()
+    resultado = funcao(*args)
+    duracao = time.perf_counter() - inicio
+    print(f'{nome}: {duracao:.2f}s')
+    return resultado
 
-    create_fake_categorias()
-    categorias = db_session.query(Categoria).all()
-    categoria_ids = [c.id_categoria for c in categorias]
 
-    create_fake_produtos()
-    produtos = db_session.query(Produto).all()
-    produto_ids = [p.id_produto for p in produtos]
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--funcionarios', type=int, default=50)
+    parser.add_argument('--produtos', type=int, default=len(MODELOS_PRODUTO))
+    parser.add_argument('--movimentacoes', type=int, help='padrão: uma por produto')
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--lote', type=int, default=10000)
+    parser.add_argument('--processos', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+    movimentacoes = args.produtos if args.movimentacoes is None else args.movimentacoes
 
-    create_fake_movimentacoes(len(produto_ids), funcionario_ids, produto_ids)
+    init_db()
+    inicio = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.processos) as pool:
+        # Criando dados fictícios
+        _cronometrar(f'funcionarios ({args.funcionarios})', create_fake_funcionarios,
+                     pool, args.funcionarios, args.lote, args.semente)
+        categoria_ids = _cronometrar('categorias', create_fake_categorias)
+        _cronometrar(f'produtos ({args.produtos})', create_fake_produtos,
+                     pool, args.produtos, args.lote, args.semente + 100000, categoria_ids)
+
+        with engine.connect() as conexao:
+            funcionario_ids = conexao.execute(select(Funcionario.id_funcionario)).scalars().all()
+            precos = dict(conexao.execute(select(Produto.id_produto, Produto.preco_produto)).all())
+        gravadas = _cronometrar(f'movimentacoes ({movimentacoes} sorteadas)', create_fake_movimentacoes,
+                                pool, movimentacoes, args.lote, args.semente + 200000, funcionario_ids, precos)
+    # O estoque inicial dos produtos não vem de movimentações: os fechamentos partem do saldo final
+    _cronometrar('fechamentos de estoque', reconstruir_fechamentos)
+
+    print(f"Banco de dados populado com dados fictícios ({gravadas} movimentações) "
+          f"em {time.perf_counter() - inicio:.2f}s.")
 
-    print("Banco de dados populado com dados fictícios.")
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,211 @@
+"""Pipeline de respostas HTTP: compressão, cache dos arquivos estáticos e ETags das páginas.
+
+instalar(app) liga três coisas:
+- gzip (ou brotli, se o pacote estiver instalado) conforme o Accept-Encoding,
+  para respostas de texto a partir de COMPRESSAO_MINIMO bytes;
+- url_for('static', ...) ganha ?v=<hash do conteúdo>; pedidos com o hash atual
+  voltam com Cache-Control immutable de um ano;
+- @pagina_condicional(*tabelas) dá às páginas um ETag fraco tirado da versão dos
+  dados (versoes_tabelas, no banco), e a revalidação de uma página que não mudou
+  custa um 304 com uma única consulta.
+"""
+from functools import wraps
+import gzip
+import hashlib
+import os
+import threading
+import zlib
+
+from flask import current_app, make_response, request, session
+
+from cache import MemoriaLRU
+from config import COMPRESSAO_MINIMO
+from versoes import assinatura
+
+try:
+    import brotli
+except ImportError:  # brotli é opcional; sem ele fica só o gzip
+    brotli = None
+
+UM_ANO = 365 * 24 * 3600
+NIVEL_GZIP = 6
+NIVEL_BROTLI = 5
+TIPOS_COMPRIMIVEIS = ('text/', 'application/json', 'application/javascript', 'application/x-ndjson',
+                      'application/xml', 'image/svg+xml')
+
+# Estáticos comprimidos uma vez por ETag do arquivo: o plotly.min.js tem vários MB.
+# Só os endpoints de ESTATICOS entram; outros arquivos (downloads das tarefas) saem em fluxo.
+ESTATICOS = ('static', 'plotly_js')
+COMPRIMIDOS_MAXIMO_BYTES = 16 * 1024 * 1024
+_comprimidos = MemoriaLRU(maximo=64, ttl=None, maximo_bytes=COMPRIMIDOS_MAXIMO_BYTES)
+_trava = threading.Lock()
+_impressoes = {}  # caminho -> (mtime, tamanho, hash)
+_versao_templates = []
+
+
+def codificacoes():
+    return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+
+def comprimir(dados, codificacao):
+    if codificacao == 'br':
+        return brotli.compress(dados, quality=NIVEL_BROTLI)
+    return gzip.compress(dados, compresslevel=NIVEL_GZIP, mtime=0)
+
+
+def _gzip_em_fluxo(partes):
+    # Respostas em streaming (NDJSON da API, CSV da exportação) saem comprimidas parte a parte
+    compressor = zlib.compressobj(NIVEL_GZIP, zlib.DEFLATED, 31)
+    try:
+        for parte in partes:
+            if isinstance(parte, str):
+                parte = parte.encode()
+            bloco = compressor.compress(parte)
+            if bloco:
+                yield bloco
+        yield compressor.flush()
+    finally:
+        # Fecha a origem (o arquivo de um send_file), como o WSGI faria sem a compressão
+        if hasattr(partes, 'close'):
+            partes.close()
+
+
+def _comprimivel(resposta):
+    return (resposta.status_code == 200 and 'Content-Encoding' not in resposta.headers
+            and resposta.mimetype.startswith(TIPOS_COMPRIMIVEIS) and 'Range' not in request.headers)
+
+
+def _negociar_compressao(resposta):
+    if request.method == 'HEAD' or not _comprimivel(resposta):
+        return resposta
+    resposta.vary.add('Accept-Encoding')
+    codificacao = request.accept_encodings.best_match(codificacoes())
+    if codificacao is None:
+        return resposta
+
+    if resposta.direct_passthrough and request.endpoint in ESTATICOS:
+        # Estático: o ETag do arquivo identifica o conteúdo, então a versão comprimida é reaproveitada
+        etag, _ = resposta.get_etag()
+        item = _comprimidos.ler((etag, codificacao)) if etag else None
+        resposta.direct_passthrough = False
+        if item is not None:
+            corpo = item[1]
+        else:
+            dados = resposta.get_data()
+            if len(dados) < COMPRESSAO_MINIMO:
+                return resposta
+            corpo = comprimir(dados, codificacao)
+            if etag:
+                _comprimidos.gravar((etag, codificacao), 0, corpo)
+        resposta.set_data(corpo)
+    elif resposta.direct_passthrough or resposta.is_streamed:
+        # Em fluxo só gzip: o tamanho final não é conhecido, então não há limite mínimo.
+        # Arquivos gerados (exportações) são lidos em pedaços, sem ficar inteiros na memória.
+        if not request.accept_encodings['gzip']:
+            return resposta
+        codificacao = 'gzip'
+        resposta.direct_passthrough = False
+        resposta.response = _gzip_em_fluxo(resposta.response)
+        resposta.headers.pop('Content-Length', None)
+    else:
+        dados = resposta.get_data()
+        if len(dados) < COMPRESSAO_MINIMO:
+            return resposta
+        resposta.set_data(comprimir(dados, codificacao))
+
+    resposta.headers['Content-Encoding'] = codificacao
+    # O corpo comprimido é outra representação: o ETag forte passa a fraco
+    etag, fraco = resposta.get_etag()
+    if etag and not fraco:
+        resposta.set_etag(etag, weak=True)
+    return resposta
+
+
+def impressao_digital(caminho):
+    # Hash curto do conteúdo, recalculado só quando o arquivo muda
+    try:
+        estado = os.stat(caminho)
+    except OSError:
+        return None
+    with _trava:
+        memorizado = _impressoes.get(caminho)
+    if memorizado and memorizado[:2] == (estado.st_mtime_ns, estado.st_size):
+        return memorizado[2]
+    with open(caminho, 'rb') as arquivo:
+        impressao = hashlib.sha1(arquivo.read()).hexdigest()[:12]
+    with _trava:
+        _impressoes[caminho] = (estado.st_mtime_ns, estado.st_size, impressao)
+    return impressao
+
+
+def _caminho_estatico(nome):
+    return os.path.join(current_app.static_folder, nome)
+
+
+def _url_estatico(endpoint, valores):
+    if endpoint == 'static' and 'filename' in valores and 'v' not in valores:
+        impressao = impressao_digital(_caminho_estatico(valores['filename']))
+        if impressao:
+            valores['v'] = impressao
+
+
+def _cache_estatico(resposta):
+    # Com o hash do conteúdo na URL o arquivo nunca muda sob ela: guarda por um ano sem revalidar.
+    # Hash antigo ou ausente fica no padrão (revalida pelo ETag).
+    if request.endpoint == 'static' and resposta.status_code in (200, 304):
+        versao = request.args.get('v')
+        if versao and versao == impressao_digital(_caminho_estatico(request.view_args['filename'])):
+            resposta.cache_control.public = True
+            resposta.cache_control.max_age = UM_ANO
+            resposta.cache_control.immutable = True
+            resposta.cache_control.no_cache = None
+    return resposta
+
+
+def _versao_das_paginas():
+    # Muda quando um template muda, para o ETag de uma página não sobreviver a um deploy
+    if not _versao_templates:
+        resumo = hashlib.sha1()
+        pasta = os.path.join(current_app.root_path, current_app.template_folder)
+        for raiz, _, arquivos in sorted(os.walk(pasta)):
+            for nome in sorted(arquivos):
+                with open(os.path.join(raiz, nome), 'rb') as arquivo:
+                    resumo.update(arquivo.read())
+        _versao_templates.append(resumo.hexdigest()[:8])
+    return _versao_templates[0]
+
+
+def pagina_condicional(*tabelas):
+    """ETag fraco para uma página GET que só depende das tabelas informadas (e da URL).
+
+    Com o mesmo ETag no If-None-Match a view nem roda: 304 só com a leitura das versões.
+    Páginas com mensagens flash pendentes não recebem ETag.
+    """
+    def decorador(view):
+        @wraps(view)
+        def condicional(*args, **kwargs):
+            if request.method != 'GET' or '_flashes' in session:
+                return view(*args, **kwargs)
+            versoes = assinatura(*tabelas)
+            if versoes is None:  # banco sem as versões dos dados: sem ETag
+                return view(*args, **kwargs)
+            numeros = '.'.join(str(numero) for numero in versoes)
+            etag = f'{_versao_das_paginas()}-{numeros}'
+            if request.if_none_match.contains_weak(etag):
+                resposta = make_response('', 304)
+            else:
+                resposta = make_response(view(*args, **kwargs))
+                if resposta.status_code != 200:
+                    return resposta
+            resposta.set_etag(etag, weak=True)
+            resposta.cache_control.no_cache = True
+            return resposta
+        return condicional
+    return decorador
+
+
+def instalar(app):
+    app.url_defaults(_url_estatico)
+    # after_request roda na ordem inversa do registro: o cache dos estáticos antes da compressão
+    app.after_request(_negociar_compressao)
+    app.after_request(_cache_estatico)
@@ -0,0 +1,31 @@
+from sqlalchemy import select, delete, func
+from models import Base, ResumoMensal, db_leitura, engine, exigir_sqlite, instalar_resumos
+from arquivamento import somar_arquivadas
+
+
+def resumo_mensal(dimensao='mes', chave=0, session=db_leitura):
+    # Poucas linhas por dimensão/chave, lidas pela chave primária em ordem de mês
+    exigir_sqlite('O resumo mensal')
+    return session.execute(
+        select(ResumoMensal.mes_ano, ResumoMensal.total_produtos, ResumoMensal.total_movimentacoes)
+        .where(ResumoMensal.dimensao == dimensao,
+               ResumoMensal.chave == chave,
+               ResumoMensal.total_produtos > 0)
+        .order_by(ResumoMensal.mes_ano)
+    ).all()
+
+
+def reconstruir_resumos():
+    # Apaga e recalcula o resumo a partir de todas as movimentações, arquivadas inclusive
+    exigir_sqlite('A reconstrução do resumo mensal')
+    with engine.begin() as conexao:
+        conexao.execute(delete(ResumoMensal))
+        instalar_resumos(Base.metadata, conexao)
+        somar_arquivadas(conexao, resumos=True)
+        return conexao.execute(select(func.count()).select_from(ResumoMensal)).scalar()
+
+
+if __name__ == '__main__':
+    reconstruir_resumos()
+    for linha in resumo_mensal():
+        print(f'{linha.mes_ano}: {linha.total_produtos} produtos em {linha.total_movimentacoes} movimentações')
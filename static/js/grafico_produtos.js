@@ -0,0 +1,49 @@
+// Desenha o gráfico de produtos por mês/ano no navegador.
+// A série vem uma vez de /produto/grafico/dados; trocar o tipo só redesenha.
+(function () {
+    const LARGURA = 1400;
+    const ALTURA = 700;
+    const EIXOS = {xaxis: {title: {text: 'Mês/Ano'}}, yaxis: {title: {text: 'Total de Produtos'}}};
+
+    // tipo: (série) -> [traços, layout], no mesmo formato que o plotly.express gerava
+    const FIGURAS = {
+        bar: (s) => [[{type: 'bar', x: s.meses, y: s.totais}],
+            {title: {text: 'Produtos por Mês/Ano'}, ...EIXOS}],
+        line: (s) => [[{type: 'scatter', mode: 'lines', x: s.meses, y: s.totais}],
+            {title: {text: 'Produtos por Mês/Ano'}, ...EIXOS}],
+        pie: (s) => [[{type: 'pie', labels: s.meses, values: s.totais}],
+            {title: {text: 'Distribuição de Produtos por Mês/Ano'}}],
+        scatter: (s) => [[{type: 'scatter', mode: 'markers', x: s.meses, y: s.totais}],
+            {title: {text: 'Dispersão de Produtos por Mês/Ano'}, ...EIXOS}],
+        area: (s) => [[{type: 'scatter', mode: 'lines', fill: 'tozeroy', x: s.meses, y: s.totais}],
+            {title: {text: 'Área de Produtos por Mês/Ano'}, ...EIXOS}],
+    };
+
+    const alvo = document.getElementById('grafico');
+    const seletor = document.getElementById('tipo_grafico');
+    const arquivo = document.getElementById('tipo_grafico_arquivo');
+    let serie = null;
+
+    function desenhar() {
+        if (serie === null) {
+            return;
+        }
+        const tipo = FIGURAS[seletor.value] ? seletor.value : 'bar';
+        const [tracos, layout] = FIGURAS[tipo](serie);
+        Plotly.react(alvo, tracos, {...layout, width: LARGURA, height: ALTURA});
+        // Mantém o tipo na URL para recarregar ou compartilhar o mesmo gráfico, e no arquivo a baixar
+        history.replaceState(null, '', `?tipo_grafico=${tipo}`);
+        arquivo.value = tipo;
+    }
+
+    seletor.addEventListener('change', desenhar);
+    fetch(alvo.dataset.dados)
+        .then((resposta) => resposta.json())
+        .then((dados) => {
+            serie = dados;
+            desenhar();
+        })
+        .catch(() => {
+            alvo.textContent = 'Não foi possível carregar os dados do gráfico.';
+        });
+})();
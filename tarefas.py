@@ -0,0 +1,482 @@
+"""Tarefas em segundo plano: exportações, reconstruções e geração de gráficos.
+
+Uso: python tarefas.py [--listar] [--limpar] [--executar TIPO [--parametros JSON]]
+
+enviar(tipo, parametros) grava a tarefa na tabela tarefas e devolve o id na
+hora; um pool de TAREFAS_TRABALHADORES threads executa as pendentes, no máximo
+`limite` de cada tipo ao mesmo tempo (contando todos os processos que dividem o
+banco). Estado, progresso e o arquivo gerado ficam na tabela, então qualquer
+worker responde pela tarefa. cancelar(id) tira a tarefa da fila ou, nos tipos
+interrompíveis, faz ela parar no próximo lote e descartar o arquivo; manutenções
+já iniciadas vão até o fim. Tarefas de um processo que morreu são dadas como falhas,
+e as terminadas há mais de TAREFAS_RETENCAO_HORAS são apagadas com o arquivo.
+
+--executar envia a tarefa e espera ela terminar, mostrando o resultado.
+"""
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import delete, func, insert, select, update
+from config import TAREFAS_PASTA, TAREFAS_RETENCAO_HORAS, TAREFAS_TRABALHADORES
+from models import TABELAS_CONTADAS, Tarefa, db_leitura, engine, engine_leitura, remover_sessoes
+from versoes import ID_PROCESSO, registrar_alteracao
+
+PENDENTE, EXECUTANDO, CONCLUIDA, FALHOU, CANCELADA = 'pendente', 'executando', 'concluida', 'falhou', 'cancelada'
+TERMINADAS = (CONCLUIDA, FALHOU, CANCELADA)
+# Intervalo mínimo entre duas gravações de progresso (que também leem o pedido de cancelamento)
+INTERVALO_PROGRESSO = 1.0
+# A cada PULSO segundos o processo renova as tarefas que executa e despacha as pendentes;
+# uma tarefa em execução sem renovação há ORFA segundos ficou sem processo
+PULSO = 5.0
+ORFA = 60.0
+LIMPEZA = 3600.0
+
+log = logging.getLogger('tarefas')
+
+TipoTarefa = namedtuple('TipoTarefa', 'executar limite validar interrompivel')
+# Tipos registrados por @tipo_tarefa
+TIPOS = {}
+
+_trava = threading.Lock()
+_executando = set()  # ids em execução neste processo
+_pool = []
+
+
+class ErroTarefa(ValueError):
+    pass
+
+
+class TarefaCancelada(Exception):
+    pass
+
+
+def tipo_tarefa(nome, limite=1, validar=None, interrompivel=True):
+    """Registra executar(contexto, **parametros) -> mensagem como o tipo `nome`.
+
+    validar(parametros) devolve os parâmetros normalizados ou levanta ErroTarefa,
+    ainda na requisição que envia a tarefa. Uma tarefa interrompível pode ser
+    cancelada em execução até o fim: o resultado é descartado. As outras só
+    enquanto estão na fila.
+    """
+    def registrar(funcao):
+        TIPOS[nome] = TipoTarefa(funcao, limite, validar, interrompivel)
+        return funcao
+    return registrar
+
+
+class Contexto:
+    # O que a função da tarefa recebe: o arquivo de saída e o progresso/cancelamento
+    def __init__(self, id_tarefa):
+        self.id_tarefa = id_tarefa
+        self.arquivo = None
+        self.nome_download = None
+        self._gravado_em = 0.0
+
+    def saida(self, extensao, nome_download):
+        # Caminho do arquivo que a tarefa vai gerar, em TAREFAS_PASTA
+        os.makedirs(TAREFAS_PASTA, exist_ok=True)
+        self.arquivo = os.path.join(TAREFAS_PASTA, f'tarefa_{self.id_tarefa}{extensao}')
+        self.nome_download = nome_download
+        return self.arquivo
+
+    def verificar(self, feito=None, total=None):
+        """Grava o progresso e levanta TarefaCancelada se o cancelamento foi pedido.
+
+        Chame entre lotes; vai ao banco no máximo uma vez por INTERVALO_PROGRESSO.
+        """
+        agora = time.monotonic()
+        if agora - self._gravado_em < INTERVALO_PROGRESSO:
+            return
+        self._gravado_em = agora
+        valores = {'atualizada_em': datetime.now()}
+        if feito is not None and total:
+            valores['progresso'] = min(99, int(feito * 100 / total))
+        with engine.begin() as conexao:
+            cancelar = conexao.execute(update(Tarefa).where(Tarefa.id_tarefa == self.id_tarefa)
+                                       .values(**valores).returning(Tarefa.cancelar)).scalar()
+        if cancelar:
+            raise TarefaCancelada()
+
+
+def enviar(tipo, parametros=None):
+    """Grava a tarefa como pendente e devolve o id; a execução começa em seguida."""
+    if tipo not in TIPOS:
+        raise ErroTarefa(f"Tipo de tarefa inválido. Use um de: {', '.join(TIPOS)}.")
+    parametros = dict(parametros or {})
+    if TIPOS[tipo].validar is not None:
+        parametros = TIPOS[tipo].validar(parametros)
+    with engine.begin() as conexao:
+        id_tarefa = conexao.execute(insert(Tarefa).values(
+            tipo=tipo, parametros=json.dumps(parametros, ensure_ascii=False), estado=PENDENTE,
+            progresso=0, cancelar=0, criada_em=datetime.now())).inserted_primary_key[0]
+    _iniciar()
+    _despachar()
+    return id_tarefa
+
+
+def cancelavel(tarefa):
+    # Se cancelar(tarefa) seria aceito agora (para mostrar ou não o botão)
+    return tarefa.estado == PENDENTE or (tarefa.estado == EXECUTANDO and tarefa.tipo in TIPOS
+                                         and TIPOS[tarefa.tipo].interrompivel)
+
+
+def cancelar(id_tarefa):
+    # Pendente sai da fila na hora; em execução (só os tipos interrompíveis) termina como cancelada
+    # no próximo verificar() ou, se já passou do último, ao concluir. Retorna se o pedido foi aceito.
+    with engine.begin() as conexao:
+        if conexao.execute(update(Tarefa).where(Tarefa.id_tarefa == id_tarefa, Tarefa.estado == PENDENTE)
+                           .values(estado=CANCELADA, mensagem='Cancelada antes de começar.',
+                                   terminada_em=datetime.now())).rowcount:
+            return True
+        interrompiveis = [nome for nome, tipo in TIPOS.items() if tipo.interrompivel]
+        return bool(conexao.execute(update(Tarefa).where(Tarefa.id_tarefa == id_tarefa,
+                                                         Tarefa.estado == EXECUTANDO,
+                                                         Tarefa.tipo.in_(interrompiveis))
+                                    .values(cancelar=1)).rowcount)
+
+
+def obter(id_tarefa, session=db_leitura):
+    return session.get(Tarefa, id_tarefa, populate_existing=True)
+
+
+def listar(limite=50, estado=None, tipo=None, session=db_leitura):
+    stmt = select(Tarefa).order_by(Tarefa.id_tarefa.desc()).limit(limite)
+    if estado:
+        stmt = stmt.where(Tarefa.estado == estado)
+    if tipo:
+        stmt = stmt.where(Tarefa.tipo == tipo)
+    return session.execute(stmt).scalars().all()
+
+
+def arquivo_pronto(tarefa):
+    # Caminho do arquivo de uma tarefa concluída, se ele ainda existir
+    if tarefa is None or tarefa.estado != CONCLUIDA or not tarefa.arquivo:
+        return None
+    return tarefa.arquivo if os.path.exists(tarefa.arquivo) else None
+
+
+def aguardar(id_tarefa, intervalo=0.2):
+    while True:
+        with engine.connect() as conexao:
+            estado = conexao.execute(select(Tarefa.estado).where(Tarefa.id_tarefa == id_tarefa)).scalar()
+        if estado is None or estado in TERMINADAS:
+            return estado
+        time.sleep(intervalo)
+
+
+def _iniciar():
+    # Pool e pulso criados na primeira tarefa do processo: quem só serve páginas não abre threads
+    with _trava:
+        if _pool:
+            return
+        _pool.append(ThreadPoolExecutor(max_workers=TAREFAS_TRABALHADORES, thread_name_prefix='tarefa'))
+        threading.Thread(target=_pulsar, name='tarefas-pulso', daemon=True).start()
+
+
+def _despachar():
+    # Reserva pendentes enquanto houver thread livre. O UPDATE só pega a tarefa se ela continua
+    # pendente e o tipo está abaixo do limite: dois processos nunca reservam a mesma.
+    with _trava:
+        if not _pool:
+            return
+        livres = TAREFAS_TRABALHADORES - len(_executando)
+        if livres <= 0:
+            return
+        reservadas = []
+        with engine.begin() as conexao:
+            pendentes = conexao.execute(select(Tarefa.id_tarefa, Tarefa.tipo).where(Tarefa.estado == PENDENTE)
+                                        .order_by(Tarefa.id_tarefa)).all()
+            for id_tarefa, tipo in pendentes:
+                if livres <= 0:
+                    break
+                if tipo not in TIPOS:
+                    _terminar(conexao, id_tarefa, FALHOU, f"Tipo de tarefa desconhecido: '{tipo}'.",
+                              estado_atual=PENDENTE)
+                    continue
+                em_execucao = (select(func.count()).select_from(Tarefa)
+                               .where(Tarefa.tipo == tipo, Tarefa.estado == EXECUTANDO).scalar_subquery())
+                agora = datetime.now()
+                reservada = conexao.execute(
+                    update(Tarefa).where(Tarefa.id_tarefa == id_tarefa, Tarefa.estado == PENDENTE,
+                                         em_execucao < TIPOS[tipo].limite)
+                    .values(estado=EXECUTANDO, processo=ID_PROCESSO, iniciada_em=agora, atualizada_em=agora)
+                ).rowcount
+                if reservada:
+                    reservadas.append(id_tarefa)
+                    livres -= 1
+        # Só depois do commit: a thread já encontra a tarefa reservada
+        for id_tarefa in reservadas:
+            _executando.add(id_tarefa)
+            _pool[0].submit(_executar, id_tarefa)
+
+
+def _terminar(conexao, id_tarefa, estado, mensagem, *condicoes, estado_atual=EXECUTANDO, **valores):
+    # Só a tarefa que ainda está no estado esperado: uma órfã já dada como falha não volta
+    stmt = update(Tarefa).where(Tarefa.id_tarefa == id_tarefa, Tarefa.estado == estado_atual, *condicoes)
+    if estado_atual == EXECUTANDO:
+        stmt = stmt.where(Tarefa.processo == ID_PROCESSO)
+    return conexao.execute(stmt.values(estado=estado, mensagem=mensagem, terminada_em=datetime.now(),
+                                       atualizada_em=datetime.now(), **valores)).rowcount
+
+
+def _apagar(caminho):
+    if caminho and os.path.exists(caminho):
+        os.remove(caminho)
+
+
+def _executar(id_tarefa):
+    contexto = Contexto(id_tarefa)
+    try:
+        with engine.connect() as conexao:
+            tipo, parametros = conexao.execute(select(Tarefa.tipo, Tarefa.parametros)
+                                               .where(Tarefa.id_tarefa == id_tarefa)).one()
+        mensagem = TIPOS[tipo].executar(contexto, **json.loads(parametros))
+        # Conclui só sem pedido de cancelamento, no mesmo UPDATE: um pedido aceito nunca vira concluída
+        with engine.begin() as conexao:
+            concluida = _terminar(conexao, id_tarefa, CONCLUIDA, mensagem, Tarefa.cancelar == 0, progresso=100,
+                                  arquivo=contexto.arquivo, nome_download=contexto.nome_download)
+        if not concluida:
+            raise TarefaCancelada()
+    except TarefaCancelada:
+        _apagar(contexto.arquivo)
+        with engine.begin() as conexao:
+            _terminar(conexao, id_tarefa, CANCELADA, 'Cancelada durante a execução.')
+    except Exception as erro:
+        log.exception('Tarefa %s falhou', id_tarefa)
+        _apagar(contexto.arquivo)
+        with engine.begin() as conexao:
+            _terminar(conexao, id_tarefa, FALHOU, str(erro) or type(erro).__name__)
+    finally:
+        # A thread do pool é reaproveitada: não leva a sessão desta tarefa para a próxima
+        remover_sessoes()
+        with _trava:
+            _executando.discard(id_tarefa)
+        _despachar()
+
+
+def _pulsar():
+    limpeza = 0.0
+    while True:
+        time.sleep(PULSO)
+        try:
+            agora = datetime.now()
+            with _trava:
+                meus = list(_executando)
+            with engine.begin() as conexao:
+                if meus:
+                    conexao.execute(update(Tarefa).where(Tarefa.id_tarefa.in_(meus), Tarefa.estado == EXECUTANDO)
+                                    .values(atualizada_em=agora))
+                conexao.execute(update(Tarefa).where(Tarefa.estado == EXECUTANDO,
+                                                     Tarefa.atualizada_em < agora - timedelta(seconds=ORFA))
+                                .values(estado=FALHOU, terminada_em=agora,
+                                        mensagem='Interrompida: o processo que a executava parou.'))
+            _despachar()
+            if time.monotonic() - limpeza >= LIMPEZA:
+                limpeza = time.monotonic()
+                limpar()
+        except Exception:
+            log.exception('Falha no pulso das tarefas')
+
+
+def limpar(horas=TAREFAS_RETENCAO_HORAS):
+    """Apaga as tarefas terminadas há mais de `horas` e os arquivos delas; retorna quantas."""
+    limite = datetime.now() - timedelta(hours=horas)
+    with engine.begin() as conexao:
+        antigas = conexao.execute(select(Tarefa.id_tarefa, Tarefa.arquivo)
+                                  .where(Tarefa.estado.in_(TERMINADAS), Tarefa.terminada_em < limite)).all()
+        for _, arquivo in antigas:
+            _apagar(arquivo)
+        if antigas:
+            conexao.execute(delete(Tarefa).where(Tarefa.id_tarefa.in_([id_tarefa for id_tarefa, _ in antigas])))
+    return len(antigas)
+
+
+def _data_opcional(parametros, nome):
+    valor = parametros.get(nome)
+    try:
+        return date.fromisoformat(str(valor)).isoformat() if valor else None
+    except ValueError:
+        raise ErroTarefa(f"Parâmetro '{nome}' deve estar no formato AAAA-MM-DD.")
+
+
+def _validar_exportacao(parametros):
+    formato = parametros.get('formato') or 'xlsx'
+    if formato not in ('csv', 'xlsx'):
+        raise ErroTarefa("Formato deve ser 'csv' ou 'xlsx'.")
+    status = parametros.get('status') or None
+    if status not in (None, '0', '1'):
+        raise ErroTarefa("Status deve ser '0' ou '1'.")
+    try:
+        id_produto = int(parametros['id_produto']) if parametros.get('id_produto') else None
+    except (TypeError, ValueError):
+        raise ErroTarefa("Parâmetro 'id_produto' deve ser inteiro.")
+    return {'de': _data_opcional(parametros, 'de'), 'ate': _data_opcional(parametros, 'ate'),
+            'id_produto': id_produto, 'status': status, 'formato': formato}
+
+
+@tipo_tarefa('exportacao', limite=2, validar=_validar_exportacao)
+def exportar(contexto, de, ate, id_produto, status, formato):
+    from exportacao import LOTE, consulta_exportacao, gerar_csv, gravar_xlsx
+
+    de = date.fromisoformat(de) if de else None
+    ate = date.fromisoformat(ate) if ate else None
+    stmt = consulta_exportacao(de, ate, id_produto, status)
+    # A contagem leva as opções da consulta (o período arquivado anexa o arquivo)
+    contagem = select(func.count()).select_from(stmt.subquery()).execution_options(**stmt.get_execution_options())
+    with engine_leitura.connect() as conexao:
+        total = conexao.execute(contagem).scalar()
+
+    def a_cada_lote(linhas):
+        contexto.verificar(linhas, total)
+
+    destino = contexto.saida(f'.{formato}', f"movimentacoes_{de or 'inicio'}_{ate or 'hoje'}.{formato}")
+    if formato == 'xlsx':
+        gravar_xlsx(stmt, destino, a_cada_lote)
+    else:
+        with open(destino, 'w', newline='', encoding='utf-8') as saida:
+            for pedaco in gerar_csv(stmt, a_cada_lote):
+                saida.write(pedaco)
+    return f'{total} movimentação(ões) exportadas.'
+
+
+# tipo: (traço, título), como o static/js/grafico_produtos.js desenha na página
+FIGURAS = {
+    'bar': ({'type': 'bar'}, 'Produtos por Mês/Ano'),
+    'line': ({'type': 'scatter', 'mode': 'lines'}, 'Produtos por Mês/Ano'),
+    'pie': ({'type': 'pie'}, 'Distribuição de Produtos por Mês/Ano'),
+    'scatter': ({'type': 'scatter', 'mode': 'markers'}, 'Dispersão de Produtos por Mês/Ano'),
+    'area': ({'type': 'scatter', 'mode': 'lines', 'fill': 'tozeroy'}, 'Área de Produtos por Mês/Ano'),
+}
+
+
+def _validar_grafico(parametros):
+    tipo_grafico = parametros.get('tipo_grafico') or 'bar'
+    if tipo_grafico not in FIGURAS:
+        raise ErroTarefa(f"Tipo de gráfico inválido. Use um de: {', '.join(FIGURAS)}.")
+    return {'tipo_grafico': tipo_grafico}
+
+
+@tipo_tarefa('grafico', limite=1, validar=_validar_grafico)
+def gerar_grafico(contexto, tipo_grafico):
+    # HTML autônomo (plotly.js embutido) para baixar e abrir sem o servidor
+    try:
+        import plotly.graph_objects as go
+    except ImportError:
+        raise RuntimeError("Gerar o gráfico requer o pacote 'plotly'.")
+    from resumos import resumo_mensal
+
+    linhas = resumo_mensal('mes')
+    meses = [linha.mes_ano for linha in linhas]
+    totais = [linha.total_produtos for linha in linhas]
+    contexto.verificar()
+    traco, titulo = FIGURAS[tipo_grafico]
+    if traco['type'] == 'pie':
+        traco = {**traco, 'labels': meses, 'values': totais}
+    else:
+        traco = {**traco, 'x': meses, 'y': totais}
+    layout = {'title': {'text': titulo}, 'width': 1400, 'height': 700}
+    if traco['type'] != 'pie':
+        layout.update(xaxis={'title': {'text': 'Mês/Ano'}}, yaxis={'title': {'text': 'Total de Produtos'}})
+    figura = go.Figure(data=[traco], layout=layout)
+    figura.write_html(contexto.saida('.html', f'grafico_produtos_{tipo_grafico}.html'), include_plotlyjs=True)
+    return f'Gráfico com {len(meses)} mês(es).'
+
+
+def _manter_fechamentos(meses):
+    from fechamentos import fechar_periodos
+
+    fechados = [corte for corte, produtos in fechar_periodos() if produtos]
+    return f'{len(fechados)} mês(es) fechado(s).'
+
+
+def _manter_resumos(meses):
+    from resumos import reconstruir_resumos
+
+    linhas = reconstruir_resumos()
+    registrar_alteracao('movimentacoes')
+    return f'Resumo mensal reconstruído: {linhas} linha(s).'
+
+
+def _manter_contadores(meses):
+    from contadores import reconstruir_contadores
+
+    contadores = reconstruir_contadores()
+    registrar_alteracao(*TABELAS_CONTADAS)
+    return 'Contadores: ' + ', '.join(f'{nome} {valor}' for nome, valor in contadores.items()) + '.'
+
+
+def _manter_arquivamento(meses):
+    from arquivamento import arquivar, corte_padrao
+
+    corte = corte_padrao(meses)
+    movidas, lotes = arquivar(corte)
+    return f'{movidas} movimentação(ões) anteriores a {corte} arquivadas em {lotes} lote(s).'
+
+
+# operação: função(meses) -> mensagem. Cada uma roda numa transação (ou em lotes, no
+# arquivamento), então o cancelamento só vale antes de ela começar.
+MANUTENCOES = {
+    'fechamentos': _manter_fechamentos,
+    'resumos': _manter_resumos,
+    'contadores': _manter_contadores,
+    'arquivamento': _manter_arquivamento,
+}
+
+
+def _validar_manutencao(parametros):
+    from config import ARQUIVAR_APOS_MESES
+
+    operacao = parametros.get('operacao')
+    if operacao not in MANUTENCOES:
+        raise ErroTarefa(f"Operação inválida. Use uma de: {', '.join(MANUTENCOES)}.")
+    try:
+        meses = int(parametros.get('meses') or ARQUIVAR_APOS_MESES)
+    except (TypeError, ValueError):
+        raise ErroTarefa("Parâmetro 'meses' deve ser inteiro.")
+    if meses < 1:
+        raise ErroTarefa("Parâmetro 'meses' deve ser positivo.")
+    return {'operacao': operacao, 'meses': meses}
+
+
+@tipo_tarefa('manutencao', limite=1, validar=_validar_manutencao, interrompivel=False)
+def manter(contexto, operacao, meses):
+    # Uma de cada vez: todas reescrevem tabelas derivadas das movimentações
+    return MANUTENCOES[operacao](meses)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--listar', action='store_true', help='mostra as últimas tarefas')
+    parser.add_argument('--limpar', action='store_true', help='apaga as tarefas terminadas fora da retenção')
+    parser.add_argument('--executar', choices=sorted(TIPOS), metavar='TIPO',
+                        help=f"envia e espera uma tarefa ({', '.join(sorted(TIPOS))})")
+    parser.add_argument('--parametros', type=json.loads, default={}, help='parâmetros da tarefa em JSON')
+    args = parser.parse_args()
+
+    if args.limpar:
+        print(f'{limpar()} tarefa(s) apagada(s).')
+    if args.executar:
+        try:
+            id_tarefa = enviar(args.executar, args.parametros)
+        except ErroTarefa as erro:
+            parser.error(str(erro))
+        estado = aguardar(id_tarefa)
+        tarefa = obter(id_tarefa)
+        print(f'Tarefa {id_tarefa} ({args.executar}): {estado} - {tarefa.mensagem}')
+        if arquivo_pronto(tarefa):
+            print(f'Arquivo: {tarefa.arquivo}')
+    if args.listar or not (args.limpar or args.executar):
+        for tarefa in listar():
+            print(f'{tarefa.id_tarefa:>6} {tarefa.tipo:<12} {tarefa.estado:<10} {tarefa.progresso:>3}%  '
+                  f"{tarefa.criada_em:%Y-%m-%d %H:%M}  {tarefa.mensagem or ''}")
+
+
+if __name__ == '__main__':
+    main()
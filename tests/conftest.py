@@ -0,0 +1,84 @@
+"""Banco SQLite temporário e dados pequenos e determinísticos para os testes.
+
+Uso: python -m pytest
+
+models.py cria as engines na importação, então DATABASE_URL (e CARGA_ESTRITA)
+precisam estar no ambiente antes de qualquer módulo do projeto ser importado.
+"""
+from datetime import date, timedelta
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASTA = tempfile.mkdtemp(prefix='estoque_testes_')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(PASTA, 'testes.db')}"
+os.environ['ARQUIVO_MOVIMENTACOES'] = os.path.join(PASTA, 'testes_arquivo.db')
+os.environ['TAREFAS_PASTA'] = os.path.join(PASTA, 'tarefas')
+os.environ['CARGA_ESTRITA'] = '1'
+os.environ.pop('CACHE_COMPARTILHADO', None)
+sys.path.insert(0, RAIZ)
+
+N_PRODUTOS = 6
+N_FUNCIONARIOS = 4
+N_MOVIMENTACOES = 300
+INICIO_MOVIMENTACOES = date.today().replace(day=1) - timedelta(days=3 * 365)
+
+
+def semear(engine):
+    # Movimentações espalhadas por três anos, com datas fora de ordem de id
+    from sqlalchemy import insert
+    from models import Categoria, Funcionario, Movimentacao, Produto
+
+    aleatorio = random.Random(7)
+    with engine.begin() as conexao:
+        conexao.execute(insert(Categoria), [{'nome_categoria': nome} for nome in ('Eletrônicos', 'Alimentos', 'Livros')])
+        conexao.execute(insert(Funcionario), [
+            {'nome_funcionario': f'Pessoa{i}', 'sobrenome': f'Teste{i}', 'email': f'pessoa{i}@exemplo.com',
+             'cpf': f'{i:011d}', 'telefone': f'1199999{i:04d}', 'data_de_cadastro': '2020-01-01'}
+            for i in range(1, N_FUNCIONARIOS + 1)])
+        conexao.execute(insert(Produto), [
+            {'nome_produto': f'Produto {i}', 'qtd': 1000, 'preco_produto': 2.5 * i, 'id_categoria': i % 3 + 1}
+            for i in range(1, N_PRODUTOS + 1)])
+        conexao.execute(insert(Movimentacao), [
+            {'quantidade_produto': aleatorio.randint(1, 20), 'fornecedor': 'Fornecedor',
+             'status': aleatorio.choice(['1', '0']), 'valor_movimentacao': 10.0,
+             'data_da_movimentacao': INICIO_MOVIMENTACOES + timedelta(days=aleatorio.randint(0, 3 * 365)),
+             'id_funcionario': aleatorio.randint(1, N_FUNCIONARIOS), 'id_produto': aleatorio.randint(1, N_PRODUTOS)}
+            for _ in range(N_MOVIMENTACOES)])
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'altera_banco: muda o banco da sessão de forma irreversível (roda por último)')
+
+
+def pytest_collection_modifyitems(items):
+    # Arquivar não se desfaz: esses testes rodam depois de todos os outros
+    items.sort(key=lambda item: item.get_closest_marker('altera_banco') is not None)
+
+
+@pytest.fixture(scope='session')
+def banco():
+    from models import engine, engine_leitura, init_db
+
+    init_db()
+    semear(engine)
+    yield engine
+    engine.dispose()
+    engine_leitura.dispose()
+    shutil.rmtree(PASTA, ignore_errors=True)
+
+
+@pytest.fixture(scope='session')
+def aplicacao(banco):
+    from app import app
+    return app
+
+
+@pytest.fixture
+def cliente(aplicacao):
+    return aplicacao.test_client()
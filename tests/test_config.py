@@ -0,0 +1,57 @@
+import types
+
+import pytest
+
+import config
+import models
+from contadores import contar
+
+# DBAPI de mentira: a engine de um banco servidor é montada sem conectar
+DBAPI_FALSO = types.SimpleNamespace(paramstyle='pyformat', __version__='1.30.0', Error=Exception)
+
+
+def test_banco_servidor_recebe_o_pool_do_perfil():
+    engine = config.criar_engine('postgresql+pg8000://u:s@localhost/estoque', 'seguro', module=DBAPI_FALSO)
+    assert engine.pool.size() == 5
+    assert engine.pool._max_overflow == 5
+    assert engine.pool._pre_ping is True
+    assert engine.pool._recycle == 900
+
+
+def test_pool_sobrescrito_pelo_ambiente(monkeypatch):
+    monkeypatch.setattr(config, 'DB_POOL_TAMANHO', '3')
+    monkeypatch.setattr(config, 'DB_POOL_EXTRA', '0')
+    engine = config.criar_engine('postgresql+pg8000://u:s@localhost/estoque', 'desempenho', module=DBAPI_FALSO)
+    assert (engine.pool.size(), engine.pool._max_overflow, engine.pool._pre_ping) == (3, 0, True)
+
+
+def test_engine_de_leitura_num_postgres_e_somente_leitura():
+    engine = config.criar_engine('postgresql+pg8000://u:s@localhost/estoque', somente_leitura=True,
+                                 module=DBAPI_FALSO)
+    assert engine.get_execution_options()['postgresql_readonly'] is True
+
+
+@pytest.fixture
+def sem_sqlite(monkeypatch, banco):
+    # Simula um banco servidor: os recursos presos ao SQLite se desligam
+    monkeypatch.setattr(models, 'USA_SQLITE', False)
+
+
+def test_contadores_caem_para_contagem_direta(aplicacao, sem_sqlite):
+    with aplicacao.app_context():
+        assert contar('movimentacoes') == models.db_leitura.query(models.Movimentacao).count()
+        assert contar('estoque_total') == sum(qtd for qtd, in models.db_leitura.query(models.Produto.qtd))
+        models.remover_sessoes()
+
+
+@pytest.mark.parametrize('url', ['/busca?q=Produto', '/api/v1/estoque?data=2023-06-30',
+                                 '/produto/estoque?data=2023-06-30', '/produto/grafico/dados'])
+def test_recursos_do_sqlite_recusam_com_503(cliente, sem_sqlite, url):
+    assert cliente.get(url).status_code == 503
+
+
+def test_paginas_sem_gatilhos_continuam_sem_etag(cliente, sem_sqlite):
+    for url in ['/funcionario', '/movimentacao', '/dashboard']:
+        resposta = cliente.get(url)
+        assert resposta.status_code == 200
+        assert 'ETag' not in resposta.headers
@@ -0,0 +1,48 @@
+import pytest
+from sqlalchemy import event, select
+from sqlalchemy.exc import InvalidRequestError
+
+import app as aplicacao
+from benchmarks.contagem_consultas import ESPERADO
+from models import Movimentacao, Produto, db_leitura, engine, engine_leitura
+
+
+@pytest.fixture
+def comandos(banco):
+    # Conta os comandos SQL enviados pelas duas engines
+    contagem = [0]
+
+    def contar(*args):
+        contagem[0] += 1
+
+    for conexao in (engine, engine_leitura):
+        event.listen(conexao, 'before_cursor_execute', contar)
+    yield contagem
+    for conexao in (engine, engine_leitura):
+        event.remove(conexao, 'before_cursor_execute', contar)
+
+
+@pytest.mark.parametrize('rota', list(ESPERADO))
+@pytest.mark.parametrize('tamanho', [1, 5, 50])
+def test_numero_de_consultas_nao_depende_do_tamanho_da_pagina(cliente, comandos, monkeypatch, rota, tamanho):
+    chave, esperado = ESPERADO[rota]
+    url = rota
+    if chave == 'limite':
+        url += ('&' if '?' in rota else '?') + f'limite={tamanho}'
+    else:
+        monkeypatch.setitem(aplicacao.POR_PAGINA, chave, tamanho)
+    comandos[0] = 0
+    resposta = cliente.get(url)
+    assert resposta.status_code == 200
+    assert comandos[0] == esperado
+
+
+def test_carga_estrita_recusa_relacionamento_sob_demanda(aplicacao):
+    with aplicacao.app_context():
+        movimentacao = db_leitura.execute(select(Movimentacao).limit(1)).scalar_one()
+        with pytest.raises(InvalidRequestError):
+            movimentacao.funcionario
+        produto = db_leitura.execute(select(Produto).limit(1)).scalar_one()
+        with pytest.raises(InvalidRequestError):
+            produto.categoria
+        db_leitura.remove()
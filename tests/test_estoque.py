@@ -0,0 +1,112 @@
+import threading
+
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.orm import sessionmaker
+
+from config import criar_engine
+from estoque import ENTRADA, SAIDA, ajustar_estoque, registrar_movimentacao
+from models import Base, Categoria, Funcionario, Movimentacao, Produto
+
+
+@pytest.fixture
+def Sessao(tmp_path):
+    # Banco próprio por teste: o estoque de cada cenário começa conhecido
+    engine = criar_engine(f"sqlite:///{tmp_path / 'estoque.db'}", 'desempenho', connect_args={'timeout': 60})
+    Base.metadata.create_all(engine)
+    Sessao = sessionmaker(bind=engine)
+    with Sessao.begin() as session:
+        categoria = Categoria(nome_categoria='Teste')
+        session.add(categoria)
+        session.add(Funcionario(nome_funcionario='Teste', sobrenome='Estoque', email='estoque@exemplo.com',
+                                cpf='00000000000'))
+        session.flush()
+        session.add_all([Produto(nome_produto=f'Produto {i}', preco_produto=1.0, qtd=10,
+                                 id_categoria=categoria.id_categoria) for i in range(2)])
+    yield Sessao
+    engine.dispose()
+
+
+def estoque(Sessao, id_produto=1):
+    with Sessao() as session:
+        return session.execute(select(Produto.qtd).where(Produto.id_produto == id_produto)).scalar()
+
+
+def movimentacoes(Sessao):
+    with Sessao() as session:
+        return session.execute(select(func.count()).select_from(Movimentacao)).scalar()
+
+
+def test_saida_ate_zerar_e_recusa_a_seguinte(Sessao):
+    with Sessao.begin() as session:
+        assert ajustar_estoque(session, 1, -10)
+    with Sessao.begin() as session:
+        assert not ajustar_estoque(session, 1, -1)
+    assert estoque(Sessao) == 0
+
+
+def test_saida_conflitante_nao_usa_o_saldo_lido_antes(Sessao):
+    # Duas saídas de 8 que leram o mesmo saldo de 10: só a primeira passa
+    with Sessao() as antes, Sessao() as depois:
+        assert antes.get(Produto, 1).qtd == depois.get(Produto, 1).qtd == 10
+        assert ajustar_estoque(antes, 1, -8)
+        antes.commit()
+        assert not ajustar_estoque(depois, 1, -8)
+        depois.commit()
+    assert estoque(Sessao) == 2
+
+
+def test_movimentacao_recusada_nao_grava_nada(Sessao):
+    with Sessao.begin() as session:
+        erro = registrar_movimentacao(session, 1, 1, 'Teste', 11, SAIDA)
+    assert erro == 'Estoque insuficiente. Disponível: 10.'
+    assert estoque(Sessao) == 10
+    assert movimentacoes(Sessao) == 0
+    with Sessao.begin() as session:
+        assert registrar_movimentacao(session, 1, 99, 'Teste', 1, ENTRADA) == 'Produto não encontrado.'
+
+
+def test_saidas_concorrentes_nunca_deixam_estoque_negativo(Sessao):
+    # 8 threads tentam tirar 1 unidade cada, 5 vezes, do mesmo produto com 10 em estoque
+    aceitas = []
+    barreira = threading.Barrier(8)
+
+    def trabalhador():
+        barreira.wait()
+        for _ in range(5):
+            with Sessao.begin() as session:
+                if registrar_movimentacao(session, 1, 1, 'Teste', 1, SAIDA) is None:
+                    aceitas.append(1)
+
+    threads = [threading.Thread(target=trabalhador) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(aceitas) == 10
+    assert estoque(Sessao) == 0
+    assert movimentacoes(Sessao) == 10
+    assert estoque(Sessao, 2) == 10
+
+
+def test_entradas_e_saidas_concorrentes_batem_com_as_aceitas(Sessao):
+    saldos = []
+
+    def trabalhador(semente):
+        saldo = 0
+        for i in range(30):
+            status, quantidade = (ENTRADA, 3) if (semente + i) % 3 == 0 else (SAIDA, 2)
+            with Sessao.begin() as session:
+                if registrar_movimentacao(session, 1, 2, 'Teste', quantidade, status) is None:
+                    saldo += quantidade if status == ENTRADA else -quantidade
+        saldos.append(saldo)
+
+    threads = [threading.Thread(target=trabalhador, args=(semente,)) for semente in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(saldos) == 6
+    assert estoque(Sessao, 2) == 10 + sum(saldos) >= 0
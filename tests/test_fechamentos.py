@@ -0,0 +1,105 @@
+from contextlib import closing
+from datetime import date, timedelta
+import os
+import sqlite3
+
+import pytest
+from sqlalchemy import delete, select, update
+from sqlalchemy.engine import make_url
+
+import config
+from arquivamento import arquivar, corte_arquivo
+from estoque import ENTRADA, SAIDA, ajustar_estoque, registrar_movimentacao
+from fechamentos import datas_de_verificacao, estoque_em, fechar_periodos
+from models import CAMINHO_ARQUIVO, FechamentoEstoque, Movimentacao, db_session, unidade_de_trabalho
+
+pytestmark = pytest.mark.altera_banco
+
+
+def reproduzir(datas):
+    # Referência independente: estoque atual menos o efeito de cada movimentação posterior à data,
+    # lendo linha a linha o banco principal e o arquivo
+    with closing(sqlite3.connect(make_url(config.DATABASE_URL).database)) as conexao:
+        estoque = dict(conexao.execute('SELECT id_produto, coalesce(qtd, 0) FROM produtos'))
+        linhas = conexao.execute('SELECT id_produto, data_da_movimentacao, status, quantidade_produto '
+                                 'FROM movimentacoes').fetchall()
+    if os.path.exists(CAMINHO_ARQUIVO):
+        with closing(sqlite3.connect(CAMINHO_ARQUIVO)) as conexao:
+            linhas += conexao.execute('SELECT id_produto, data_da_movimentacao, status, quantidade_produto '
+                                      'FROM movimentacoes').fetchall()
+    esperado = {}
+    for data in datas:
+        saldo = dict(estoque)
+        for id_produto, dia, status, quantidade in linhas:
+            if dia > data.isoformat():
+                saldo[id_produto] -= quantidade if status == ENTRADA else -quantidade
+        esperado[data] = saldo
+    return esperado
+
+
+def conferir():
+    datas = datas_de_verificacao(20, semente=3, session=db_session)
+    esperado = reproduzir(datas)
+    for data in datas:
+        assert estoque_em(data, session=db_session) == esperado[data], data
+    db_session.remove()
+
+
+def test_fechamentos_conferem_com_a_reproducao(banco):
+    assert fechar_periodos()
+    assert db_session.execute(select(FechamentoEstoque).limit(1)).first() is not None
+    conferir()
+
+
+def test_insercao_retroativa_num_mes_fechado(banco):
+    # Entra uma movimentação datada de dois anos atrás, como numa importação atrasada
+    with unidade_de_trabalho() as session:
+        assert registrar_movimentacao(session, 1, 1, 'Retroativa', 7, ENTRADA,
+                                      data=date.today() - timedelta(days=730)) is None
+        assert registrar_movimentacao(session, 1, 2, 'Retroativa', 3, SAIDA,
+                                      data=date.today() - timedelta(days=400)) is None
+    conferir()
+
+
+def test_exclusao_e_mudanca_de_data_retroativas(banco):
+    with unidade_de_trabalho() as session:
+        excluida, movida, trocada = session.execute(
+            select(Movimentacao).order_by(Movimentacao.data_da_movimentacao).limit(3)).scalars().all()
+        # Excluir desfaz o efeito da movimentação no estoque atual
+        efeito = excluida.quantidade_produto if excluida.status == ENTRADA else -excluida.quantidade_produto
+        assert ajustar_estoque(session, excluida.id_produto, -efeito)
+        session.execute(delete(Movimentacao).where(Movimentacao.id_movimentacao == excluida.id_movimentacao))
+        # Mudar a data não muda o estoque atual, só o histórico
+        session.execute(update(Movimentacao).where(Movimentacao.id_movimentacao == movida.id_movimentacao)
+                           .values(data_da_movimentacao=date.today() - timedelta(days=100)))
+        # Trocar de produto move o efeito de um para o outro
+        efeito = trocada.quantidade_produto if trocada.status == ENTRADA else -trocada.quantidade_produto
+        outro = trocada.id_produto % 6 + 1
+        assert ajustar_estoque(session, trocada.id_produto, -efeito)
+        assert ajustar_estoque(session, outro, efeito)
+        session.execute(update(Movimentacao).where(Movimentacao.id_movimentacao == trocada.id_movimentacao)
+                           .values(id_produto=outro))
+    conferir()
+
+
+def test_arquivamento_mantem_o_estoque_nas_datas(banco):
+    corte = (date.today() - timedelta(days=540)).replace(day=1)
+    movidas, _ = arquivar(corte, lote=50, vacuum=False, espera=0)
+    assert movidas > 0
+    assert corte_arquivo() == corte
+    assert db_session.execute(select(Movimentacao).where(Movimentacao.data_da_movimentacao < corte)
+                              .limit(1)).first() is None
+    db_session.remove()
+    conferir()
+
+
+def test_alteracoes_retroativas_depois_do_arquivamento(banco):
+    with unidade_de_trabalho() as session:
+        assert registrar_movimentacao(session, 2, 3, 'Retroativa', 5, SAIDA,
+                                      data=date.today() - timedelta(days=200)) is None
+        recente = session.execute(select(Movimentacao).order_by(Movimentacao.data_da_movimentacao)
+                                     .limit(1)).scalar_one()
+        efeito = recente.quantidade_produto if recente.status == ENTRADA else -recente.quantidade_produto
+        assert ajustar_estoque(session, recente.id_produto, -efeito)
+        session.delete(recente)
+    conferir()
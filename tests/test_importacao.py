@@ -0,0 +1,49 @@
+import io
+
+import pytest
+
+from importacao import _validar, importar_movimentacoes
+
+FUNCIONARIOS = {1, 2}
+PRODUTOS = {1, 2, 3}
+LINHA = {'id_funcionario': '1', 'id_produto': '2', 'fornecedor': 'ACME', 'status': 'entrada'}
+
+
+@pytest.mark.parametrize('campos', [
+    {'quantidade_produto': 0},
+    {'quantidade_produto': '0'},
+    {'quantidade': 0},
+    {'quantidade': '0'},
+    {'quantidade_produto': '', 'quantidade': '0'},
+    {'quantidade_produto': '-3'},
+])
+def test_quantidade_zero_ou_negativa_e_recusada_como_tal(campos):
+    movimentacao, motivo = _validar({**LINHA, **campos}, FUNCIONARIOS, PRODUTOS)
+    assert movimentacao is None
+    assert motivo == "Quantidade deve ser maior que zero."
+
+
+@pytest.mark.parametrize('campos, quantidade', [
+    ({'quantidade_produto': '5'}, 5),
+    ({'quantidade': 4}, 4),
+    ({'quantidade_produto': '', 'quantidade': '7'}, 7),
+    ({'quantidade_produto': None, 'quantidade': '2'}, 2),
+    ({'quantidade_produto': '6', 'quantidade': '9'}, 6),
+])
+def test_quantidade_lida_de_um_dos_dois_campos(campos, quantidade):
+    movimentacao, motivo = _validar({**LINHA, **campos}, FUNCIONARIOS, PRODUTOS)
+    assert motivo is None
+    assert movimentacao['quantidade_produto'] == quantidade
+
+
+@pytest.mark.parametrize('campos', [{}, {'quantidade': ''}, {'quantidade_produto': 'dez'}])
+def test_quantidade_ausente_ou_texto_nao_e_inteiro(campos):
+    _, motivo = _validar({**LINHA, **campos}, FUNCIONARIOS, PRODUTOS)
+    assert motivo == "Os campos id_funcionario, id_produto e quantidade devem ser inteiros."
+
+
+def test_importacao_relata_a_quantidade_zero(banco):
+    arquivo = io.StringIO('id_funcionario,id_produto,quantidade,fornecedor,status\n1,1,0,ACME,entrada\n')
+    relatorio = importar_movimentacoes(arquivo)
+    assert relatorio['importadas'] == 0
+    assert relatorio['rejeitadas'] == [(2, "Quantidade deve ser maior que zero.")]
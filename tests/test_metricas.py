@@ -0,0 +1,27 @@
+import pytest
+
+import metricas
+
+ROTAS = ['/metrics', '/metrics/lentas', '/cache/estatisticas']
+
+
+@pytest.mark.parametrize('url', ROTAS)
+def test_desligadas_sem_token(cliente, url):
+    assert cliente.get(url).status_code == 404
+
+
+@pytest.mark.parametrize('url', ROTAS)
+def test_exigem_o_token(cliente, monkeypatch, url):
+    monkeypatch.setattr(metricas, 'METRICAS_TOKEN', 'segredo')
+    assert cliente.get(url).status_code == 401
+    assert cliente.get(url, headers={'Authorization': 'Bearer outro'}).status_code == 401
+    assert cliente.get(url, headers={'Authorization': 'Bearer segredo'}).status_code == 200
+
+
+def test_consultas_lentas_sem_valores_dos_parametros(cliente, monkeypatch):
+    monkeypatch.setattr(metricas, 'METRICAS_TOKEN', 'segredo')
+    monkeypatch.setattr(metricas, 'SQL_LENTA_MS', 0)
+    cliente.get('/funcionario?ordem=nome_asc&apos=' + 'WyJQZXNzb2ExIiwxXQ')  # cursor ["Pessoa1",1]
+    lentas = cliente.get('/metrics/lentas', headers={'Authorization': 'Bearer segredo'}).get_json()
+    assert lentas
+    assert not any('Pessoa1' in lenta['parametros'] for lenta in lentas)
@@ -0,0 +1,53 @@
+from base64 import urlsafe_b64encode
+from datetime import date
+import json
+
+import pytest
+
+from models import Funcionario, Movimentacao
+from paginacao import Ordenacao, codificar_cursor, decodificar_cursor
+
+POR_NOME = Ordenacao(Funcionario.nome_funcionario, Funcionario.id_funcionario, False)
+POR_DATA = Ordenacao(Movimentacao.data_da_movimentacao, Movimentacao.id_movimentacao, False)
+
+
+def cursor_bruto(conteudo):
+    return urlsafe_b64encode(json.dumps(conteudo).encode()).decode().rstrip('=')
+
+
+def test_cursor_ida_e_volta():
+    assert decodificar_cursor(codificar_cursor('Ana', 3), POR_NOME) == ('Ana', 3)
+    assert decodificar_cursor(codificar_cursor(None, 3), POR_NOME) == (None, 3)
+    assert decodificar_cursor(codificar_cursor(date(2024, 2, 29), 7), POR_DATA) == (date(2024, 2, 29), 7)
+
+
+@pytest.mark.parametrize('conteudo', [
+    [[1], 2],             # valor que não é escalar
+    [{'a': 1}, 2],
+    [True, 2],
+    ['Ana', '2'],         # id como texto
+    ['Ana', 2.0],
+    ['Ana', True],
+    ['Ana', None],
+    ['Ana', 2, 3],
+    {'valor': 1, 'id': 2},
+    'Ana',
+])
+def test_cursor_adulterado_e_ignorado(conteudo):
+    assert decodificar_cursor(cursor_bruto(conteudo), POR_NOME) is None
+
+
+def test_cursor_com_data_invalida_e_ignorado():
+    assert decodificar_cursor(cursor_bruto(['ontem', 2]), POR_DATA) is None
+    assert decodificar_cursor(cursor_bruto([20240101, 2]), POR_DATA) is None
+    assert decodificar_cursor('%%%', POR_DATA) is None
+
+
+@pytest.mark.parametrize('url', [
+    '/movimentacao?ordem=nome_asc&apos=W1sxXSwyXQ',
+    '/movimentacao?ordem=data_desc&antes=' + cursor_bruto(['2024-13-40', 1]),
+    '/funcionario?ordem=nome_asc&apos=' + cursor_bruto(['Ana', '1; DROP']),
+    '/produto?apos=' + cursor_bruto([None, [1]]),
+])
+def test_rotas_ignoram_cursor_malformado(cliente, url):
+    assert cliente.get(url).status_code == 200
@@ -1,18 +1,10 @@
 from models import Funcionario, Categoria, Produto, Movimentacao, db_session
 from sqlalchemy import func
+from resumos import resumo_mensal
 
 def produtos_por_mes_ano():
-    resultados = (
-        db_session.query(
-            func.strftime('%Y-%m', Movimentacao.data_da_movimentacao).label('mes_ano'),
-            func.sum(Movimentacao.quantidade_produto).label('total_produtos')
-        )
-        .group_by('mes_ano')
-        .having(func.sum(Movimentacao.quantidade_produto) > 0)  # Adiciona a cláusula HAVING
-        .order_by('mes_ano')
-        .all()
-    )
-    return resultados
+    # Lê o resumo mensal mantido por gatilhos, sem agrupar a tabela de movimentações
+    return resumo_mensal('mes')
 
 
 def inserir_funcionario():
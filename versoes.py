@@ -0,0 +1,51 @@
+import os
+import time
+
+from flask import g, has_request_context
+from sqlalchemy import select, update
+from models import VersaoTabela, db_leitura, engine, engine_leitura, usa_sqlite
+
+# Versão dos dados de cada tabela, guardada no próprio banco (versoes_tabelas) e
+# incrementada por gatilhos a cada escrita, venha ela de qualquer worker, da linha
+# de comando ou do populate_db. Mudar a versão invalida tudo que foi gerado a partir da tabela.
+INICIO = time.time()
+ID_PROCESSO = '{:x}{:x}'.format(os.getpid(), int(INICIO))
+
+
+def _ler_versoes():
+    # Uma consulta para todas as tabelas; na requisição ela entra na mesma transação de
+    # leitura que a view usa, então versão e dados vêm do mesmo instante do banco
+    consulta = select(VersaoTabela.tabela, VersaoTabela.numero, VersaoTabela.alterado_em)
+    if not has_request_context():
+        with engine_leitura.connect() as conexao:
+            return {tabela: (numero, alterado_em) for tabela, numero, alterado_em in conexao.execute(consulta)}
+    if 'versoes_dados' not in g:
+        g.versoes_dados = {tabela: (numero, alterado_em)
+                           for tabela, numero, alterado_em in db_leitura.execute(consulta)}
+    return g.versoes_dados
+
+
+def versao(tabela):
+    # (número, instante da última alteração); None sem os gatilhos do SQLite, que mantêm as versões
+    if not usa_sqlite():
+        return None
+    return _ler_versoes().get(tabela, (0, INICIO))
+
+
+def assinatura(*tabelas):
+    # Chave de versão de algo que depende de várias tabelas; None quando não há versões
+    if not tabelas:
+        return ()
+    if not usa_sqlite():
+        return None
+    versoes = _ler_versoes()
+    return tuple(versoes.get(tabela, (0, INICIO))[0] for tabela in tabelas)
+
+
+def registrar_alteracao(*tabelas):
+    # Para mudanças que os gatilhos não veem, como a reconstrução dos resumos e contadores
+    if not usa_sqlite():
+        return
+    with engine.begin() as conexao:
+        conexao.execute(update(VersaoTabela).where(VersaoTabela.tabela.in_(tabelas))
+                        .values(numero=VersaoTabela.numero + 1, alterado_em=time.time()))